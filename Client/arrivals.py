@@ -0,0 +1,75 @@
+import math
+import random
+
+# Open-loop arrival schedules. Each yields the intended send times of a run as offsets in seconds
+# from its start; the load engine sends on those times whether or not earlier requests have returned
+# and measures latency from them, so a stalled system shows up as latency instead of a slower schedule.
+
+def constant_rate(rate, duration):
+    """Evenly spaced sends at `rate` per second"""
+    for i in range(int(rate * duration)):
+        yield i / rate
+
+def poisson(rate, duration, rng=None):
+    """Sends with exponentially distributed gaps averaging `rate` per second"""
+    rng = rng or random.Random()
+    offset = rng.expovariate(rate)
+    while offset < duration:
+        yield offset
+        offset += rng.expovariate(rate)
+
+def step(stages, arrival=constant_rate):
+    """Piecewise-constant load: `stages` is a list of (duration, rate) run back to back"""
+    start = 0.0
+    for duration, rate in stages:
+        if rate > 0:
+            for offset in arrival(rate, duration):
+                yield start + offset
+        start += duration
+
+def ramp(start_rate, end_rate, duration):
+    """Rate changing linearly from start_rate to end_rate over duration.
+
+    The n-th send is at the time t where the expected count start_rate*t + slope*t^2/2 reaches n.
+    """
+    slope = (end_rate - start_rate) / duration
+    total = (start_rate + end_rate) / 2 * duration
+    for n in range(int(total)):
+        if slope == 0:
+            yield n / start_rate
+        else:
+            yield (-start_rate + math.sqrt(start_rate * start_rate + 2 * slope * n)) / slope
+
+def parse_schedule(spec, rng=None):
+    """Build a schedule from a spec string:
+
+    constant:RATE:SECONDS, poisson:RATE:SECONDS, ramp:FROM:TO:SECONDS, or
+    step:RATExSECONDS,RATExSECONDS,... (for example step:50x10,200x10,50x10)
+    """
+    kind, _, args = spec.partition(':')
+    try:
+        if kind == 'constant':
+            rate, duration = map(float, args.split(':'))
+            return constant_rate(rate, duration)
+        if kind == 'poisson':
+            rate, duration = map(float, args.split(':'))
+            return poisson(rate, duration, rng)
+        if kind == 'ramp':
+            start_rate, end_rate, duration = map(float, args.split(':'))
+            return ramp(start_rate, end_rate, duration)
+        if kind == 'step':
+            stages = []
+            for stage in args.split(','):
+                rate, duration = map(float, stage.split('x'))
+                stages.append((duration, rate))
+            return step(stages)
+    except ValueError:
+        pass
+    raise ValueError(f"Invalid arrival schedule: {spec!r}")
+
+def peak_rate(spec):
+    """Highest rate, in requests per second, of a schedule spec accepted by parse_schedule"""
+    kind, _, args = spec.partition(':')
+    if kind == 'step':
+        return max(float(stage.split('x')[0]) for stage in args.split(','))
+    return max(float(value) for value in args.split(':')[:-1])
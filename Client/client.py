@@ -1,112 +1,59 @@
 import requests
 import time
-import threading
+import asyncio
 import random
-import statistics
-from datetime import datetime
-from collections import defaultdict
 import string
 import json
+import os
+import sys
+import array
+# wire_format and request_tracing live in the repo's shared/ directory (copied beside this file in Docker)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'shared'))
+import wire_format
+import arrivals
+import workload_trace
+import results
+import request_tracing
+from reporter import IntervalReporter, RequestLog
+from load_engine import LoadEngine
+from performance_metrics import PerformanceMetrics, LatencyHistogram
 
 # Configuration
-SINGLE_SERVER_URL = "http://server1:5000/request"
-LOAD_BALANCER_URL = "http://loadbalancer:5000/request"
-SET_ALGO_URL = "http://loadbalancer:5000/set_algorithm"
+SINGLE_SERVER = os.environ.get('SINGLE_SERVER', 'http://server1:5000')
+LOAD_BALANCER = os.environ.get('LOAD_BALANCER', 'http://loadbalancer:5000')
+SINGLE_SERVER_URL = f"{SINGLE_SERVER}/request"
+LOAD_BALANCER_URL = f"{LOAD_BALANCER}/request"
+SET_ALGO_URL = f"{LOAD_BALANCER}/set_algorithm"
+ANALYTICS_URL = f"{SINGLE_SERVER}/analytics"
+WIRE_FORMAT = os.environ.get('WIRE_FORMAT', 'json')  # Request/response body format: json or msgpack
+WIRE_CONTENT_TYPE = wire_format.MSGPACK_TYPE if WIRE_FORMAT == 'msgpack' else wire_format.JSON_TYPE
+MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', 10000))  # Concurrent requests the load engine keeps open
+# Load model for every phase. By default each phase sends its request count at a fixed open-loop interval.
+ARRIVALS = os.environ.get('ARRIVALS')  # Open-loop schedule instead, e.g. poisson:50:30 or step:20x10,80x10 (see arrivals.py)
+VIRTUAL_USERS = int(os.environ.get('VIRTUAL_USERS', 0))  # Closed loop instead: this many users for PHASE_DURATION
+THINK_TIME = float(os.environ.get('THINK_TIME', 1.0))  # Mean seconds a virtual user waits between requests
+PHASE_DURATION = float(os.environ.get('PHASE_DURATION', 30))
+RECORD_TRACE = os.environ.get('RECORD_TRACE')  # Write every task sent, with its send offset, to this JSONL trace (replaced on each run)
+REPLAY_TRACE = os.environ.get('REPLAY_TRACE')  # Reissue the tasks in this trace instead of generating new ones
+REPLAY_SPEED = float(os.environ.get('REPLAY_SPEED', 1.0))  # Replay time scale: 2 sends the trace twice as fast
+RESULTS_JSON = os.environ.get('RESULTS_JSON')  # Write per-phase results and run metadata here (compare with results.py)
+RESULTS_CSV = os.environ.get('RESULTS_CSV')  # Write one summary row per phase here
+REPORT_INTERVAL = float(os.environ.get('REPORT_INTERVAL', 2.0))  # Seconds between live progress lines
+REQUEST_LOG = os.environ.get('REQUEST_LOG')  # Opt-in per-request JSONL debug log, written off the send path
+# SPAN_FILE (read by request_tracing) collects every tier's spans; the per-hop breakdown is printed either way
+phase_results = []
+recorded_phases = set()  # Workloads already captured this run; repeats under other algorithms are not recorded
+TYPED_ARRAYS = os.environ.get('TYPED_ARRAYS', '0') == '1'  # Send sort_large_list numbers as packed int64 buffers
+CLIENT_ID = os.environ.get('CLIENT_ID')  # Identity the load balancer rate-limits and fair-shares by (default: source address)
 
-class PerformanceMetrics:
-    """Track and analyze request performance metrics"""
-    def __init__(self):
-        self.response_times = []
-        self.failed_requests = []  # Store failed request details
-        self.total_requests = 0
-        self.server_distribution = defaultdict(list)  # Store response times per server
-        self.task_distribution = defaultdict(list)    # Store response times per task type
-        self.start_time = None
-        self.end_time = None
-        self.error_distribution = defaultdict(int)    # Count different types of errors
-
-    def record_request(self, server, task_type, response_time=None, error=None):
-        """Record metrics for a single request"""
-        if not self.start_time:
-            self.start_time = datetime.now()
-        
-        self.total_requests += 1
-        
-        if response_time is not None:
-            self.response_times.append(response_time)
-            self.server_distribution[server].append(response_time)
-            self.task_distribution[task_type].append(response_time)
-        else:
-            self.failed_requests.append({
-                'server': server,
-                'task_type': task_type,
-                'error': error
-            })
-            self.error_distribution[str(error)] += 1
-            
-        self.end_time = datetime.now()
-
-    def get_server_stats(self, server):
-        """Calculate statistics for a specific server"""
-        times = self.server_distribution[server]
-        if not times:
-            return None
-        return {
-            'count': len(times),
-            'avg': statistics.mean(times),
-            'min': min(times),
-            'max': max(times),
-            'std': statistics.stdev(times) if len(times) > 1 else 0
-        }
-
-    def print_summary(self, phase_name):
-        """Print comprehensive performance summary"""
-        print(f"\n{'='*20} {phase_name} Summary {'='*20}")
-        duration = (self.end_time - self.start_time).total_seconds()
-        print(f"Total Duration: {duration:.2f}s")
-        print(f"Requests per second: {self.total_requests/duration:.1f}")
-
-        print(f"\nRequest Statistics:")
-        print(f"  Total Requests: {self.total_requests}")
-        print(f"  Successful: {len(self.response_times)}")
-        print(f"  Failed: {len(self.failed_requests)}")
-        success_rate = (len(self.response_times)/self.total_requests*100)
-        print(f"  Success Rate: {success_rate:.1f}%")
-
-        if self.response_times:
-            print(f"\nResponse Time Statistics:")
-            print(f"  Average: {statistics.mean(self.response_times):.2f}s")
-            print(f"  Median: {statistics.median(self.response_times):.2f}s")
-            print(f"  Min: {min(self.response_times):.2f}s")
-            print(f"  Max: {max(self.response_times):.2f}s")
-            if len(self.response_times) > 1:
-                print(f"  Std Dev: {statistics.stdev(self.response_times):.2f}s")
-
-        if self.server_distribution:
-            print(f"\nServer Distribution and Performance:")
-            total_successful = len(self.response_times)
-            for server in sorted(self.server_distribution.keys()):
-                stats = self.get_server_stats(server)
-                request_count = len(self.server_distribution[server])
-                percentage = (request_count/total_successful*100)
-                print(f"  {server}:")
-                print(f"    Requests: {request_count} ({percentage:.1f}%)")
-                print(f"    Avg Response: {stats['avg']:.2f}s")
-                print(f"    Min/Max: {stats['min']:.2f}s / {stats['max']:.2f}s")
-
-        if self.task_distribution:
-            print(f"\nTask Type Performance:")
-            for task_type, times in sorted(self.task_distribution.items()):
-                print(f"  {task_type:15s}: {len(times):3d} requests, "
-                      f"avg={statistics.mean(times):.2f}s, "
-                      f"max={max(times):.2f}s")
-
-        if self.error_distribution:
-            print(f"\nError Distribution:")
-            for error, count in self.error_distribution.items():
-                print(f"  {error}: {count} occurrences")
-
-        print("=" * 60)
+def numbers_payload(numbers):
+    """Numbers for sort_large_list, packed as a little-endian int64 buffer when TYPED_ARRAYS is set"""
+    if not TYPED_ARRAYS:
+        return numbers
+    values = array.array('q', numbers)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return {"dtype": "int64", "data": values.tobytes()}
 
 def generate_basic_task():
     """Generate a random basic computation task"""
@@ -140,7 +87,7 @@ def generate_basic_task():
         }] * 15),
         *([{
             "task_type": "sort_large_list",
-            "numbers": [random.randint(1, 1000) for _ in range(100)]
+            "numbers": numbers_payload([random.randint(1, 1000) for _ in range(100)])
         }] * 15)
     ]
     return random.choice(tasks)
@@ -192,76 +139,143 @@ def generate_db_task():
     ]
     return random.choice(tasks)
 
-def send_request(url, metrics, task_id, task_type="basic", batch_start_time=None):
-    """Send a single request and record metrics"""
+def make_task(task_type="basic"):
+    """Generate a task for a test phase's workload type"""
     if task_type == "basic":
-        task = generate_basic_task()
+        return generate_basic_task()
     elif task_type == "database":
-        task = generate_db_task()
+        return generate_db_task()
+    # Mix of both types
+    return generate_db_task() if random.random() < 0.4 else generate_basic_task()
+
+def report_result(metrics, reporter, request_log, phase_name, task_id, task, status_code, payload,
+                  response_time, error, service_time=None, trace=(None, None)):
+    """Record one request's outcome in the phase metrics, the live reporter and the optional request log.
+
+    trace is the (request ID, span totals) the load engine's tracer reported for the request.
+    """
+    server = None
+    request_id, spans = trace
+    if error is None and status_code == 200:
+        server = payload.get('server', 'unknown')
+        metrics.record_request(server, task['task_type'], response_time, service_time=service_time)
+        if spans:
+            metrics.record_spans(spans)
+        reporter.observe(server, response_time)
     else:
-        # Mix of both types
-        task = generate_db_task() if random.random() < 0.4 else generate_basic_task()
-    
-    start_time = time.time()
+        if error is None:
+            error = "Server Overloaded" if status_code == 503 else f"Status {status_code}"
+        metrics.record_request(None, task['task_type'], None, error)
+        reporter.observe(None, None)
     
-    try:
-        response = requests.post(url, json=task, timeout=30)
-        end_time = time.time()
-        response_time = end_time - start_time
-        
-        if response.status_code == 200:
-            server = response.json().get('server', 'unknown')
-            load = response.json().get('load', 'N/A')
-            processing_time = response.json().get('processing_time', 'N/A')
-            
-            # Calculate queue time (time spent waiting before processing)
-            queue_time = response_time - (processing_time if isinstance(processing_time, (int, float)) else 0)
-            
-            print(f"Request {task_id:3d} | {task['task_type']:15s} | "
-                  f"Server: {server:15s} | Load: {load:2} | "
-                  f"Time: {response_time:.2f}s (Queue: {queue_time:.2f}s)")
-            
-            metrics.record_request(server, task['task_type'], response_time)
-        else:
-            error_msg = f"Status {response.status_code}"
-            if response.status_code == 503:
-                error_msg = "Server Overloaded"
-            print(f"Request {task_id:3d} | {task['task_type']:15s} | Failed: {error_msg}")
-            metrics.record_request(None, task['task_type'], None, error_msg)
-            
-    except Exception as e:
-        print(f"Request {task_id:3d} | {task['task_type']:15s} | Error: {str(e)}")
-        metrics.record_request(None, task['task_type'], None, str(e))
+    if request_log:
+        request_log.log({
+            "phase": phase_name,
+            "task_id": task_id,
+            "request_id": request_id,
+            "task_type": task['task_type'],
+            "status": status_code,
+            "server": server,
+            "load": payload.get('load') if payload else None,
+            "latency": response_time,
+            "service_time": service_time,
+            "spans": spans,     # Seconds per hop; see request_tracing.py
+            "error": error if server is None else None,
+            "time": time.time()
+        })
+
+def run_test_phase(url, num_requests, phase_name, task_type="basic", delay_between_requests=0.1, workload=None):
+    """Run a test phase with the specified number of requests.
 
-def run_test_phase(url, num_requests, phase_name, task_type="basic", delay_between_requests=0.1):
-    """Run a test phase with the specified number of requests"""
+    `workload` names the phase's entries in a recorded or replayed trace (default: phase_name);
+    phases that should see the same requests, like one workload under different algorithms, share it.
+    """
     metrics = PerformanceMetrics()
+    workload = workload or phase_name
+    recorder = None
+    if RECORD_TRACE and workload not in recorded_phases:
+        recorder = workload_trace.TraceRecorder(RECORD_TRACE, workload, append=bool(recorded_phases))
+        recorded_phases.add(workload)
     
     print(f"\n{'='*20} {phase_name} {'='*20}")
-    print(f"Starting {num_requests} requests ({task_type} tasks)...")
-    print("\nRequest ID | Task Type       | Server          | Load | Time (Queue)")
-    print("-" * 75)
+    if REPLAY_TRACE:
+        print(f"Replaying {workload} from {REPLAY_TRACE} at {REPLAY_SPEED:g}x speed...")
+    elif VIRTUAL_USERS:
+        print(f"Running {VIRTUAL_USERS} virtual users for {PHASE_DURATION:.0f}s "
+              f"({THINK_TIME:.1f}s mean think time, {task_type} tasks)...")
+    elif ARRIVALS:
+        print(f"Sending on the {ARRIVALS} arrival schedule ({task_type} tasks)...")
+    else:
+        print(f"Starting {num_requests} requests ({task_type} tasks)...")
+    request_log = RequestLog(REQUEST_LOG) if REQUEST_LOG else None
+    traces = {}  # task_id -> (request ID, span totals), from the engine's tracer to the task's report_result
+
+    def trace_result(task_id, request_id, spans):
+        traces[task_id] = (request_id, spans)
     
-    # Create and start threads
-    threads = []
-    batch_start_time = time.time()
+    async def send_phase(engine, next_task, on_result):
+        if REPLAY_TRACE:
+            trace = workload_trace.read_trace(REPLAY_TRACE, workload, REPLAY_SPEED)
+            await engine.run_timed(url, trace, on_result)
+        elif VIRTUAL_USERS:
+            await engine.run_closed_loop(url, VIRTUAL_USERS, PHASE_DURATION, next_task, on_result, THINK_TIME)
+        elif ARRIVALS:
+            await engine.run_open_loop(url, arrivals.parse_schedule(ARRIVALS), next_task, on_result)
+        else:
+            await engine.run(url, num_requests, next_task, on_result, delay_between_requests)
     
-    for i in range(num_requests):
-        thread = threading.Thread(
-            target=send_request,
-            args=(url, metrics, i+1, task_type, batch_start_time)
-        )
-        threads.append(thread)
-        thread.start()
-        time.sleep(delay_between_requests)
+    async def run_phase():
+        async with LoadEngine(WIRE_CONTENT_TYPE, CLIENT_ID, MAX_IN_FLIGHT, recorder=recorder,
+                              tracer=trace_result) as engine:
+            reporter = IntervalReporter(REPORT_INTERVAL, lambda: engine.in_flight)
+            next_task = lambda: make_task(task_type)
+            on_result = lambda task_id, *result: report_result(metrics, reporter, request_log, phase_name, task_id,
+                                                               *result, trace=traces.pop(task_id, (None, None)))
+            reporter.start()
+            try:
+                await send_phase(engine, next_task, on_result)
+            finally:
+                await reporter.stop()
     
-    # Wait for all threads to complete
-    for thread in threads:
-        thread.join()
-        
+    try:
+        asyncio.run(run_phase())
+    finally:
+        if recorder:
+            recorder.close()
+        if request_log:
+            request_log.close()
+        if request_tracing.span_writer:
+            request_tracing.span_writer.flush()
     metrics.print_summary(phase_name)
+    phase_results.append(results.phase_result(phase_name, url, metrics))
     return metrics
 
+def print_run_analytics(since):
+    """Print server-side throughput, error rates and processing_time percentiles for the run"""
+    try:
+        response = requests.get(ANALYTICS_URL, params={"since": since}, timeout=30)
+        report = response.json()
+    except Exception as e:
+        print(f"Could not fetch analytics: {str(e)}")
+        return
+    if response.status_code != 200:
+        print(f"Could not fetch analytics: {report.get('error', response.status_code)}")
+        return
+
+    def fmt(value):
+        return f"{value:.2f}s" if isinstance(value, (int, float)) else "N/A"
+
+    source = report['source']
+    if report.get('fallback_reason'):
+        source = f"{source}, {report['requested_source']} unavailable"
+    print(f"\n=== Server-Side Analytics ({source}, {report['window']['seconds']:.0f}s window) ===")
+    print(f"{'Group':22s} | {'Requests':>8s} | {'Req/s':>6s} | {'Errors':>6s} | {'p50':>7s} | {'p95':>7s} | {'p99':>7s}")
+    print("-" * 80)
+    for section in ("servers", "tasks"):
+        for name, stats in sorted(report[section].items()):
+            print(f"{str(name):22s} | {stats['count']:8d} | {stats['throughput']:6.1f} | "
+                  f"{stats['error_rate']*100:5.1f}% | {fmt(stats['p50']):>7s} | {fmt(stats['p95']):>7s} | {fmt(stats['p99']):>7s}")
+
 def main():
     """Main test execution function"""
     # Test configuration
@@ -269,6 +283,10 @@ def main():
     NUM_REQUESTS_DB = 50      # Database tasks (more complex)
     DELAY_BETWEEN = 0.05     # Small delay to increase server stress
     
+    if ARRIVALS:
+        arrivals.parse_schedule(ARRIVALS)  # Fail before any phase runs if the schedule is malformed
+    run_started = time.time()
+
     print("\n=== Enhanced Load Balancing Demonstration with Database ===")
     print("This test will demonstrate the effectiveness of different load balancing strategies")
     print("with both basic computation tasks and database operations.")
@@ -327,7 +345,8 @@ def main():
             NUM_REQUESTS_BASIC + NUM_REQUESTS_DB, 
             f"Load Balanced ({algorithm}) - Mixed Tasks",
             "mixed",
-            DELAY_BETWEEN
+            DELAY_BETWEEN,
+            workload="Load Balanced - Mixed Tasks"
         )
         time.sleep(5)  # Cool down between algorithms
     
@@ -337,14 +356,17 @@ def main():
     print("-" * 90)
     
     def get_stats(metrics):
-        if not metrics or not metrics.response_times:
-            return "N/A", "N/A", "N/A", "N/A", "N/A"
+        snapshot = metrics.merged() if metrics else None
+        if not snapshot or not snapshot.latency.count:
+            return "N/A", "N/A", "N/A", "N/A", "N/A", "N/A"
+        latency = snapshot.latency
         return (
-            f"{(len(metrics.response_times)/metrics.total_requests*100):.1f}%",
-            f"{statistics.mean(metrics.response_times):.2f}s",
-            f"{min(metrics.response_times):.2f}s",
-            f"{max(metrics.response_times):.2f}s",
-            f"{len(metrics.failed_requests)}"
+            f"{(latency.count/snapshot.total_requests*100):.1f}%",
+            f"{latency.mean():.2f}s",
+            f"{latency.min:.2f}s",
+            f"{latency.max:.2f}s",
+            f"{snapshot.failed}",
+            f"{latency.percentile(0.99):.2f}s"
         )
     
     single_basic_stats = get_stats(single_basic_metrics)
@@ -357,6 +379,7 @@ def main():
     print(f"Avg Response    | {single_basic_stats[1]:13s} | {single_db_stats[1]:11s} | {rr_stats[1]:11s} | {sh_stats[1]:11s} | {ll_stats[1]:11s}")
     print(f"Min Response    | {single_basic_stats[2]:13s} | {single_db_stats[2]:11s} | {rr_stats[2]:11s} | {sh_stats[2]:11s} | {ll_stats[2]:11s}")
     print(f"Max Response    | {single_basic_stats[3]:13s} | {single_db_stats[3]:11s} | {rr_stats[3]:11s} | {sh_stats[3]:11s} | {ll_stats[3]:11s}")
+    print(f"p99 Response    | {single_basic_stats[5]:13s} | {single_db_stats[5]:11s} | {rr_stats[5]:11s} | {sh_stats[5]:11s} | {ll_stats[5]:11s}")
     print(f"Failed Requests | {single_basic_stats[4]:13s} | {single_db_stats[4]:11s} | {rr_stats[4]:11s} | {sh_stats[4]:11s} | {ll_stats[4]:11s}")
     
     print("\n=== Database Task Performance Comparison ===")
@@ -364,19 +387,19 @@ def main():
     
     # Extract database task performance from metrics
     def get_db_task_stats(metrics):
-        db_tasks = []
-        for task, times in metrics.task_distribution.items():
+        db_tasks = LatencyHistogram()
+        for task, histogram in metrics.merged().tasks.items():
             if task.startswith('db_'):
-                db_tasks.extend(times)
+                db_tasks.merge(histogram)
         
-        if not db_tasks:
+        if not db_tasks.count:
             return "N/A", "N/A", "N/A"
         
         return (
-            f"{len(db_tasks)}",
-            f"{statistics.mean(db_tasks):.2f}s" if db_tasks else "N/A",
-            f"{min(db_tasks):.2f}s" if db_tasks else "N/A",
-            f"{max(db_tasks):.2f}s" if db_tasks else "N/A"
+            f"{db_tasks.count}",
+            f"{db_tasks.mean():.2f}s",
+            f"{db_tasks.min:.2f}s",
+            f"{db_tasks.max:.2f}s"
         )
     
     # Only analyze db tasks if they exist in the metrics
@@ -394,8 +417,16 @@ def main():
         print(f"Min Response   | {single_db_task_stats[2]:13s} | {rr_db_task_stats[2]:11s} | {sh_db_task_stats[2]:11s} | {ll_db_task_stats[2]:11s}")
         print(f"Max Response   | {single_db_task_stats[3]:13s} | {rr_db_task_stats[3]:11s} | {sh_db_task_stats[3]:11s} | {ll_db_task_stats[3]:11s}")
 
+    print_run_analytics(run_started)
+
+    if RESULTS_JSON:
+        results.write_json(RESULTS_JSON, phase_results)
+        print(f"\nResults written to {RESULTS_JSON}")
+    if RESULTS_CSV:
+        results.write_csv(RESULTS_CSV, phase_results)
+        print(f"Results written to {RESULTS_CSV}")
+
     print("\n=== Test Complete ===")
-    print("Use MongoDB Compass to analyze request distribution and performance data stored in the database")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import ipaddress
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from multiprocessing.connection import Listener, Client, wait
+import requests
+import arrivals
+import client
+import results
+import workload_trace
+from load_engine import LoadEngine
+from performance_metrics import PerformanceMetrics, MetricsShard
+
+# Distributed load generation. A coordinator listens on a control port; workers (local processes it
+# spawns, plus any started on other hosts with `distributed.py worker --coordinator HOST:PORT`) connect,
+# all receive the same schedule and a shared start time, and each sends every Nth request of it. Workers
+# stream per-interval histograms back; the coordinator merges them into a live line per interval and a
+# final report. Histograms share one bucket layout, so merged percentiles are as exact as a single
+# process's. Hosts need synchronized clocks (NTP) for the shared start time to line up. Each worker sends
+# its own client ID (<--client-id>-<worker>) so the load balancer's per-client limits, when enabled,
+# apply to each worker's share rather than to the whole run.
+# Control messages are pickled, so anyone who can connect with the authkey can run code on the
+# coordinator: it listens on loopback unless DISTRIBUTED_AUTHKEY is set to a secret.
+#   python distributed.py coordinator --workers 4 --arrivals poisson:2000:60
+DISTRIBUTED_AUTHKEY = os.environ.get('DISTRIBUTED_AUTHKEY')
+AUTHKEY = (DISTRIBUTED_AUTHKEY or 'loadbalancer').encode()     # The default only serves loopback coordinators
+DEFAULT_PORT = 7100
+START_DELAY = 2.0           # Seconds between sending the start message and the shared start time
+
+def send_requests(config, worker_index, workers):
+    """Every `workers`-th (offset, task) of the run, starting at worker_index"""
+    if config.get("replay"):
+        timed = workload_trace.read_trace(config["replay"], config.get("workload"), config.get("speed", 1.0))
+    else:
+        schedule = arrivals.parse_schedule(config["arrivals"], random.Random(config["seed"]))
+        timed = ((offset, None) for offset in schedule)
+    for index, (offset, task) in enumerate(timed):
+        if index % workers == worker_index:
+            yield offset, task or client.make_task(config["mix"])
+
+async def run_worker_load(connection, config, worker_index, workers, start_at):
+    """Send this worker's slice and stream interval metrics to the coordinator"""
+    interval = config["interval"]
+    current = [PerformanceMetrics()]
+
+    def on_result(task_id, task, status_code, payload, response_time, error, service_time):
+        if error is None and status_code == 200:
+            current[0].record_request(payload.get('server', 'unknown'), task['task_type'], response_time,
+                                      service_time=service_time)
+        else:
+            current[0].record_request(None, task['task_type'], None, error or f"Status {status_code}")
+
+    def flush(message_type, index, engine):
+        metrics, current[0] = current[0], PerformanceMetrics()
+        connection.send({"type": message_type, "worker": worker_index, "interval": index,
+                         "in_flight": engine.in_flight, "metrics": metrics.to_dict()})
+
+    client_id = f"{config['client_id']}-{worker_index}"
+    async with LoadEngine(client.WIRE_CONTENT_TYPE, client_id, client.MAX_IN_FLIGHT) as engine:
+        async def stream():
+            index = 0
+            while True:
+                await asyncio.sleep(max(0.0, start_at + (index + 1) * interval - time.time()))
+                flush("interval", index, engine)
+                index += 1
+
+        await asyncio.sleep(max(0.0, start_at - time.time()))
+        streamer = asyncio.ensure_future(stream())
+        await engine.run_timed(config["url"], send_requests(config, worker_index, workers), on_result)
+        streamer.cancel()
+        flush("done", None, engine)
+
+def run_worker(address):
+    host, _, port = address.rpartition(':')
+    connection = Client((host, int(port)), authkey=AUTHKEY)
+    connection.send({"type": "hello", "host": socket.gethostname(), "pid": os.getpid()})
+    message = connection.recv()
+    asyncio.run(run_worker_load(connection, message["config"], message["worker"], message["workers"],
+                                message["start_at"]))
+    connection.close()
+
+def warn_if_rate_limited(url, rate_per_worker):
+    """Warn when each worker would offer more than the load balancer's per-client rate limit"""
+    try:
+        admission = requests.get(f"{url.rsplit('/request', 1)[0]}/stats", timeout=5).json()["admission"]
+    except (requests.RequestException, ValueError, KeyError, TypeError):
+        return      # Not a load balancer, or one without admission stats
+    limit = admission.get("client_rate_limit")
+    if limit and rate_per_worker > limit:
+        print(f"Warning: each worker offers up to {rate_per_worker:g} req/s but the load balancer limits a client "
+              f"to {limit:g} req/s; excess requests will be answered with 429. Add workers or lower the rate.")
+
+def metrics_from(message):
+    return PerformanceMetrics.from_dict(message["metrics"])
+
+def print_interval(index, interval, reports):
+    """One live line for an interval, merged across the workers that reported it"""
+    merged = MetricsShard()
+    for report in reports:
+        merged.merge(metrics_from(report).merged())
+    latency = merged.latency
+    success = latency.count / merged.total_requests * 100 if merged.total_requests else 0.0
+    in_flight = sum(report["in_flight"] for report in reports)
+    print(f"[{(index + 1) * interval:6.1f}s] {merged.total_requests / interval:8.1f} req/s | ok {success:5.1f}% | "
+          f"p50 {latency.percentile(0.5):.3f}s p99 {latency.percentile(0.99):.3f}s | "
+          f"in-flight {in_flight:6d} | workers {len(reports)}", flush=True)
+
+def coordinate(listener, workers, config):
+    """Wait for the workers, start them together and merge what they report"""
+    connections = []
+    print(f"Waiting for {workers} workers on port {listener.address[1]}...")
+    while len(connections) < workers:
+        connection = listener.accept()
+        hello = connection.recv()
+        print(f"Worker {len(connections) + 1}/{workers} connected: {hello['host']} (pid {hello['pid']})")
+        connections.append(connection)
+
+    start_at = time.time() + START_DELAY
+    for index, connection in enumerate(connections):
+        connection.send({"type": "start", "config": config, "worker": index, "workers": workers, "start_at": start_at})
+
+    total = PerformanceMetrics()
+    pending_intervals = {}
+    active = set(connections)
+    while active:
+        for connection in wait(list(active)):
+            try:
+                message = connection.recv()
+            except EOFError:
+                print("A worker disconnected before finishing")
+                active.discard(connection)
+                continue
+            total.merge(metrics_from(message))
+            if message["type"] == "done":
+                active.discard(connection)
+                continue
+            reports = pending_intervals.setdefault(message["interval"], [])
+            reports.append(message)
+            if len(reports) >= len(active):
+                print_interval(message["interval"], config["interval"], pending_intervals.pop(message["interval"]))
+    # Intervals some workers never reached because they finished first
+    for index in sorted(pending_intervals):
+        print_interval(index, config["interval"], pending_intervals[index])
+    return total
+
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback if host else False
+    except (OSError, ValueError):
+        return False
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate load from several processes or hosts")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    coordinator = subcommands.add_parser('coordinator', help="Run a load test across workers")
+    coordinator.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Local worker processes")
+    coordinator.add_argument('--remote-workers', type=int, default=0, help="Workers expected from other hosts")
+    coordinator.add_argument('--listen', default=f"127.0.0.1:{DEFAULT_PORT}",
+                             help="Control channel address; other interfaces require DISTRIBUTED_AUTHKEY")
+    coordinator.add_argument('--url', default=client.LOAD_BALANCER_URL, help="Target /request URL")
+    coordinator.add_argument('--algorithm', help="Set this load balancing algorithm first")
+    coordinator.add_argument('--arrivals', default="poisson:200:30", help="Total arrival schedule (see arrivals.py)")
+    coordinator.add_argument('--replay', help="Replay this trace instead; it must exist at the same path on every host")
+    coordinator.add_argument('--workload', help="Trace workload (phase) to replay")
+    coordinator.add_argument('--speed', type=float, default=1.0, help="Replay time scale")
+    coordinator.add_argument('--mix', default="mixed", help="Generated workload: basic, database or mixed")
+    coordinator.add_argument('--interval', type=float, default=client.REPORT_INTERVAL, help="Seconds per live line")
+    coordinator.add_argument('--client-id', default=client.CLIENT_ID or "distributed",
+                             help="Client ID prefix; worker N sends <prefix>-N")
+    coordinator.add_argument('--results-json', help="Write the merged result here")
+    worker = subcommands.add_parser('worker', help="Connect to a coordinator and generate its share of load")
+    worker.add_argument('--coordinator', required=True, help="Coordinator HOST:PORT")
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        run_worker(args.coordinator)
+        return
+
+    workers = args.workers + args.remote_workers
+    host, _, port = args.listen.rpartition(':')
+    if not is_loopback(host):
+        if DISTRIBUTED_AUTHKEY is None:
+            parser.error(f"--listen {args.listen} is reachable from other hosts; set DISTRIBUTED_AUTHKEY to a secret")
+    elif args.remote_workers:
+        parser.error("remote workers cannot reach a loopback --listen address")
+    if args.replay is None:
+        arrivals.parse_schedule(args.arrivals)      # Fail here rather than in every worker
+        warn_if_rate_limited(args.url, arrivals.peak_rate(args.arrivals) / workers)
+    if args.algorithm:
+        requests.post(client.SET_ALGO_URL, json={"algorithm": args.algorithm}, timeout=10).raise_for_status()
+
+    listener = Listener((host, int(port)), authkey=AUTHKEY)
+    local_address = f"127.0.0.1:{listener.address[1]}"
+    processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__), 'worker', '--coordinator', local_address])
+                 for _ in range(args.workers)]
+    config = {"url": args.url, "arrivals": args.arrivals, "seed": random.randrange(1 << 32), "mix": args.mix,
+              "replay": args.replay, "workload": args.workload, "speed": args.speed, "interval": args.interval,
+              "client_id": args.client_id}
+    try:
+        total = coordinate(listener, workers, config)
+    finally:
+        listener.close()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    phase_name = f"Distributed ({workers} workers)"
+    total.print_summary(phase_name)
+    if args.results_json:
+        results.write_json(args.results_json, [results.phase_result(phase_name, args.url, total)])
+
+if __name__ == "__main__":
+    main()
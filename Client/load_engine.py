@@ -0,0 +1,162 @@
+import asyncio
+import itertools
+import os
+import random
+import sys
+import time
+import aiohttp
+# wire_format and request_tracing live in the repo's shared/ directory (copied beside this file in Docker)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'shared'))
+import wire_format
+import request_tracing
+
+try:
+    import resource
+except ImportError:         # Not available on Windows
+    resource = None
+
+# Async load generation: one event loop drives every request over a pooled keep-alive session,
+# so the number of requests in flight is bounded by MAX_IN_FLIGHT rather than by threads or sockets.
+MAX_IN_FLIGHT = 10000       # Concurrent requests allowed before new sends wait for a free slot
+REQUEST_TIMEOUT = 30        # Seconds per request
+KEEPALIVE_TIMEOUT = 30      # Seconds an idle pooled connection is kept open
+
+def raise_open_file_limit():
+    """Lift the soft open-file limit to the hard limit; each in-flight request holds a socket"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+class LoadEngine:
+    """Sends tasks from one event loop over a shared connection pool.
+
+    Results go to an on_result(task_id, task, status_code, payload, response_time, error, service_time)
+    callback, called on the event loop thread, so metrics objects need no locking. In open-loop runs
+    response_time is measured from the intended send time (correcting for coordinated omission) and
+    service_time from when the request actually went out; in closed-loop runs the two are equal.
+    With a recorder (workload_trace.TraceRecorder), every task sent is captured with its offset.
+    Every request carries a new request ID; with a tracer, each response's span totals (the client's
+    own, every hop's from Server-Timing and the network time between them) are passed to
+    tracer(task_id, request_id, spans) just before on_result.
+    """
+    def __init__(self, content_type=wire_format.JSON_TYPE, client_id=None,
+                 max_in_flight=MAX_IN_FLIGHT, timeout=REQUEST_TIMEOUT, recorder=None, tracer=None):
+        self.content_type = content_type
+        self.recorder = recorder
+        self.tracer = tracer
+        self.client_id = client_id
+        self.max_in_flight = max_in_flight
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.session = None
+        self.slots = None
+        self.in_flight = 0          # Requests sent and awaiting a response
+
+    async def __aenter__(self):
+        raise_open_file_limit()
+        # The in-flight bound is enforced by self.slots, so the pool itself is unlimited
+        connector = aiohttp.TCPConnector(limit=0, keepalive_timeout=KEEPALIVE_TIMEOUT)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        self.slots = asyncio.Semaphore(self.max_in_flight)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def post_task(self, url, task, request_id=None):
+        """POST a task in the configured wire format; returns (status code, decoded body, Server-Timing spans)"""
+        body, headers = wire_format.encode_request(task, self.content_type)
+        if self.client_id:
+            headers['X-Client-ID'] = self.client_id
+        if request_id:
+            headers[request_tracing.REQUEST_ID_HEADER] = request_id
+        async with self.session.post(url, data=body, headers=headers) as response:
+            content = await response.read()
+            try:
+                payload = wire_format.loads(content, response.headers.get('Content-Type'))
+            except ValueError:
+                payload = None
+            timing = request_tracing.parse_server_timing(response.headers.get(request_tracing.TIMING_HEADER))
+            return response.status, payload or {}, timing
+
+    async def send(self, url, task_id, task, on_result, intended_time=None):
+        """Send one task once a slot is free and report its outcome"""
+        async with self.slots:
+            trace = request_tracing.RequestTrace(None, 'client')
+            start_time = trace.started
+            intended_time = intended_time or start_time
+            trace.add('client.wait', intended_time, start_time - intended_time)     # Behind the send schedule
+            self.in_flight += 1
+            try:
+                status_code, payload, timing = await self.post_task(url, task, trace.request_id)
+            except Exception as e:
+                trace.finish()
+                on_result(task_id, task, None, None, None, str(e) or type(e).__name__, None)
+                return
+            finally:
+                self.in_flight -= 1
+            trace.finish()
+            end_time = time.time()
+            if self.tracer:
+                spans = {**trace.totals(), **timing}
+                self.tracer(task_id, trace.request_id, {**spans, **request_tracing.network_spans(spans)})
+            on_result(task_id, task, status_code, payload, end_time - intended_time, None, end_time - start_time)
+
+    async def run_timed(self, url, timed_tasks, on_result):
+        """Send each (offset, task) at its intended time, offsets in seconds, and wait for all of them.
+
+        Sends are timed against the run's start, not the previous send, so a slow response or a
+        busy event loop never pushes the schedule back; a late send still counts its latency from
+        the time it should have gone out. timed_tasks is consumed lazily, so it can stream.
+        """
+        pending = set()
+        run_start = time.time()
+        for i, (offset, task) in enumerate(timed_tasks):
+            intended_time = run_start + offset
+            wait = intended_time - time.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            elif i % 100 == 99:
+                await asyncio.sleep(0)      # Let responses be processed while catching up
+            if self.recorder:
+                self.recorder.record(offset, task)
+            send = asyncio.ensure_future(self.send(url, i + 1, task, on_result, intended_time))
+            pending.add(send)
+            send.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+
+    async def run_open_loop(self, url, schedule, make_task, on_result):
+        """Send a new task at each intended time in schedule"""
+        await self.run_timed(url, ((offset, make_task()) for offset in schedule), on_result)
+
+    async def run(self, url, num_requests, make_task, on_result, delay_between_requests=0.0):
+        """Send num_requests tasks, delay_between_requests apart on an open-loop schedule"""
+        schedule = (i * delay_between_requests for i in range(num_requests))
+        await self.run_open_loop(url, schedule, make_task, on_result)
+
+    async def run_closed_loop(self, url, users, duration, make_task, on_result, think_time=0.0):
+        """Simulate `users` virtual users for `duration` seconds.
+
+        Each user sends a task, waits for the response, then pauses for an exponentially distributed
+        think time averaging think_time seconds before the next one, so offered load falls as the
+        system slows down.
+        """
+        run_start = time.time()
+        deadline = run_start + duration
+        task_ids = itertools.count(1)
+
+        async def user():
+            while time.time() < deadline:
+                task = make_task()
+                if self.recorder:
+                    self.recorder.record(time.time() - run_start, task)
+                await self.send(url, next(task_ids), task, on_result)
+                if think_time > 0:
+                    await asyncio.sleep(random.expovariate(1 / think_time))
+
+        await asyncio.gather(*(user() for _ in range(users)))
@@ -1,36 +1,318 @@
-class PerformanceMetrics:
+import array
+import math
+import threading
+import time
+from collections import defaultdict
+
+# Latencies are recorded in log-bucketed histograms (in the style of HdrHistogram): values are stored
+# as whole microseconds, exact below 2^SUB_BUCKET_BITS and otherwise in one of 2^(SUB_BUCKET_BITS-1)
+# linear sub-buckets per power of two, so every percentile is within 1/2^(SUB_BUCKET_BITS-1) of the true
+# value and a histogram's memory is fixed however many requests it records.
+SUB_BUCKET_BITS = 8                     # 128 sub-buckets per power of two: under 0.8% relative error
+MAX_TRACKABLE_US = 3600 * 1000000       # Values above an hour are clamped
+BUCKET_COUNT = ((MAX_TRACKABLE_US.bit_length() - SUB_BUCKET_BITS + 1) << (SUB_BUCKET_BITS - 1)) + (1 << SUB_BUCKET_BITS)
+MAX_ERROR_KINDS = 50                    # Distinct error messages counted separately; the rest go under "other"
+SUMMARY_PERCENTILES = (0.50, 0.90, 0.99, 0.999)
+# Request tracing spans in the order the latency breakdown lists them (see request_tracing.py)
+SPAN_ORDER = ('client.request', 'client.wait', 'client.network', 'lb.request', 'lb.admission', 'lb.select',
+              'lb.health_probe', 'lb.load_probe', 'lb.upstream', 'lb.network', 'server.request', 'server.fault',
+              'server.queue', 'server.delay', 'server.task', 'server.db', 'server.log')
+
+def bucket_index(value_us):
+    shift = max(0, value_us.bit_length() - SUB_BUCKET_BITS)
+    if shift == 0:
+        return value_us
+    return (shift << (SUB_BUCKET_BITS - 1)) + (value_us >> shift)
+
+def bucket_value(index):
+    """Midpoint, in microseconds, of the values that fall in a bucket"""
+    if index < (1 << SUB_BUCKET_BITS):
+        return index
+    shift = (index >> (SUB_BUCKET_BITS - 1)) - 1
+    mantissa = index - (shift << (SUB_BUCKET_BITS - 1))
+    return (mantissa << shift) + ((1 << shift) >> 1)
+
+class LatencyHistogram:
+    """Fixed-memory latency histogram; record() takes seconds, statistics are returned in seconds"""
+    def __init__(self):
+        self.counts = array.array('q', bytes(8 * BUCKET_COUNT))
+        self.count = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, seconds):
+        value_us = min(MAX_TRACKABLE_US, max(0, int(seconds * 1000000)))
+        self.counts[bucket_index(value_us)] += 1
+        self.count += 1
+        self.total += seconds
+        self.total_squares += seconds * seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """Add another histogram's recordings into this one"""
+        if other.count == 0:
+            return self
+        counts = self.counts
+        for index, count in enumerate(other.counts):
+            if count:
+                counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.total_squares += other.total_squares
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def stdev(self):
+        """Sample standard deviation"""
+        if self.count < 2:
+            return 0.0
+        variance = (self.total_squares - self.total * self.total / self.count) / (self.count - 1)
+        return math.sqrt(max(0.0, variance))
+
+    def percentile(self, fraction):
+        """Nearest-rank percentile, clamped to the exact min and max"""
+        if self.count == 0:
+            return 0.0
+        rank = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.max, max(self.min, bucket_value(index) / 1000000))
+        return self.max
+
+    def to_dict(self):
+        """JSON-friendly form, with only the non-empty buckets"""
+        return {
+            "counts": {str(index): count for index, count in enumerate(self.counts) if count},
+            "count": self.count,
+            "total": self.total,
+            "total_squares": self.total_squares,
+            "min": self.min if self.count else None,
+            "max": self.max
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        for index, count in data["counts"].items():
+            histogram.counts[int(index)] = count
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.total_squares = data["total_squares"]
+        histogram.min = data["min"] if data["min"] is not None else math.inf
+        histogram.max = data["max"]
+        return histogram
+
+class MetricsShard:
+    """One recorder's share of a PerformanceMetrics; only ever written by a single thread"""
     def __init__(self):
-        self.response_times = []
-        self.failed_requests = 0
         self.total_requests = 0
-        
-    def record_request(self, start_time, end_time=None):
-        self.total_requests += 1
-        if end_time:
-            self.response_times.append(end_time - start_time)
+        self.failed = 0
+        self.latency = LatencyHistogram()       # From the intended send time in open-loop runs
+        self.service = LatencyHistogram()       # From the actual send time
+        self.servers = defaultdict(LatencyHistogram)
+        self.tasks = defaultdict(LatencyHistogram)
+        self.errors = defaultdict(int)
+        self.spans = defaultdict(LatencyHistogram)     # Per-hop time of traced successful requests
+        self.start_time = None
+        self.end_time = None
+
+    def merge(self, other):
+        self.total_requests += other.total_requests
+        self.failed += other.failed
+        self.latency.merge(other.latency)
+        self.service.merge(other.service)
+        for server, histogram in list(other.servers.items()):
+            self.servers[server].merge(histogram)
+        for task_type, histogram in list(other.tasks.items()):
+            self.tasks[task_type].merge(histogram)
+        for error, count in list(other.errors.items()):
+            self.errors[error] += count
+        for name, histogram in list(other.spans.items()):
+            self.spans[name].merge(histogram)
+        if other.start_time is not None:
+            self.start_time = min(filter(None, (self.start_time, other.start_time)))
+            self.end_time = max(filter(None, (self.end_time, other.end_time)))
+        return self
+
+class PerformanceMetrics:
+    """Track and analyze request performance metrics.
+
+    Each recording thread writes to its own shard without taking a lock; reads merge the shards.
+    Metrics from other threads or processes are combined with merge(), or shipped between
+    processes with to_dict()/from_dict().
+    """
+    def __init__(self):
+        self.shards = []
+        self.shards_lock = threading.Lock()
+        self.local = threading.local()
+        self.merged_in = None       # Shard that merge() folds other metrics into
+
+    def shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = MetricsShard()
+            with self.shards_lock:
+                self.shards.append(shard)
+        return shard
+
+    def record_request(self, server, task_type, response_time=None, error=None, service_time=None):
+        """Record metrics for a single request"""
+        shard = self.shard()
+        now = time.time()
+        if shard.start_time is None:
+            shard.start_time = now
+        shard.end_time = now
+        shard.total_requests += 1
+
+        if response_time is not None:
+            shard.latency.record(response_time)
+            shard.service.record(service_time if service_time is not None else response_time)
+            shard.servers[server].record(response_time)
+            shard.tasks[task_type].record(response_time)
         else:
-            self.failed_requests += 1
-            
+            shard.failed += 1
+            error = str(error)
+            if error not in shard.errors and len(shard.errors) >= MAX_ERROR_KINDS:
+                error = "other"
+            shard.errors[error] += 1
+
+    def record_spans(self, spans):
+        """Record one request's span totals, in seconds by span name"""
+        shard = self.shard()
+        for name, seconds in spans.items():
+            shard.spans[name].record(seconds)
+
+    def merged(self):
+        """All shards combined into one snapshot"""
+        snapshot = MetricsShard()
+        with self.shards_lock:
+            shards = list(self.shards)
+        for shard in shards:
+            snapshot.merge(shard)
+        return snapshot
+
+    def merge(self, other):
+        """Fold another PerformanceMetrics (from another thread, process or phase) into this one"""
+        snapshot = other.merged()
+        with self.shards_lock:
+            if self.merged_in is None:
+                self.merged_in = MetricsShard()
+                self.shards.append(self.merged_in)
+            self.merged_in.merge(snapshot)
+        return self
+
+    @property
+    def total_requests(self):
+        return self.merged().total_requests
+
+    def to_dict(self):
+        snapshot = self.merged()
+        return {
+            "total_requests": snapshot.total_requests,
+            "failed": snapshot.failed,
+            "start_time": snapshot.start_time,
+            "end_time": snapshot.end_time,
+            "latency": snapshot.latency.to_dict(),
+            "service": snapshot.service.to_dict(),
+            "servers": {str(server): histogram.to_dict() for server, histogram in snapshot.servers.items()},
+            "tasks": {task_type: histogram.to_dict() for task_type, histogram in snapshot.tasks.items()},
+            "errors": dict(snapshot.errors),
+            "spans": {name: histogram.to_dict() for name, histogram in snapshot.spans.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        metrics = cls()
+        shard = metrics.shard()
+        shard.total_requests = data["total_requests"]
+        shard.failed = data["failed"]
+        shard.start_time = data["start_time"]
+        shard.end_time = data["end_time"]
+        shard.latency = LatencyHistogram.from_dict(data["latency"])
+        shard.service = LatencyHistogram.from_dict(data["service"])
+        for server, histogram in data["servers"].items():
+            shard.servers[server] = LatencyHistogram.from_dict(histogram)
+        for task_type, histogram in data["tasks"].items():
+            shard.tasks[task_type] = LatencyHistogram.from_dict(histogram)
+        shard.errors.update(data["errors"])
+        for name, histogram in data.get("spans", {}).items():
+            shard.spans[name] = LatencyHistogram.from_dict(histogram)
+        return metrics
+
     def print_summary(self, phase_name):
-        print(f"\n{'-'*20} {phase_name} Summary {'-'*20}")
-        
-        if self.total_requests == 0:
+        """Print comprehensive performance summary"""
+        snapshot = self.merged()
+        latency = snapshot.latency
+        print(f"\n{'='*20} {phase_name} Summary {'='*20}")
+        if snapshot.total_requests == 0:
             print("No requests recorded")
+            print("=" * 60)
             return
-            
-        if self.response_times:
-            avg_response = sum(self.response_times) / len(self.response_times)
-            min_response = min(self.response_times)
-            max_response = max(self.response_times)
-            success_rate = (len(self.response_times) / self.total_requests) * 100
-            
-            print(f"Total Requests: {self.total_requests}")
-            print(f"Successful Requests: {len(self.response_times)}")
-            print(f"Failed Requests: {self.failed_requests}")
-            print(f"Success Rate: {success_rate:.1f}%")
-            print(f"Average Response Time: {avg_response:.2f}s")
-            print(f"Minimum Response Time: {min_response:.2f}s")
-            print(f"Maximum Response Time: {max_response:.2f}s")
-        else:
-            print("No successful requests recorded")
-        print("-" * 60)
\ No newline at end of file
+        duration = max(snapshot.end_time - snapshot.start_time, 1e-9)
+        print(f"Total Duration: {duration:.2f}s")
+        print(f"Requests per second: {snapshot.total_requests/duration:.1f}")
+
+        print(f"\nRequest Statistics:")
+        print(f"  Total Requests: {snapshot.total_requests}")
+        print(f"  Successful: {latency.count}")
+        print(f"  Failed: {snapshot.failed}")
+        print(f"  Success Rate: {latency.count/snapshot.total_requests*100:.1f}%")
+
+        if latency.count:
+            print(f"\nResponse Time Statistics:")
+            print(f"  Average: {latency.mean():.3f}s")
+            for fraction in SUMMARY_PERCENTILES:
+                print(f"  p{fraction*100:g}: {latency.percentile(fraction):.3f}s")
+            print(f"  Min: {latency.min:.3f}s")
+            print(f"  Max: {latency.max:.3f}s")
+            print(f"  Std Dev: {latency.stdev():.3f}s")
+            # Open-loop latency includes time a request spent waiting to be sent; service time does not
+            print(f"  Service time (from actual send): p50 {snapshot.service.percentile(0.5):.3f}s, "
+                  f"p99 {snapshot.service.percentile(0.99):.3f}s")
+
+        if snapshot.servers:
+            print(f"\nServer Distribution and Performance:")
+            for server in sorted(snapshot.servers, key=str):
+                histogram = snapshot.servers[server]
+                print(f"  {server}:")
+                print(f"    Requests: {histogram.count} ({histogram.count/latency.count*100:.1f}%)")
+                print(f"    Avg Response: {histogram.mean():.3f}s")
+                print(f"    p50/p99/Max: {histogram.percentile(0.5):.3f}s / {histogram.percentile(0.99):.3f}s"
+                      f" / {histogram.max:.3f}s")
+
+        if snapshot.tasks:
+            print(f"\nTask Type Performance:")
+            for task_type, histogram in sorted(snapshot.tasks.items()):
+                print(f"  {task_type:15s}: {histogram.count:3d} requests, "
+                      f"avg={histogram.mean():.3f}s, "
+                      f"p99={histogram.percentile(0.99):.3f}s, "
+                      f"max={histogram.max:.3f}s")
+
+        if snapshot.spans:
+            total = snapshot.spans.get('client.request')
+            print(f"\nLatency Breakdown (traced requests):")
+            names = [name for name in SPAN_ORDER if name in snapshot.spans]
+            names += sorted(name for name in snapshot.spans if name not in SPAN_ORDER)
+            for name in names:
+                histogram = snapshot.spans[name]
+                share = f"{histogram.total / total.total * 100:5.1f}%" if total and total.total else "    -"
+                print(f"  {name:16s}: avg={histogram.mean():.3f}s, p50={histogram.percentile(0.5):.3f}s, "
+                      f"p99={histogram.percentile(0.99):.3f}s, {share} of request time")
+
+        if snapshot.errors:
+            print(f"\nError Distribution:")
+            for error, count in snapshot.errors.items():
+                print(f"  {error}: {count} occurrences")
+
+        print("=" * 60)
@@ -0,0 +1,95 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+from collections import defaultdict
+from performance_metrics import LatencyHistogram
+
+# Live progress for load runs. IntervalReporter prints one compact line per interval instead of one
+# per request; RequestLog is the opt-in per-request record, written off the event loop by a thread.
+REPORT_INTERVAL = 2.0       # Seconds between progress lines
+
+class IntervalReporter:
+    """Aggregates results on the event loop and prints a summary of each interval.
+
+    A line shows the interval's request rate, success rate, p50/p99 latency and per-server share,
+    plus the requests currently in flight.
+    """
+    def __init__(self, interval=REPORT_INTERVAL, in_flight=None):
+        self.interval = interval
+        self.in_flight = in_flight or (lambda: 0)
+        self.task = None
+        self.run_start = None
+        self.reset()
+
+    def reset(self):
+        self.interval_start = time.time()
+        self.latency = LatencyHistogram()
+        self.total = 0
+        self.failed = 0
+        self.servers = defaultdict(int)
+
+    def observe(self, server, response_time):
+        """Count one result; response_time is None for a failed request"""
+        self.total += 1
+        if response_time is None:
+            self.failed += 1
+        else:
+            self.latency.record(response_time)
+            self.servers[server] += 1
+
+    def line(self):
+        now = time.time()
+        seconds = max(now - self.interval_start, 1e-9)
+        success = (self.total - self.failed) / self.total * 100 if self.total else 0.0
+        shares = " ".join(f"{server} {count / self.latency.count * 100:.0f}%"
+                          for server, count in sorted(self.servers.items(), key=lambda item: str(item[0])))
+        return (f"[{now - self.run_start:6.1f}s] {self.total / seconds:7.1f} req/s | ok {success:5.1f}% | "
+                f"p50 {self.latency.percentile(0.5):.3f}s p99 {self.latency.percentile(0.99):.3f}s | "
+                f"in-flight {self.in_flight():5d} | {shares}")
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            print(self.line(), flush=True)
+            self.reset()
+
+    def start(self):
+        """Start reporting from the running event loop"""
+        self.run_start = time.time()
+        self.reset()
+        self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        """Stop reporting, printing the last partial interval unless it is too short for a meaningful rate"""
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        if self.total and time.time() - self.interval_start >= self.interval / 4:
+            print(self.line(), flush=True)
+
+class RequestLog:
+    """Per-request debug log, one JSON object per line, written by a background thread"""
+    def __init__(self, path):
+        self.entries = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.write_entries, args=(path,), daemon=True)
+        self.thread.start()
+
+    def log(self, entry):
+        self.entries.put(entry)
+
+    def write_entries(self, path):
+        with open(path, 'a', encoding='utf-8') as f:
+            while True:
+                entry = self.entries.get()
+                if entry is None:
+                    break
+                f.write(json.dumps(entry, default=str) + "\n")
+
+    def close(self):
+        """Flush the remaining entries and stop the writer"""
+        self.entries.put(None)
+        self.thread.join()
@@ -0,0 +1,176 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+
+# Benchmark results: one record per test phase, written as JSON (full detail) or CSV (one row per phase),
+# and a compare command that checks a run against a stored baseline:
+#   python results.py compare baseline.json current.json --max-throughput-drop 0.05 --max-latency-increase 0.10
+# A baseline phase missing from the current run counts as a regression.
+LATENCY_PERCENTILES = {"p50": 0.50, "p90": 0.90, "p99": 0.99, "p999": 0.999}
+DEFAULT_MAX_THROUGHPUT_DROP = 0.05      # Fail when throughput falls by more than this fraction
+DEFAULT_MAX_LATENCY_INCREASE = 0.10     # Fail when a gated percentile rises by more than this fraction
+DEFAULT_MAX_SUCCESS_DROP = 0.01         # Fail when the success rate falls by more than this fraction
+DEFAULT_GATED_PERCENTILES = ("p99",)
+CONFIG_VARIABLES = ('WIRE_FORMAT', 'TYPED_ARRAYS', 'MAX_IN_FLIGHT', 'ARRIVALS', 'VIRTUAL_USERS', 'THINK_TIME',
+                    'PHASE_DURATION', 'REPLAY_TRACE', 'REPLAY_SPEED', 'CLIENT_ID', 'LOAD_BALANCER', 'SINGLE_SERVER')
+CSV_COLUMNS = ("phase", "url", "duration", "total_requests", "successful", "failed", "success_rate",
+               "request_rate", "throughput", "mean", *LATENCY_PERCENTILES, "max", "service_p50", "service_p99")
+
+def histogram_summary(histogram):
+    summary = {"count": histogram.count, "mean": histogram.mean(), "min": histogram.min if histogram.count else None,
+               "max": histogram.max, "stdev": histogram.stdev()}
+    for name, fraction in LATENCY_PERCENTILES.items():
+        summary[name] = histogram.percentile(fraction)
+    return summary
+
+def phase_result(phase_name, url, metrics):
+    """Structured result of one test phase"""
+    snapshot = metrics.merged()
+    latency = snapshot.latency
+    duration = (snapshot.end_time - snapshot.start_time) if snapshot.total_requests else 0.0
+    return {
+        "phase": phase_name,
+        "url": url,
+        "duration": duration,
+        "total_requests": snapshot.total_requests,
+        "successful": latency.count,
+        "failed": snapshot.failed,
+        "success_rate": latency.count / snapshot.total_requests if snapshot.total_requests else 0.0,
+        "request_rate": snapshot.total_requests / duration if duration > 0 else 0.0,
+        "throughput": latency.count / duration if duration > 0 else 0.0,     # Successful requests per second
+        "latency": histogram_summary(latency),
+        "service_time": histogram_summary(snapshot.service),
+        "errors": dict(snapshot.errors),
+        "servers": {
+            str(server): {**histogram_summary(histogram), "share": histogram.count / latency.count}
+            for server, histogram in snapshot.servers.items()
+        },
+        "tasks": {task_type: histogram_summary(histogram) for task_type, histogram in snapshot.tasks.items()},
+        "spans": {name: histogram_summary(histogram) for name, histogram in snapshot.spans.items()}
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, timeout=5,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def environment_metadata():
+    """Where and how the run was made, so results from different setups aren't compared blindly"""
+    return {
+        "timestamp": time.time(),
+        "hostname": socket.gethostname(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "git_commit": git_commit(),
+        "config": {name: os.environ[name] for name in CONFIG_VARIABLES if name in os.environ}
+    }
+
+def write_json(path, phases):
+    with open(path, 'w') as f:
+        json.dump({"environment": environment_metadata(), "phases": phases}, f, indent=2)
+
+def write_csv(path, phases):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_COLUMNS)
+        for phase in phases:
+            latency = phase["latency"]
+            writer.writerow([
+                phase["phase"], phase["url"], phase["duration"], phase["total_requests"], phase["successful"],
+                phase["failed"], phase["success_rate"], phase["request_rate"], phase["throughput"],
+                latency["mean"], *(latency[name] for name in LATENCY_PERCENTILES), latency["max"],
+                phase["service_time"]["p50"], phase["service_time"]["p99"]
+            ])
+
+def compare(baseline, current, max_throughput_drop=DEFAULT_MAX_THROUGHPUT_DROP,
+            max_latency_increase=DEFAULT_MAX_LATENCY_INCREASE, gated_percentiles=DEFAULT_GATED_PERCENTILES,
+            max_success_drop=DEFAULT_MAX_SUCCESS_DROP):
+    """Compare each baseline phase with the same phase of the current run; returns (rows, regressions)
+    where rows are (phase, metric, baseline value, current value, relative change, regressed).
+
+    A phase missing from the current run gives a regressed "missing" row with no values, and a
+    metric that has a baseline value but none now (e.g. no successful requests) regresses too.
+    """
+    current_phases = {phase["phase"]: phase for phase in current["phases"]}
+    rows, regressions = [], []
+    for before in baseline["phases"]:
+        phase = current_phases.get(before["phase"])
+        if phase is None:
+            rows.append((before["phase"], "missing", None, None, None, True))
+            regressions.append(rows[-1])
+            continue
+        checks = [("throughput", before["throughput"], phase["throughput"], -max_throughput_drop),
+                  ("success", before["success_rate"], phase["success_rate"], -max_success_drop)]
+        checks += [(name, before["latency"][name], phase["latency"][name], max_latency_increase)
+                   for name in gated_percentiles]
+        for metric, old, new, limit in checks:
+            if old is None or new is None:
+                change, regressed = None, old is not None
+            else:
+                change = (new - old) / old if old else 0.0
+                regressed = change < limit if limit < 0 else change > limit
+            rows.append((phase["phase"], metric, old, new, change, regressed))
+            if regressed:
+                regressions.append(rows[-1])
+    return rows, regressions
+
+def print_comparison(rows):
+    print(f"{'Phase':45s} | {'Metric':10s} | {'Baseline':>10s} | {'Current':>10s} | {'Change':>8s}")
+    print("-" * 95)
+    for phase, metric, old, new, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        if metric == "missing":
+            print(f"{phase[:45]:45s} | not in the current run{flag}")
+            continue
+        old = f"{old:10.3f}" if old is not None else f"{'-':>10s}"
+        new = f"{new:10.3f}" if new is not None else f"{'-':>10s}"
+        change = f"{change:+7.1%}" if change is not None else f"{'-':>8s}"
+        print(f"{phase[:45]:45s} | {metric:10s} | {old} | {new} | {change}{flag}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare benchmark results against a baseline")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    compare_parser = subcommands.add_parser('compare', help="Fail if a run regressed against a baseline")
+    compare_parser.add_argument('baseline', help="Baseline results JSON")
+    compare_parser.add_argument('current', help="Results JSON of the run to check")
+    compare_parser.add_argument('--max-throughput-drop', type=float, default=DEFAULT_MAX_THROUGHPUT_DROP,
+                                help="Allowed fractional throughput decrease (default 0.05)")
+    compare_parser.add_argument('--max-latency-increase', type=float, default=DEFAULT_MAX_LATENCY_INCREASE,
+                                help="Allowed fractional increase of each gated percentile (default 0.10)")
+    compare_parser.add_argument('--max-success-drop', type=float, default=DEFAULT_MAX_SUCCESS_DROP,
+                                help="Allowed fractional decrease of the success rate (default 0.01)")
+    compare_parser.add_argument('--percentiles', default=",".join(DEFAULT_GATED_PERCENTILES),
+                                help=f"Comma-separated percentiles to gate on, from {', '.join(LATENCY_PERCENTILES)}")
+    args = parser.parse_args()
+
+    percentiles = tuple(name.strip() for name in args.percentiles.split(',') if name.strip())
+    unknown = [name for name in percentiles if name not in LATENCY_PERCENTILES]
+    if unknown:
+        parser.error(f"unknown percentiles: {', '.join(unknown)}")
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    rows, regressions = compare(baseline, current, args.max_throughput_drop, args.max_latency_increase, percentiles,
+                                args.max_success_drop)
+    if not rows:
+        print("The baseline has no phases")
+        sys.exit(2)
+    print_comparison(rows)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond the configured thresholds")
+        sys.exit(1)
+    print("\nNo regressions")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import re
+import time
+from collections import defaultdict
+import requests
+import arrivals
+import client
+import results
+from load_engine import LoadEngine
+from performance_metrics import LatencyHistogram
+from reporter import IntervalReporter
+from sweep import set_algorithm, registered_backends
+
+# Fault-injection scenarios: for each algorithm, offer an open-loop Poisson load through the load
+# balancer while a timeline of faults is injected into backends through their /admin/faults endpoint.
+# Every request is attributed to the bucket of its intended send time, and each fault is reported with
+# its time to detect (the load balancer marks the backend unhealthy), time to reroute (errors back to
+# the baseline and the backend's share of responses cut), time to recover after it is cleared, the
+# requests lost while it was active and the latency spike against the pre-fault baseline.
+#   python scenarios.py --event 30:server3:latency=2 --event 60:server3:clear --duration 90
+# Events are AT:TARGET:FAULTS. TARGET is a backend URL or server name (server3, Server-3) and FAULTS a
+# comma-separated list of latency=SECONDS, errors=RATE, hang, duration=SECONDS, or one of crash, clear.
+DEFAULT_DURATION = 90.0
+DEFAULT_RATE = 20.0
+DEFAULT_COOLDOWN = 10.0     # Idle seconds between algorithms so queues drain
+BUCKET_SECONDS = 1.0        # Resolution of the timeline the timings are measured on
+POLL_INTERVAL = 0.25        # Seconds between polls of the load balancer's view of its backends
+STABLE_BUCKETS = 3          # Consecutive buckets a condition must hold for to count as reached
+REROUTE_SHARE = 0.5         # Rerouted once the target's share of responses is below this fraction of its baseline
+ERROR_MARGIN = 0.01         # ...and the error rate is within this of the baseline error rate
+RECOVERY_FACTOR = 1.5       # Recovered once p99 is back within this multiple of the baseline p99
+RESTART_TIMEOUT = 60.0      # Seconds to wait for a crashed backend to come back before the next algorithm
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+def admin_headers():
+    return {'X-Admin-Token': ADMIN_TOKEN} if ADMIN_TOKEN else {}
+
+def parse_event(spec):
+    """'30:server3:latency=2,errors=0.1' -> {"at": 30.0, "target": "server3", "kind": "inject", "fault": {...}}"""
+    at, _, rest = spec.partition(':')
+    target, _, faults = rest.rpartition(':')
+    if not target:
+        raise ValueError(f"Event {spec!r} is not AT:TARGET:FAULTS")
+    event = {"at": float(at), "target": target, "kind": "inject", "fault": {}, "spec": spec}
+    for item in faults.split(','):
+        name, _, value = item.strip().partition('=')
+        if name in ('clear', 'crash'):
+            event["kind"] = name
+        elif name == 'hang':
+            event["fault"]["hang"] = True
+        elif name == 'latency':
+            event["fault"]["latency"] = float(value)
+        elif name == 'errors':
+            event["fault"]["error_rate"] = float(value)
+        elif name == 'duration':
+            event["fault"]["duration"] = float(value)
+        else:
+            raise ValueError(f"Unknown fault {name!r} in {spec!r}")
+    if event["kind"] == "inject" and not event["fault"]:
+        raise ValueError(f"Event {spec!r} injects nothing")
+    return event
+
+def normalize(name):
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+def backend_names(backends):
+    """Server name each backend reports, which is how responses identify it"""
+    names = {}
+    for url in backends:
+        response = requests.get(f"{url}/admin/faults", headers=admin_headers(), timeout=5)
+        if response.status_code == 404:
+            raise RuntimeError(f"{url} has fault injection disabled; start it with ENABLE_FAULTS=1 or ADMIN_TOKEN")
+        response.raise_for_status()
+        names[url] = response.json()["server"]
+    return names
+
+def resolve_targets(events, names):
+    """Set each event's backend url and server name from its target"""
+    for event in events:
+        target = event["target"].rstrip('/')
+        matches = [url for url, name in names.items()
+                   if target == url or normalize(target) == normalize(name)]
+        if len(matches) != 1:
+            raise ValueError(f"Target {event['target']!r} does not match exactly one of: "
+                             f"{', '.join(f'{name} ({url})' for url, name in names.items())}")
+        event["url"] = matches[0]
+        event["name"] = names[matches[0]]
+
+def apply_event(event):
+    """Inject or clear a fault; returns an error message, or None on success"""
+    url = f"{event['url']}/admin/faults"
+    try:
+        if event["kind"] == "clear":
+            response = requests.delete(url, headers=admin_headers(), timeout=5)
+        elif event["kind"] == "crash":
+            response = requests.post(url, json={"crash": True}, headers=admin_headers(), timeout=5)
+        else:
+            response = requests.post(url, json=event["fault"], headers=admin_headers(), timeout=5)
+    except requests.RequestException as e:
+        return str(e)
+    return None if response.status_code < 300 else f"Status {response.status_code}: {response.text.strip()}"
+
+def reset_backends(urls):
+    """Clear faults on every target, waiting for crashed ones to be restarted"""
+    for url in urls:
+        deadline = time.time() + RESTART_TIMEOUT
+        while True:
+            try:
+                requests.delete(f"{url}/admin/faults", headers=admin_headers(), timeout=5).raise_for_status()
+                break
+            except requests.RequestException:
+                if time.time() >= deadline:
+                    raise RuntimeError(f"{url} did not come back within {RESTART_TIMEOUT:g}s; restart it and rerun")
+                time.sleep(1)
+
+def backend_health(lb_url):
+    response = requests.get(f"{lb_url}/servers", timeout=2)
+    return {server["url"]: server["healthy"] for server in response.json()["servers"]}
+
+class Bucket:
+    """Outcomes of the requests intended to be sent during one BUCKET_SECONDS slice of a run"""
+    def __init__(self):
+        self.total = 0
+        self.failed = 0
+        self.latency = LatencyHistogram()
+        self.servers = defaultdict(int)
+
+    def error_rate(self):
+        return self.failed / self.total if self.total else 0.0
+
+    def share(self, server):
+        return self.servers[server] / self.latency.count if self.latency.count else 0.0
+
+async def run_scenario(lb_url, events, duration, rate, mix, bucket_seconds):
+    """Run the load and the event timeline together; returns (buckets, health samples, applied events)"""
+    buckets = defaultdict(Bucket)
+    offsets = []
+    health = []         # (offset, {url: healthy}) as the load balancer saw it
+    applied = []
+    reporter = IntervalReporter()
+
+    def schedule():
+        for offset in arrivals.poisson(rate, duration):
+            offsets.append(offset)
+            yield offset
+
+    def on_result(task_id, task, status_code, payload, response_time, error, service_time):
+        bucket = buckets[int(offsets[task_id - 1] // bucket_seconds)]
+        bucket.total += 1
+        if error is None and status_code == 200:
+            server = payload.get('server', 'unknown')
+            bucket.latency.record(response_time)
+            bucket.servers[server] += 1
+            reporter.observe(server, response_time)
+        else:
+            bucket.failed += 1
+            reporter.observe(None, None)
+
+    async def play_events():
+        for event in events:
+            await asyncio.sleep(max(0.0, run_start + event["at"] - time.time()))
+            error = await asyncio.to_thread(apply_event, event)
+            offset = time.time() - run_start
+            applied.append({"spec": event["spec"], "at": event["at"], "applied_at": offset, "error": error})
+            print(f"[{offset:6.1f}s] {event['spec']}" + (f" failed: {error}" if error else ""), flush=True)
+
+    async def poll_health():
+        while True:
+            try:
+                health.append((time.time() - run_start, await asyncio.to_thread(backend_health, lb_url)))
+            except (requests.RequestException, ValueError, KeyError):
+                pass
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async with LoadEngine(client.WIRE_CONTENT_TYPE, client.CLIENT_ID, client.MAX_IN_FLIGHT) as engine:
+        reporter.in_flight = lambda: engine.in_flight
+        reporter.start()
+        run_start = time.time()
+        background = [asyncio.ensure_future(play_events()), asyncio.ensure_future(poll_health())]
+        try:
+            await engine.run_open_loop(f"{lb_url}/request", schedule(), lambda: client.make_task(mix), on_result)
+        finally:
+            for task in background:
+                task.cancel()
+            await reporter.stop()
+    return buckets, health, applied
+
+def first_stable(indexes, condition, buckets):
+    """First index from which `condition` holds for STABLE_BUCKETS buckets (fewer at the end of the range)"""
+    indexes = list(indexes)
+    for position, index in enumerate(indexes):
+        window = indexes[position:position + STABLE_BUCKETS]
+        if all(condition(buckets[i]) for i in window if buckets[i].total):
+            if any(buckets[i].total for i in window):
+                return index
+    return None
+
+def analyze(events, buckets, health, duration, bucket_seconds):
+    """Baseline before the first event, then detection, rerouting, recovery, losses and latency per fault"""
+    buckets = defaultdict(Bucket, buckets)
+    last_bucket = math.ceil(duration / bucket_seconds)
+    baseline = Bucket()
+    for index in range(int(events[0]["at"] // bucket_seconds)):
+        bucket = buckets[index]
+        baseline.total += bucket.total
+        baseline.failed += bucket.failed
+        baseline.latency.merge(bucket.latency)
+        for server, count in bucket.servers.items():
+            baseline.servers[server] += count
+    base_error = baseline.error_rate()
+    base_p99 = baseline.latency.percentile(0.99) if baseline.latency.count else None
+
+    faults = []
+    for position, event in enumerate(events):
+        if event["kind"] == "clear":
+            continue
+        following = next((later for later in events[position + 1:] if later["url"] == event["url"]), None)
+        end = following["at"] if following else duration
+        window = range(int(event["at"] // bucket_seconds), min(last_bucket, math.ceil(end / bucket_seconds)))
+        name = event["name"]
+        base_share = baseline.share(name)
+
+        detected = next((offset for offset, healthy in health
+                         if event["at"] <= offset < end and healthy.get(event["url"]) is False), None)
+        rerouted = first_stable(window, lambda bucket: bucket.error_rate() <= base_error + ERROR_MARGIN
+                                and bucket.share(name) <= REROUTE_SHARE * base_share, buckets)
+        recovered = None
+        if following is not None and following["kind"] == "clear" and base_p99 is not None:
+            after = range(int(following["at"] // bucket_seconds), last_bucket)
+            recovered_at = first_stable(after, lambda bucket: bucket.error_rate() <= base_error + ERROR_MARGIN
+                                        and bucket.latency.percentile(0.99) <= RECOVERY_FACTOR * base_p99
+                                        and bucket.share(name) >= REROUTE_SHARE * base_share, buckets)
+            if recovered_at is not None:
+                recovered = max(0.0, recovered_at * bucket_seconds - following["at"])
+
+        peak_p99 = max((buckets[index].latency.percentile(0.99) for index in window), default=0.0)
+        faults.append({
+            "event": event["spec"],
+            "target": name,
+            "at": event["at"],
+            "until": end,
+            "time_to_detect": detected - event["at"] if detected is not None else None,
+            "time_to_reroute": max(0.0, rerouted * bucket_seconds - event["at"]) if rerouted is not None else None,
+            "time_to_recover": recovered,
+            "requests_sent": sum(buckets[index].total for index in window),
+            "requests_lost": sum(buckets[index].failed for index in window),
+            "peak_p99": peak_p99,
+            "p99_increase": peak_p99 / base_p99 if base_p99 else None
+        })
+
+    timeline = [{
+        "t": index * bucket_seconds,
+        "requests": buckets[index].total,
+        "failed": buckets[index].failed,
+        "p99": buckets[index].latency.percentile(0.99),
+        "servers": dict(buckets[index].servers)
+    } for index in range(last_bucket)]
+    return {
+        "baseline": {"requests": baseline.total, "error_rate": base_error, "p99": base_p99,
+                     "shares": {server: baseline.share(server) for server in baseline.servers}},
+        "faults": faults,
+        "timeline": timeline
+    }
+
+def seconds(value):
+    return f"{value:6.1f}s" if value is not None else "  never"
+
+def print_report(runs):
+    print(f"\n{'Algorithm':16s} | {'Fault':28s} | {'Detect':>7s} | {'Reroute':>7s} | {'Recover':>7s} | "
+          f"{'Lost':>9s} | {'Peak p99':>8s} | {'vs base':>7s}")
+    print("-" * 112)
+    for run in runs:
+        for fault in run["faults"]:
+            increase = f"{fault['p99_increase']:6.1f}x" if fault["p99_increase"] is not None else "      -"
+            print(f"{run['algorithm']:16s} | {fault['event'][:28]:28s} | {seconds(fault['time_to_detect'])} | "
+                  f"{seconds(fault['time_to_reroute'])} | {seconds(fault['time_to_recover'])} | "
+                  f"{fault['requests_lost']:4d}/{fault['requests_sent']:<4d} | {fault['peak_p99']:7.3f}s | {increase}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Inject backend faults on a timeline and measure failover per algorithm")
+    parser.add_argument('--lb-url', default=client.LOAD_BALANCER, help="Load balancer base URL")
+    parser.add_argument('--algorithms', default="round_robin,source_hashing,least_loaded,least_drain_time")
+    parser.add_argument('--scenario', help="JSON file with events and optionally duration, rate and mix")
+    parser.add_argument('--event', action='append', default=[], help="AT:TARGET:FAULTS, e.g. 30:server3:latency=2")
+    parser.add_argument('--duration', type=float, help=f"Seconds of load per algorithm (default {DEFAULT_DURATION:g})")
+    parser.add_argument('--rate', type=float, help=f"Offered requests per second (default {DEFAULT_RATE:g})")
+    parser.add_argument('--mix', help="Workload: basic, database or mixed (default mixed)")
+    parser.add_argument('--bucket', type=float, default=BUCKET_SECONDS, help="Timeline resolution in seconds")
+    parser.add_argument('--cooldown', type=float, default=DEFAULT_COOLDOWN, help="Idle seconds between algorithms")
+    parser.add_argument('--output', help="Write the reports and per-bucket timelines as JSON")
+    args = parser.parse_args()
+
+    scenario = {}
+    if args.scenario:
+        with open(args.scenario) as f:
+            scenario = json.load(f)
+    duration = args.duration or scenario.get("duration", DEFAULT_DURATION)
+    rate = args.rate or scenario.get("rate", DEFAULT_RATE)
+    mix = args.mix or scenario.get("mix", "mixed")
+    try:
+        events = sorted((parse_event(spec) for spec in scenario.get("events", []) + args.event),
+                        key=lambda event: event["at"])
+    except ValueError as e:
+        parser.error(str(e))
+    if not events:
+        parser.error("no events; give --event or a --scenario file")
+
+    lb_url = args.lb_url.rstrip('/')
+    try:
+        names = backend_names(registered_backends(lb_url))
+        resolve_targets(events, names)
+    except (RuntimeError, ValueError) as e:
+        parser.error(str(e))
+    targets = sorted({event["url"] for event in events})
+
+    runs = []
+    for algorithm in (name.strip() for name in args.algorithms.split(',') if name.strip()):
+        reset_backends(targets)
+        set_algorithm(lb_url, algorithm)
+        print(f"\n{algorithm}: {rate:g} req/s for {duration:g}s with {len(events)} events...")
+        try:
+            buckets, health, applied = asyncio.run(run_scenario(lb_url, events, duration, rate, mix, args.bucket))
+        finally:
+            for url in targets:
+                try:
+                    requests.delete(f"{url}/admin/faults", headers=admin_headers(), timeout=5)
+                except requests.RequestException:
+                    pass
+        runs.append({"algorithm": algorithm, "events": applied,
+                     **analyze(events, buckets, health, duration, args.bucket)})
+        time.sleep(args.cooldown)
+    reset_backends(targets)
+
+    print_report(runs)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"environment": results.environment_metadata(),
+                       "scenario": {"events": [event["spec"] for event in events], "duration": duration,
+                                    "rate": rate, "mix": mix, "bucket": args.bucket},
+                       "runs": runs}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+import requests
+import arrivals
+import client
+import results
+from load_engine import LoadEngine
+from performance_metrics import PerformanceMetrics
+
+# Load sweep: for every algorithm (and optionally backend count and workload mix), step the offered
+# load through a list of rates on an open-loop Poisson schedule. Each cell warms up before it is
+# measured. The sweep prints and saves the throughput/latency curve and each series' knee.
+#   python sweep.py --algorithms round_robin,least_loaded --rates 10,20,40,80,160 --duration 20
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')     # For the load balancer's /servers when it is not on this host
+DEFAULT_RATES = "10,20,40,80"
+DEFAULT_DURATION = 20.0     # Measured seconds per cell
+DEFAULT_WARMUP = 5.0        # Seconds of load before measuring, discarded
+DEFAULT_COOLDOWN = 5.0      # Idle seconds between cells so queues drain
+KNEE_FACTOR = 3.0           # A cell is past the knee if its p99 exceeds this multiple of the series' lowest-rate p99
+DEFAULT_ERROR_LIMIT = 0.01  # ...or its error rate exceeds this
+CSV_COLUMNS = ("algorithm", "backends", "mix", "offered_rate", "throughput", "error_rate", "p50", "p90", "p99",
+               "p999", "max", "past_knee")
+
+def set_algorithm(lb_url, algorithm):
+    response = requests.post(f"{lb_url}/set_algorithm", json={"algorithm": algorithm}, timeout=10)
+    response.raise_for_status()
+
+def registered_backends(lb_url):
+    return [server["url"] for server in requests.get(f"{lb_url}/servers", timeout=10).json()["servers"]]
+
+def use_backends(lb_url, all_backends, count):
+    """Register the first `count` of the load balancer's original backends and deregister the rest"""
+    for index, url in enumerate(all_backends):
+        method = requests.post if index < count else requests.delete
+        headers = {'X-Admin-Token': ADMIN_TOKEN} if ADMIN_TOKEN else {}
+        method(f"{lb_url}/servers", json={"url": url}, headers=headers, timeout=10).raise_for_status()
+
+async def run_cell(url, rate, duration, warmup, mix):
+    """Offer `rate` requests per second for warmup + duration seconds; returns metrics for the measured part"""
+    metrics = PerformanceMetrics()
+    warmup_sends = [0]
+
+    def schedule():
+        for offset in arrivals.poisson(rate, warmup + duration):
+            if offset < warmup:
+                warmup_sends[0] += 1
+            yield offset
+
+    def on_result(task_id, task, status_code, payload, response_time, error, service_time):
+        if task_id <= warmup_sends[0]:
+            return
+        if error is None and status_code == 200:
+            metrics.record_request(payload.get('server', 'unknown'), task['task_type'], response_time,
+                                   service_time=service_time)
+        else:
+            metrics.record_request(None, task['task_type'], None, error or f"Status {status_code}")
+
+    async with LoadEngine(client.WIRE_CONTENT_TYPE, client.CLIENT_ID, client.MAX_IN_FLIGHT) as engine:
+        await engine.run_open_loop(url, schedule(), lambda: client.make_task(mix), on_result)
+    return metrics
+
+def past_knee(cell, reference_p99, p99_limit, error_limit):
+    if cell["error_rate"] > error_limit:
+        return True
+    if p99_limit is not None and cell["p99"] > p99_limit:
+        return True
+    return reference_p99 is not None and cell["p99"] > KNEE_FACTOR * reference_p99
+
+def summarize_knees(cells):
+    """Per series: the first offered rate past the knee and the best throughput reached before it"""
+    knees = {}
+    for cell in cells:
+        key = f"{cell['algorithm']} / {cell['backends']} backends / {cell['mix']}"
+        series = knees.setdefault(key, {"max_sustainable_rps": 0.0, "knee_rate": None})
+        if series["knee_rate"] is not None:
+            continue
+        if cell["past_knee"]:
+            series["knee_rate"] = cell["offered_rate"]
+        else:
+            series["max_sustainable_rps"] = max(series["max_sustainable_rps"], cell["throughput"])
+    return knees
+
+def print_curves(cells, knees):
+    print(f"\n{'Algorithm':16s} | {'Backends':>8s} | {'Mix':8s} | {'Offered':>7s} | {'Achieved':>8s} | "
+          f"{'Errors':>6s} | {'p50':>7s} | {'p99':>7s} | Knee")
+    print("-" * 95)
+    for cell in cells:
+        print(f"{cell['algorithm']:16s} | {str(cell['backends']):>8s} | {cell['mix']:8s} | "
+              f"{cell['offered_rate']:7.1f} | {cell['throughput']:8.1f} | {cell['error_rate']*100:5.1f}% | "
+              f"{cell['p50']:6.3f}s | {cell['p99']:6.3f}s | {'past' if cell['past_knee'] else ''}")
+
+    print("\n=== Maximum Sustainable Throughput ===")
+    for series, knee in knees.items():
+        knee_text = f"knee at {knee['knee_rate']:g} req/s offered" if knee['knee_rate'] is not None else "no knee found"
+        print(f"{series:50s}: {knee['max_sustainable_rps']:7.1f} req/s ({knee_text})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep offered load per algorithm and find each saturation knee")
+    parser.add_argument('--lb-url', default=client.LOAD_BALANCER, help="Load balancer base URL")
+    parser.add_argument('--algorithms', default="round_robin,source_hashing,least_loaded,least_drain_time")
+    parser.add_argument('--rates', default=DEFAULT_RATES, help="Comma-separated offered loads in requests/second")
+    parser.add_argument('--backends', help="Comma-separated backend counts; uses the first N registered backends")
+    parser.add_argument('--mix', default="mixed", help="Comma-separated workload mixes: basic, database, mixed")
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help="Measured seconds per cell")
+    parser.add_argument('--warmup', type=float, default=DEFAULT_WARMUP, help="Unmeasured seconds before each cell")
+    parser.add_argument('--cooldown', type=float, default=DEFAULT_COOLDOWN, help="Idle seconds between cells")
+    parser.add_argument('--p99-limit', type=float, help="Absolute p99 (seconds) beyond which a cell is past the knee")
+    parser.add_argument('--error-limit', type=float, default=DEFAULT_ERROR_LIMIT)
+    parser.add_argument('--full', action='store_true', help="Keep stepping a series after its knee")
+    parser.add_argument('--output', help="Write cells, knees and environment metadata as JSON")
+    parser.add_argument('--csv', help="Write one row per cell as CSV")
+    args = parser.parse_args()
+
+    lb_url = args.lb_url.rstrip('/')
+    rates = sorted(float(rate) for rate in args.rates.split(','))
+    algorithms = [name.strip() for name in args.algorithms.split(',') if name.strip()]
+    mixes = [name.strip() for name in args.mix.split(',') if name.strip()]
+    all_backends = registered_backends(lb_url)
+    backend_counts = [int(count) for count in args.backends.split(',')] if args.backends else [len(all_backends)]
+    if max(backend_counts) > len(all_backends):
+        parser.error(f"the load balancer only has {len(all_backends)} backends")
+
+    cells = []
+    try:
+        for backends in backend_counts:
+            use_backends(lb_url, all_backends, backends)
+            for algorithm in algorithms:
+                set_algorithm(lb_url, algorithm)
+                for mix in mixes:
+                    reference_p99 = None
+                    for rate in rates:
+                        print(f"{algorithm}, {backends} backends, {mix}: offering {rate:g} req/s "
+                              f"for {args.warmup:g}s + {args.duration:g}s...")
+                        metrics = asyncio.run(run_cell(f"{lb_url}/request", rate, args.duration, args.warmup, mix))
+                        result = results.phase_result(f"{algorithm}/{backends}/{mix}/{rate:g}", lb_url, metrics)
+                        cell = {
+                            "algorithm": algorithm, "backends": backends, "mix": mix, "offered_rate": rate,
+                            "throughput": result["throughput"], "error_rate": 1 - result["success_rate"],
+                            **{name: result["latency"][name] for name in ("p50", "p90", "p99", "p999", "max")},
+                            "errors": result["errors"]
+                        }
+                        if reference_p99 is None and result["successful"]:
+                            reference_p99 = cell["p99"]
+                        cell["past_knee"] = past_knee(cell, reference_p99, args.p99_limit, args.error_limit)
+                        cells.append(cell)
+                        time.sleep(args.cooldown)
+                        if cell["past_knee"] and not args.full:
+                            break
+    finally:
+        use_backends(lb_url, all_backends, len(all_backends))
+
+    knees = summarize_knees(cells)
+    print_curves(cells, knees)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"environment": results.environment_metadata(), "cells": cells, "knees": knees}, f, indent=2)
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_COLUMNS)
+            for cell in cells:
+                writer.writerow([cell[column] for column in CSV_COLUMNS])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import json
+import os
+import sys
+# wire_format lives in the repo's shared/ directory (copied beside this file in Docker)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'shared'))
+import wire_format
+
+# Workload traces: one JSON object per line, {"offset": seconds from the start of the phase,
+# "task": request body, "phase": phase name}. "phase" is optional; a trace captured elsewhere
+# without it is replayed in full by every phase. Binary fields (typed array buffers) are
+# stored as base64 text, which the servers accept in place of raw bytes.
+
+class TraceRecorder:
+    """Writes every task a run sends, with its send offset, to a JSONL trace.
+
+    The first phase of a run starts a new trace; later phases pass append=True to add to it.
+    """
+    def __init__(self, path, phase=None, append=False):
+        self.file = open(path, 'a' if append else 'w', encoding='utf-8')
+        self.phase = phase
+
+    def record(self, offset, task):
+        entry = {"offset": round(offset, 6), "task": task}
+        if self.phase is not None:
+            entry["phase"] = self.phase
+        self.file.write(json.dumps(entry, default=wire_format.encode_bytes) + "\n")
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def read_trace(path, phase=None, speed=1.0):
+    """Stream (offset, task) pairs from a trace, one line at a time.
+
+    Only entries for `phase` (or without a phase) are returned, and offsets are divided by
+    `speed`, so speed=2 replays the trace twice as fast. Offsets are made relative to the
+    first selected entry so a replayed phase starts right away.
+    """
+    first_offset = None
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+                offset = float(entry["offset"])
+                task = entry["task"]
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f"{path}:{line_number}: invalid trace entry ({e})") from None
+            if phase is not None and entry.get("phase", phase) != phase:
+                continue
+            if first_offset is None:
+                first_offset = offset
+            yield (offset - first_offset) / speed, task
@@ -0,0 +1,352 @@
+# Asyncio server mode with the same endpoints, task semantics and delay model as server.py.
+# Simulated delays are non-blocking sleeps and Mongo calls run on a bounded thread
+# executor, so waiting requests hold no OS thread. Run with `python async_server.py`.
+import asyncio
+import contextvars
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+import server
+import wire_format
+import request_tracing
+
+# Async mode configuration
+ASYNC_SLOTS = server.WORKER_COUNT       # Tasks executing at once; the delay model grows with this count
+ASYNC_QUEUE_CAPACITY = 10000            # Requests allowed to wait for a slot before new arrivals are rejected
+DB_EXECUTOR_THREADS = 32                # Threads available for blocking pymongo calls
+
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_THREADS)
+
+class QueueRejected(Exception):
+    """The request could not be queued or waited past QUEUE_DEADLINE"""
+
+class AsyncTaskRunner:
+    """FIFO admission to a fixed number of execution slots, mirroring the threaded scheduler"""
+    def __init__(self, slots=ASYNC_SLOTS, capacity=ASYNC_QUEUE_CAPACITY):
+        self.slots = slots
+        self.capacity = capacity
+        self.semaphore = None       # Created inside the running event loop
+        self.waiting = 0
+        self.busy = 0
+
+    async def run(self, task_type, data):
+        """Wait for a slot, then simulate the delay and execute the task, or a batch when task_type is 'batch'"""
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.slots)
+        if self.waiting >= self.capacity:
+            server.update_queue_counters(rejected=1)
+            raise QueueRejected()
+
+        enqueued_at = time.time()
+        self.waiting += 1
+        server.update_queue_counters(queued=1)
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+            server.update_queue_counters(queued=-1)
+
+        try:
+            sojourn = time.time() - enqueued_at
+            server.record_sojourn(sojourn)
+            trace = request_tracing.current_trace.get()
+            if trace is not None:
+                trace.add('server.queue', enqueued_at, sojourn)
+            if sojourn > server.QUEUE_DEADLINE:
+                server.update_queue_counters(dropped=1)
+                raise QueueRejected()
+
+            self.busy += 1
+            server.update_queue_counters(busy=1)
+            started = time.time()
+            try:
+                if task_type == 'batch':
+                    result = await self.execute_batch(data, self.busy)
+                else:
+                    result = await self.execute(task_type, data, self.busy)
+            finally:
+                self.busy -= 1
+                server.update_queue_counters(busy=-1)
+            return result, sojourn, time.time() - started
+        finally:
+            self.semaphore.release()
+
+    async def execute(self, task_type, data, current_load):
+        """Simulate the delay for the current load and run one task"""
+        base_delay = server.load_delay(current_load)
+        with request_tracing.span('server.delay'):
+            await asyncio.sleep(base_delay * server.TASK_DELAY_FACTORS[task_type])
+        handler = server.TASK_HANDLERS[task_type]
+        if task_type.startswith('db_'):
+            with request_tracing.span('server.db'):
+                result = await asyncio.get_running_loop().run_in_executor(db_executor, handler, data)
+        elif server.should_offload(task_type, data):
+            with request_tracing.span('server.task'):
+                result = await asyncio.wrap_future(server.submit_cpu_task(task_type, data))
+        else:
+            with request_tracing.span('server.task'):
+                result = handler(data)
+
+        # Add additional delay if server is under heavy load
+        if server.under_heavy_load():
+            with request_tracing.span('server.delay'):
+                await asyncio.sleep(base_delay * 2)
+        return result
+
+    async def execute_batch(self, tasks, current_load):
+        """Simulate one delay for a batch, then run its tasks and grouped writes on the executor"""
+        results, delay_factor = server.plan_batch(tasks)
+        base_delay = server.load_delay(current_load)
+        with request_tracing.span('server.delay'):
+            await asyncio.sleep(base_delay * delay_factor)
+        # The request's context goes along so spans recorded on the executor stay in its trace
+        await asyncio.get_running_loop().run_in_executor(
+            db_executor, contextvars.copy_context().run, server.execute_batch, tasks, results)
+
+        # Add additional delay if server is under heavy load
+        if server.under_heavy_load():
+            with request_tracing.span('server.delay'):
+                await asyncio.sleep(base_delay * 2)
+        return results
+
+    def metrics(self):
+        """Runner settings; counters are reported from ServerState"""
+        return {
+            "workers": self.slots,
+            "queue_capacity": self.capacity,
+            "queue_mode": "fifo"
+        }
+
+runner = AsyncTaskRunner()
+
+def log_request(task_type, processing_time, result, status="success"):
+    """Write the request log entry on the executor without delaying the response (so it has no span)"""
+    asyncio.get_running_loop().run_in_executor(
+        db_executor, server.log_request_to_db, task_type, processing_time, result, status)
+
+def encoded_response(request, payload, status=200):
+    """Respond in the format and encoding the caller accepts"""
+    body, headers = wire_format.encode_response(payload, request.headers.get('Accept'),
+                                                request.headers.get('Accept-Encoding'))
+    return web.Response(body=body, status=status, headers=headers)
+
+async def health_check(request):
+    report, code = server.build_health_report()
+    return web.json_response(report, status=code)
+
+async def get_load(request):
+    return web.json_response(server.build_load_report(runner.metrics()))
+
+async def get_analytics(request):
+    """Request log analytics, as in server.py; the queries run on the executor"""
+    try:
+        until = float(request.query.get('until', time.time()))
+        since = float(request.query.get('since', until - server.ANALYTICS_DEFAULT_WINDOW))
+    except ValueError:
+        return web.json_response({"error": "since and until must be epoch seconds"}, status=400)
+    report, code = await asyncio.get_running_loop().run_in_executor(
+        db_executor, server.build_analytics_report, since, until, request.query.get('source', 'raw'))
+    return web.json_response(report, status=code)
+
+async def list_jobs(request):
+    jobs = [server.job_report(record) for record in server.bulk_jobs.jobs()]
+    return web.json_response({"server": server.server_name, "jobs": jobs})
+
+async def get_job(request):
+    record = server.bulk_jobs.get(request.match_info['job_id'])
+    if record is None:
+        return web.json_response({"error": "Unknown job", "server": server.server_name}, status=404)
+    return web.json_response(server.job_report(record))
+
+async def handle_request(request):
+    """Handle incoming task requests with load-based processing"""
+    current_load = server.update_load(1)  # Increment load counter
+    start_time = time.time()
+    task_type = "unknown"
+
+    try:
+        # aiohttp undoes Content-Encoding itself; loads() only gunzips bodies that are still compressed
+        data = wire_format.loads(await request.read(), request.content_type,
+                                 request.headers.get('Content-Encoding'))
+        task_type = data.get('task_type', 'addition')
+
+        if task_type not in server.TASK_HANDLERS:
+            server.update_load(-1)
+            log_request(task_type, 0, None, "invalid_task")
+            return encoded_response(request, {"error": "Invalid task type"}, status=400)
+
+        server.begin_task(task_type)
+        try:
+            result, queue_time, execution_time = await runner.run(task_type, data)
+        except QueueRejected:
+            server.finish_task(task_type)
+            server.update_load(-1)
+            return encoded_response(request, {
+                "error": "Server overloaded",
+                "server": server.server_name,
+                "current_load": current_load
+            }, status=503)
+        except Exception:
+            server.finish_task(task_type)
+            raise
+
+        processing_time = time.time() - start_time
+        server.finish_task(task_type, execution_time)
+        log_request(task_type, processing_time, result)
+        server.update_load(-1)
+        return encoded_response(request, {
+            "server": server.server_name,
+            "task": task_type,
+            "result": result,
+            "load": current_load,
+            "processing_time": processing_time,
+            "queue_time": queue_time
+        })
+
+    except wire_format.UnsupportedFormat as e:
+        server.update_load(-1)
+        return web.json_response({"error": f"Unsupported content type {str(e)}"}, status=415)
+
+    except server.InvalidTaskData as e:
+        log_request(task_type, time.time() - start_time, str(e), "invalid_task")
+        server.update_load(-1)
+        return encoded_response(request, {"error": str(e)}, status=400)
+
+    except Exception as e:
+        processing_time = time.time() - start_time
+        log_request(task_type, processing_time, str(e), "error")
+        server.update_load(-1)
+        return encoded_response(request, {"error": str(e)}, status=500)
+
+async def handle_batch(request):
+    """Run many tasks as one request: one load entry, grouped DB writes and one log write"""
+    current_load = server.update_load(1)  # One load entry for the whole batch
+    start_time = time.time()
+
+    try:
+        data = wire_format.loads(await request.read(), request.content_type,
+                                 request.headers.get('Content-Encoding'))
+        tasks = data.get('tasks') if isinstance(data, dict) else None
+        if not isinstance(tasks, list) or not tasks or len(tasks) > server.MAX_BATCH_SIZE:
+            server.update_load(-1)
+            return encoded_response(request, {"error": f"Batch must contain 1 to {server.MAX_BATCH_SIZE} tasks"},
+                                    status=400)
+
+        type_counts = server.batch_task_counts(tasks)
+        for task_type, count in type_counts.items():
+            server.begin_task(task_type, count)
+        try:
+            results, queue_time, execution_time = await runner.run('batch', tasks)
+        except QueueRejected:
+            for task_type, count in type_counts.items():
+                server.finish_task(task_type, count=count)
+            server.update_load(-1)
+            return encoded_response(request, {
+                "error": "Server overloaded",
+                "server": server.server_name,
+                "current_load": current_load
+            }, status=503)
+        except Exception:
+            for task_type, count in type_counts.items():
+                server.finish_task(task_type, count=count)
+            raise
+
+        processing_time = time.time() - start_time
+        share = execution_time / len(tasks)
+        for task_type, count in type_counts.items():
+            server.finish_task(task_type, share, count)
+        asyncio.get_running_loop().run_in_executor(
+            db_executor, server.log_requests_to_db, server.batch_log_entries(results, share))
+
+        failed = sum(1 for entry in results if "error" in entry)
+        server.update_load(-1)
+        return encoded_response(request, {
+            "server": server.server_name,
+            "load": current_load,
+            "processing_time": processing_time,
+            "queue_time": queue_time,
+            "succeeded": len(tasks) - failed,
+            "failed": failed,
+            "results": results
+        })
+
+    except wire_format.UnsupportedFormat as e:
+        server.update_load(-1)
+        return web.json_response({"error": f"Unsupported content type {str(e)}"}, status=415)
+
+    except Exception as e:
+        server.update_load(-1)
+        return encoded_response(request, {"error": str(e)}, status=500)
+
+@web.middleware
+async def trace_requests(request, handler):
+    """Trace /request and /batch under the caller's request ID, returning the spans in Server-Timing"""
+    if request.path not in ('/request', '/batch'):
+        return await handler(request)
+    trace = request_tracing.RequestTrace(request.headers.get(request_tracing.REQUEST_ID_HEADER), 'server')
+    with request_tracing.activate(trace):
+        response = await handler(request)
+    trace.finish()
+    response.headers[request_tracing.REQUEST_ID_HEADER] = trace.request_id
+    response.headers[request_tracing.TIMING_HEADER] = trace.server_timing()
+    return response
+
+@web.middleware
+async def inject_faults(request, handler):
+    """Apply faults set through /admin/faults to every other endpoint"""
+    if not request.path.startswith('/admin/'):
+        faults = server.current_faults()
+        if faults is not None:
+            with request_tracing.span('server.fault'):
+                while faults and faults["hang"]:
+                    await asyncio.sleep(server.FAULT_POLL_INTERVAL)
+                    faults = server.current_faults()
+                if faults is not None and faults["latency"]:
+                    await asyncio.sleep(faults["latency"])
+        if faults is not None and random.random() < faults["error_rate"]:
+            return encoded_response(request, {"error": "Injected fault", "server": server.server_name}, status=500)
+    return await handler(request)
+
+async def admin_faults(request):
+    """Show (GET), inject (POST) or clear (DELETE) faults, as in server.py"""
+    if not server.faults_enabled():
+        return web.json_response({"error": "Fault injection is disabled; set ADMIN_TOKEN or ENABLE_FAULTS=1"},
+                                 status=404)
+    if not server.admin_authorized(request.headers):
+        return web.json_response({"error": "Admin token required"}, status=403)
+    if request.method == 'POST':
+        try:
+            data = await request.json()
+        except ValueError:
+            data = {}
+        if not isinstance(data, dict):
+            data = {}
+        if data.get('crash'):
+            server.crash_soon()
+            return web.json_response({"server": server.server_name, "crashing": True}, status=202)
+        try:
+            server.set_faults(data)
+        except (TypeError, ValueError) as e:
+            return web.json_response({"error": str(e)}, status=400)
+    elif request.method == 'DELETE':
+        server.clear_faults()
+    return web.json_response(server.faults_report())
+
+def create_app():
+    app = web.Application(middlewares=[trace_requests, inject_faults])
+    app.router.add_get('/health', health_check)
+    app.router.add_get('/load', get_load)
+    app.router.add_get('/analytics', get_analytics)
+    app.router.add_get('/jobs', list_jobs)
+    app.router.add_get('/jobs/{job_id}', get_job)
+    app.router.add_post('/request', handle_request)
+    app.router.add_post('/batch', handle_batch)
+    app.router.add_route('*', '/admin/faults', admin_faults)
+    return app
+
+if __name__ == "__main__":
+    server.start_background_tasks()
+    web.run_app(create_app(), host='0.0.0.0', port=server.PORT)
@@ -0,0 +1,1646 @@
+from flask import Flask, request, jsonify, Response, g
+import socket
+import math
+import time
+import threading
+import multiprocessing
+import multiprocessing.connection
+import os
+import json
+from pymongo import MongoClient, ReturnDocument, UpdateOne, ASCENDING
+from pymongo.errors import OperationFailure
+from datetime import datetime, timezone
+import random
+import string
+import uuid
+import array
+import base64
+import sys
+import hmac
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.serving import make_server
+# wire_format and request_tracing live in the repo's shared/ directory (copied beside this file in Docker)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'shared'))
+import wire_format
+import request_tracing
+
+try:
+    import numpy as np
+except ImportError:  # Bulk generation falls back to the random module
+    np = None
+
+app = Flask(__name__)
+
+# Server name from SERVER_NAME, or the container hostname mapped to a simple name
+hostname = socket.gethostname()
+server_mapping = {
+    'server1': 'Server-1',
+    'server2': 'Server-2',
+    'server3': 'Server-3',
+    'server4': 'Server-4'
+}
+server_name = os.environ.get('SERVER_NAME') or server_mapping.get(os.environ.get('HOSTNAME', hostname), hostname)
+PORT = int(os.environ.get('PORT', 5000))
+
+# Database connection; mongomock:// selects an in-memory stand-in private to this process
+DATABASE_URL = os.environ.get('DATABASE_URL', 'mongodb://database:27017/loadbalancer')
+if DATABASE_URL.startswith('mongomock://'):
+    import mongomock
+    mongo_client = mongomock.MongoClient()
+    db = mongo_client['loadbalancer']
+else:
+    mongo_client = MongoClient(DATABASE_URL)
+    db = mongo_client.get_database()
+requests_collection = db.requests
+data_collection = db.user_data
+aggregates_collection = db.materialized_aggregates
+rollups_collection = db.request_rollups
+rollup_state_collection = db.rollup_state
+
+# Server configuration
+MAX_CONCURRENT = int(os.environ.get('MAX_CONCURRENT', 5))          # Maximum concurrent requests before overload
+OVERLOAD_THRESHOLD = int(os.environ.get('OVERLOAD_THRESHOLD', 8))  # Load above which /health reports the server as overloaded
+RECOVERY_TIME = 0.5         # Time in seconds to recover one unit of load
+AGGREGATE_REFRESH_INTERVAL = 60  # Seconds between full recomputes of materialized aggregates
+GENERATE_MAX_RECORDS = 100  # Limit for inline db_generate_data requests
+BULK_BATCH_SIZE = 10000     # Records per insert_many call in bulk generation jobs
+BULK_MAX_RECORDS = 10000000 # Limit for a single bulk generation job
+MAX_BULK_JOBS = 64          # Bulk jobs remembered server-wide; a new job replaces the oldest finished one
+BULK_JOB_RECORD_SIZE = 1024 # Bytes of shared memory holding one job's record
+COST_EWMA_ALPHA = 0.2       # Weight of the newest sample in per-task processing time averages
+UTILIZATION_TIME_CONSTANT = RECOVERY_TIME * MAX_CONCURRENT  # Decay time of the utilization figure
+WORKER_COUNT = int(os.environ.get('WORKER_COUNT', MAX_CONCURRENT))  # Worker threads executing tasks
+QUEUE_CAPACITY = int(os.environ.get('QUEUE_CAPACITY', 32))          # Requests per server process allowed to wait for a worker before rejection
+CODEL_TARGET = 0.1          # Acceptable queue sojourn time in seconds
+CODEL_INTERVAL = 0.5        # Sojourn must stay above target this long before CoDel starts dropping
+LIFO_AFTER = 1.0            # Seconds of sustained above-target queueing before serving newest first
+QUEUE_DEADLINE = 5.0        # Requests waiting longer than this are dropped regardless of mode
+SERVER_PROCESSES = int(os.environ.get('SERVER_PROCESSES', 1))  # Worker processes sharing the port and load counters
+CPU_POOL_SIZE = int(os.environ.get('CPU_POOL_SIZE', os.cpu_count() or 1))  # Processes for offloaded CPU-bound tasks
+MAX_SORT_SIZE = 1000000     # Limit for sort_large_list inputs
+MAX_BATCH_SIZE = 1000       # Limit for tasks in one /batch request
+REQUEST_LOG_RETENTION = int(os.environ.get('REQUEST_LOG_RETENTION', 86400))   # Seconds raw request logs are kept (0 keeps them)
+REQUEST_LOG_CAPPED_SIZE = int(os.environ.get('REQUEST_LOG_CAPPED_SIZE', 0))   # Bytes for a capped request log instead of a TTL
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')     # When set, /admin endpoints require it in the X-Admin-Token header
+ENABLE_FAULTS = os.environ.get('ENABLE_FAULTS', '0') == '1'     # Serve /admin/faults without ADMIN_TOKEN (trusted networks only)
+TRACED_ENDPOINTS = ('handle_request', 'handle_batch')  # Endpoints timed as spans and answered with Server-Timing
+FAULT_POLL_INTERVAL = 0.1   # Seconds between checks while a hung request waits for its fault to clear
+CRASH_DELAY = 0.1           # Seconds between acknowledging an injected crash and exiting
+ROLLUP_INTERVAL = 60        # Seconds between request log rollup runs
+ROLLUP_BUCKET = 60          # Seconds covered by one rollup document
+ROLLUP_LAG = 5              # Seconds a bucket must be closed before it is rolled up
+ROLLUP_MAX_WINDOW = 3600    # Limit for the span of raw logs rolled up in one run
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]  # Upper bounds of rollup histogram buckets (seconds)
+ANALYTICS_PERCENTILES = [0.5, 0.95, 0.99]  # processing_time percentiles reported by /analytics
+ANALYTICS_DEFAULT_WINDOW = 3600  # Seconds analysed by /analytics when no since is given
+
+# Payload size from which a CPU-bound task runs in the process pool instead of inline
+OFFLOAD_THRESHOLDS = {
+    'sort_large_list': 10000,   # Numbers to sort
+    'find_vowels': 200000       # Characters to scan
+}
+
+# Relative cost of each task type, applied to the load-based base delay
+TASK_DELAY_FACTORS = {
+    'addition': 1.0,
+    'multiplication': 1.5,
+    'factorial': 2.0,
+    'string_length': 1.2,
+    'find_vowels': 1.3,
+    'sort_large_list': 3.0,
+    'db_create_user': 2.0,
+    'db_find_users': 2.5,
+    'db_update_user': 2.2,
+    'db_aggregate': 3.0,
+    'db_generate_data': 3.5
+}
+
+TASK_TYPES = list(TASK_DELAY_FACTORS)
+TASK_INDEX = {task_type: index for index, task_type in enumerate(TASK_TYPES)}
+
+class SharedValue:
+    """ServerState attribute stored in one slot of a shared-memory array"""
+    def __init__(self, array, index):
+        self.array = array
+        self.index = index
+
+    def __get__(self, state, owner=None):
+        if state is None:
+            return self
+        return getattr(state, self.array)[self.index]
+
+    def __set__(self, state, value):
+        getattr(state, self.array)[self.index] = value
+
+# Server state
+class ServerState:
+    """Server-wide counters kept in shared memory so forked worker processes update one copy"""
+    request_count = SharedValue('counters', 0)      # Current number of active requests
+    total_requests = SharedValue('counters', 1)     # Total requests handled
+    queue_depth = SharedValue('counters', 2)        # Requests waiting for a worker
+    busy_workers = SharedValue('counters', 3)       # Workers executing a task
+    queue_dropped = SharedValue('counters', 4)      # Requests dropped from the queue
+    queue_rejected = SharedValue('counters', 5)     # Requests refused because the queue was full
+    cpu_pending = SharedValue('counters', 6)        # Tasks submitted to CPU pools and not yet finished
+    last_request_time = SharedValue('timings', 0)
+    utilization = SharedValue('timings', 1)         # Time-decayed average of busy_workers / server_capacity()
+    utilization_time = SharedValue('timings', 2)
+    last_sojourn = SharedValue('timings', 3)        # Queue wait of the most recently dequeued request
+    sojourn_avg = SharedValue('timings', 4)         # EWMA of queue wait
+    fault_latency = SharedValue('faults', 0)        # Injected seconds of delay before each request
+    fault_error_rate = SharedValue('faults', 1)     # Injected fraction of requests answered with a 500
+    fault_hang = SharedValue('faults', 2)           # Non-zero: requests block until the fault is cleared
+    fault_until = SharedValue('faults', 3)          # Time injected faults expire; 0 keeps them until cleared
+
+    def __init__(self, shared=False):
+        self.counters = multiprocessing.RawArray('q', 7)
+        self.timings = multiprocessing.RawArray('d', 5)
+        self.faults = multiprocessing.RawArray('d', 4)
+        self.inflight = multiprocessing.RawArray('q', len(TASK_TYPES))          # Active requests per task type
+        self.completed = multiprocessing.RawArray('q', len(TASK_TYPES))         # Completed requests per task type
+        self.processing_time = multiprocessing.RawArray('d', len(TASK_TYPES))   # Total processing time per task type
+        # EWMA of processing time per task type, seeded from the delay model
+        self.task_costs = multiprocessing.RawArray('d', [0.1 * TASK_DELAY_FACTORS[task_type] for task_type in TASK_TYPES])
+        # Worker processes need a process-shared lock; a single process only needs a thread lock
+        self.request_lock = multiprocessing.Lock() if shared else threading.Lock()
+        self.last_request_time = time.time()
+        self.utilization_time = time.time()
+
+server_state = ServerState()
+
+def server_capacity():
+    """Worker threads across all server processes"""
+    return WORKER_COUNT * SERVER_PROCESSES
+
+def decay_utilization(now):
+    """Fold the time since the last update into the utilization average (caller holds the lock)"""
+    elapsed = max(0.0, now - server_state.utilization_time)
+    weight = math.exp(-elapsed / UTILIZATION_TIME_CONSTANT)
+    level = server_state.busy_workers / server_capacity()     # A fraction: queued requests are not counted
+    server_state.utilization = server_state.utilization * weight + level * (1 - weight)
+    server_state.utilization_time = now
+
+def get_current_load():
+    """Calculate current server load"""
+    with server_state.request_lock:
+        return server_state.request_count
+
+def update_load(delta):
+    """Thread-safe update of server load"""
+    with server_state.request_lock:
+        decay_utilization(time.time())
+        server_state.request_count = max(0, server_state.request_count + delta)
+        if delta > 0:
+            server_state.total_requests += 1
+            server_state.last_request_time = time.time()
+        return server_state.request_count
+
+def begin_task(task_type, count=1):
+    """Count accepted requests as in-flight work of their task type"""
+    with server_state.request_lock:
+        server_state.inflight[TASK_INDEX[task_type]] += count
+
+def finish_task(task_type, processing_time=None, count=1):
+    """Remove requests from in-flight work and update the task type's cost average"""
+    index = TASK_INDEX[task_type]
+    with server_state.request_lock:
+        server_state.inflight[index] = max(0, server_state.inflight[index] - count)
+        if processing_time is not None:
+            server_state.completed[index] += count
+            server_state.processing_time[index] += processing_time * count
+            previous = server_state.task_costs[index]
+            server_state.task_costs[index] = previous + COST_EWMA_ALPHA * (processing_time - previous)
+
+def try_enqueue(capacity):
+    """Count a request into the server-wide queue unless it already holds `capacity` requests"""
+    with server_state.request_lock:
+        if server_state.queue_depth >= capacity:
+            server_state.queue_rejected += 1
+            return False
+        server_state.queue_depth += 1
+        return True
+
+def update_queue_counters(queued=0, busy=0, dropped=0, rejected=0, cpu_pending=0):
+    """Adjust server-wide queue, worker and CPU pool counters"""
+    with server_state.request_lock:
+        if busy:
+            decay_utilization(time.time())
+        server_state.queue_depth += queued
+        server_state.busy_workers += busy
+        server_state.queue_dropped += dropped
+        server_state.queue_rejected += rejected
+        server_state.cpu_pending += cpu_pending
+
+def record_sojourn(sojourn):
+    """Record the queue wait of a request leaving the queue"""
+    with server_state.request_lock:
+        server_state.last_sojourn = sojourn
+        server_state.sojourn_avg += COST_EWMA_ALPHA * (sojourn - server_state.sojourn_avg)
+
+def get_load_metrics():
+    """Load signal weighted by the expected cost of in-flight work"""
+    with server_state.request_lock:
+        decay_utilization(time.time())
+        costs = dict(zip(TASK_TYPES, server_state.task_costs))
+        inflight = {task_type: count for task_type, count in zip(TASK_TYPES, server_state.inflight) if count > 0}
+        task_stats = {
+            task_type: {"completed": completed, "avg_processing_time": total / completed}
+            for task_type, completed, total in zip(TASK_TYPES, server_state.completed, server_state.processing_time)
+            if completed > 0
+        }
+        request_count = server_state.request_count
+        utilization = server_state.utilization
+        cpu_queue_depth = max(0, server_state.cpu_pending - CPU_POOL_SIZE * SERVER_PROCESSES)
+        queue = {
+            "queue_depth": server_state.queue_depth,
+            "busy_workers": server_state.busy_workers,
+            "workers": server_capacity(),
+            "queue_sojourn": server_state.last_sojourn,
+            "queue_sojourn_avg": server_state.sojourn_avg,
+            "queue_dropped": server_state.queue_dropped,
+            "queue_rejected": server_state.queue_rejected,
+            "cpu_pool_pending": server_state.cpu_pending,
+            "cpu_queue_depth": cpu_queue_depth
+        }
+
+    weighted_load = sum(count * costs[task_type] for task_type, count in inflight.items())
+    longest_task = max((costs[task_type] for task_type in inflight), default=0.0)
+    return {
+        # Requests waiting for a CPU pool process count again: they hold a worker and wait on saturated cores
+        "load": request_count + cpu_queue_depth,
+        "weighted_load": weighted_load,                                   # Seconds of expected work in flight
+        "predicted_drain_time": max(longest_task, weighted_load / server_capacity()),
+        "utilization": utilization,
+        "inflight": inflight,
+        "task_costs": costs,
+        "task_stats": task_stats,
+        **queue
+    }
+
+def pipeline_key(pipeline):
+    """Canonical string form of an aggregation pipeline, used to match registered aggregates"""
+    return json.dumps(pipeline, sort_keys=True)
+
+def is_number(value):
+    """True for values MongoDB's $sum/$avg accumulate (booleans are ignored)"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+class MaterializedAggregate:
+    """Incrementally maintained result of a single-stage $group pipeline.
+
+    State lives in the materialized_aggregates collection, one document per group,
+    so every server sharing the database updates and serves the same counters.
+    Supported accumulators are {"$sum": 1}, {"$sum": "$field"} and {"$avg": "$field"}.
+    """
+    def __init__(self, name, pipeline):
+        if len(pipeline) != 1 or '$group' not in pipeline[0]:
+            raise ValueError(f"Aggregate {name} must be a single $group stage")
+        group = pipeline[0]['$group']
+        if not isinstance(group.get('_id'), str) or not group['_id'].startswith('$'):
+            raise ValueError(f"Aggregate {name} must group by a single field")
+
+        self.name = name
+        self.pipeline = pipeline
+        self.group_field = group['_id'][1:]
+        self.outputs = []           # (output name, accumulator, source field)
+        self.fields = set()         # Fields whose sums are maintained
+        self.last_refresh = None    # Time of the last full recompute in this process
+
+        for output, expression in group.items():
+            if output == '_id':
+                continue
+            (operator, argument), = expression.items()
+            if operator == '$sum' and argument == 1:
+                self.outputs.append((output, 'count', None))
+            elif operator in ('$sum', '$avg') and isinstance(argument, str) and argument.startswith('$'):
+                self.outputs.append((output, operator[1:], argument[1:]))
+                self.fields.add(argument[1:])
+            else:
+                raise ValueError(f"Unsupported accumulator {operator} in aggregate {name}")
+
+    def state_id(self, group):
+        return {'aggregate': self.name, 'group': group}
+
+    def apply(self, added=(), removed=()):
+        """Fold inserted and removed documents into the stored counters"""
+        deltas = {}
+        for docs, sign in ((added, 1), (removed, -1)):
+            for doc in docs:
+                group = doc.get(self.group_field)
+                inc = deltas.setdefault(pipeline_key(group), (group, {}))[1]
+                inc['count'] = inc.get('count', 0) + sign
+                for field in self.fields:
+                    value = doc.get(field)
+                    if is_number(value):
+                        inc[f'sums.{field}'] = inc.get(f'sums.{field}', 0) + sign * value
+                        inc[f'counts.{field}'] = inc.get(f'counts.{field}', 0) + sign
+
+        operations = []
+        for group, inc in deltas.values():
+            inc = {key: value for key, value in inc.items() if value != 0}
+            if inc:
+                operations.append(UpdateOne({'_id': self.state_id(group)}, {'$inc': inc}, upsert=True))
+        if operations:
+            aggregates_collection.bulk_write(operations, ordered=False)
+
+    def read(self):
+        """Return the pipeline result from stored counters in O(groups)"""
+        if self.last_refresh is None:
+            self.recompute()
+
+        result = []
+        for state in aggregates_collection.find({'_id.aggregate': self.name}):
+            if state.get('count', 0) <= 0:
+                continue
+            doc = {'_id': state['_id']['group']}
+            for output, accumulator, field in self.outputs:
+                if accumulator == 'count':
+                    doc[output] = state['count']
+                elif accumulator == 'sum':
+                    doc[output] = state.get('sums', {}).get(field, 0)
+                else:
+                    count = state.get('counts', {}).get(field, 0)
+                    doc[output] = state['sums'][field] / count if count > 0 else None
+            result.append(doc)
+        return result
+
+    def recompute(self):
+        """Rebuild the counters from a full scan to correct any drift"""
+        group = {'_id': f'${self.group_field}', 'count': {'$sum': 1}}
+        for index, field in enumerate(sorted(self.fields)):
+            group[f'sum_{index}'] = {'$sum': f'${field}'}
+            group[f'n_{index}'] = {'$sum': {'$cond': [{'$isNumber': f'${field}'}, 1, 0]}}
+
+        operations = []
+        groups = []
+        for row in data_collection.aggregate([{'$group': group}]):
+            state = {'count': row['count'], 'sums': {}, 'counts': {}}
+            for index, field in enumerate(sorted(self.fields)):
+                state['sums'][field] = row[f'sum_{index}']
+                state['counts'][field] = row[f'n_{index}']
+            operations.append(UpdateOne({'_id': self.state_id(row['_id'])}, {'$set': state}, upsert=True))
+            groups.append(row['_id'])
+
+        if operations:
+            aggregates_collection.bulk_write(operations, ordered=False)
+        aggregates_collection.delete_many({'_id.aggregate': self.name, '_id.group': {'$nin': groups}})
+        self.last_refresh = time.time()
+
+# Registered aggregates, keyed by canonical pipeline
+materialized_aggregates = {}
+
+def register_aggregate(name, pipeline):
+    """Serve matching db_aggregate pipelines from incrementally maintained counters"""
+    aggregate = MaterializedAggregate(name, pipeline)
+    materialized_aggregates[pipeline_key(pipeline)] = aggregate
+    return aggregate
+
+register_aggregate('users_by_active', [
+    {"$group": {"_id": "$active", "count": {"$sum": 1}, "avg_age": {"$avg": "$age"}}}
+])
+
+def record_user_changes(added=(), removed=()):
+    """Apply inserted, updated or removed user documents to every materialized aggregate"""
+    for aggregate in materialized_aggregates.values():
+        try:
+            aggregate.apply(added, removed)
+        except Exception as e:
+            print(f"Error updating aggregate {aggregate.name}: {str(e)}")
+
+def setup_request_log_retention():
+    """Bound the request log with a capped collection or a TTL index on logged_at.
+
+    With REQUEST_LOG_RETENTION=0 an existing TTL index is dropped so nothing expires. Documents
+    logged before logged_at existed get it backfilled from their timestamp, so they expire too.
+    """
+    if REQUEST_LOG_CAPPED_SIZE > 0:
+        if 'requests' not in db.list_collection_names():
+            db.create_collection('requests', capped=True, size=REQUEST_LOG_CAPPED_SIZE)
+        elif not requests_collection.options().get('capped'):
+            db.command('convertToCapped', 'requests', size=REQUEST_LOG_CAPPED_SIZE)
+    elif REQUEST_LOG_RETENTION > 0:
+        try:
+            requests_collection.create_index('logged_at', expireAfterSeconds=REQUEST_LOG_RETENTION)
+        except OperationFailure:
+            # The TTL index exists with another retention; update it in place
+            db.command('collMod', 'requests', index={
+                'keyPattern': {'logged_at': 1},
+                'expireAfterSeconds': REQUEST_LOG_RETENTION
+            })
+        try:
+            requests_collection.update_many({'logged_at': {'$exists': False}, 'timestamp': {'$type': 'number'}},
+                                            [{'$set': {'logged_at': {'$toDate': {'$multiply': ['$timestamp', 1000]}}}}])
+        except (OperationFailure, NotImplementedError) as e:
+            # Pipeline updates need MongoDB 4.2+; older logs then stay until removed by hand
+            print(f"Could not backfill logged_at on the request log: {str(e)}")
+    else:
+        for name, index in requests_collection.index_information().items():
+            if index['key'] == [('logged_at', 1)] and 'expireAfterSeconds' in index:
+                requests_collection.drop_index(name)
+
+    requests_collection.create_index([('server', ASCENDING), ('timestamp', ASCENDING)])
+    # Covers the /analytics scan so it never fetches full log documents
+    requests_collection.create_index([('timestamp', ASCENDING), ('server', ASCENDING), ('task_type', ASCENDING),
+                                      ('status', ASCENDING), ('processing_time', ASCENDING)])
+    rollups_collection.create_index([('bucket_start', ASCENDING), ('server', ASCENDING)])
+
+# Latency figures cover successful requests only, in both raw and rollup analytics;
+# failures count towards count and errors but their processing_time is left out.
+SUCCESS_LATENCY = {'$cond': [{'$eq': ['$status', 'success']}, '$processing_time', None]}
+
+def latency_histogram_expressions():
+    """$group accumulators counting successful processing times per LATENCY_BUCKETS bucket (last bucket is overflow)"""
+    expressions = {}
+    bounds = [0.0] + LATENCY_BUCKETS + [None]
+    for index in range(len(bounds) - 1):
+        conditions = [{'$eq': ['$status', 'success']}, {'$gte': ['$processing_time', bounds[index]]}]
+        if bounds[index + 1] is not None:
+            conditions.append({'$lt': ['$processing_time', bounds[index + 1]]})
+        expressions[f'h{index}'] = {'$sum': {'$cond': [{'$and': conditions}, 1, 0]}}
+    return expressions
+
+def rollup_request_log(now=None):
+    """Compact closed ROLLUP_BUCKET windows of this server's raw logs into per-task summaries.
+
+    Windows are aligned to ROLLUP_BUCKET, so every summary document is written
+    exactly once and re-running a window overwrites rather than double counts.
+    Returns the number of summary documents written.
+    """
+    now = now or time.time()
+    end = math.floor((now - ROLLUP_LAG) / ROLLUP_BUCKET) * ROLLUP_BUCKET
+    state = rollup_state_collection.find_one({'_id': server_name})
+    if state:
+        start = state['rolled_up_to']
+    else:
+        oldest = requests_collection.find_one({'server': server_name}, sort=[('timestamp', ASCENDING)])
+        if oldest is None:
+            return 0
+        start = math.floor(oldest['timestamp'] / ROLLUP_BUCKET) * ROLLUP_BUCKET
+    end = min(end, start + ROLLUP_MAX_WINDOW)
+    if end <= start:
+        return 0
+
+    group = {
+        '_id': {
+            'bucket_start': {'$subtract': ['$timestamp', {'$mod': ['$timestamp', ROLLUP_BUCKET]}]},
+            'task_type': '$task_type'
+        },
+        'count': {'$sum': 1},
+        'errors': {'$sum': {'$cond': [{'$eq': ['$status', 'success']}, 0, 1]}},
+        'latency_sum': {'$sum': SUCCESS_LATENCY},
+        'latency_max': {'$max': SUCCESS_LATENCY},
+        **latency_histogram_expressions()
+    }
+    rows = requests_collection.aggregate([
+        {'$match': {'server': server_name, 'timestamp': {'$gte': start, '$lt': end}}},
+        {'$group': group}
+    ])
+
+    operations = []
+    for row in rows:
+        key = {'server': server_name, 'task_type': row['_id']['task_type'], 'bucket_start': row['_id']['bucket_start']}
+        operations.append(UpdateOne({'_id': key}, {'$set': {
+            **key,
+            'count': row['count'],
+            'errors': row['errors'],
+            'latency_sum': row['latency_sum'],
+            'latency_max': row['latency_max'],
+            'histogram': [row[f'h{index}'] for index in range(len(LATENCY_BUCKETS) + 1)]
+        }}, upsert=True))
+    if operations:
+        rollups_collection.bulk_write(operations, ordered=False)
+    rollup_state_collection.update_one({'_id': server_name}, {'$set': {'rolled_up_to': end}}, upsert=True)
+    return len(operations)
+
+def summarize_group(count, errors, seconds, latency_sum, percentiles):
+    """Throughput, error rate and latency figures for one analytics group"""
+    successes = count - errors
+    return {
+        "count": count,
+        "errors": errors,
+        "error_rate": errors / count if count else 0.0,
+        "throughput": count / seconds if seconds > 0 else 0.0,
+        "avg_processing_time": latency_sum / successes if successes > 0 else None,
+        **{f"p{round(fraction * 100)}": value for fraction, value in zip(ANALYTICS_PERCENTILES, percentiles)}
+    }
+
+def raw_log_analytics(since, until):
+    """Per-server and per-task figures computed by MongoDB over raw log documents (MongoDB 7.0+ for $percentile)"""
+    accumulators = {
+        'count': {'$sum': 1},
+        'errors': {'$sum': {'$cond': [{'$eq': ['$status', 'success']}, 0, 1]}},
+        'latency_sum': {'$sum': SUCCESS_LATENCY},
+        'percentiles': {'$percentile': {'input': SUCCESS_LATENCY, 'p': ANALYTICS_PERCENTILES, 'method': 'approximate'}}
+    }
+    facets = next(requests_collection.aggregate([
+        {'$match': {'timestamp': {'$gte': since, '$lt': until}}},
+        {'$project': {'_id': 0, 'server': 1, 'task_type': 1, 'status': 1, 'processing_time': 1}},
+        {'$facet': {
+            'overall': [{'$group': {'_id': None, **accumulators}}],
+            'servers': [{'$group': {'_id': '$server', **accumulators}}],
+            'tasks': [{'$group': {'_id': '$task_type', **accumulators}}]
+        }}
+    ]))
+
+    seconds = until - since
+    def summarize(row):
+        return summarize_group(row['count'], row['errors'], seconds, row['latency_sum'], row['percentiles'])
+    return {
+        "overall": summarize(facets['overall'][0]) if facets['overall'] else summarize_group(0, 0, seconds, 0, [None] * 3),
+        "servers": {row['_id']: summarize(row) for row in facets['servers']},
+        "tasks": {row['_id']: summarize(row) for row in facets['tasks']}
+    }
+
+def histogram_percentile(histogram, fraction, latency_max):
+    """Estimate a percentile by interpolating inside LATENCY_BUCKETS"""
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = fraction * total
+    seen = 0
+    for index, count in enumerate(histogram):
+        if count and seen + count >= rank:
+            lower = LATENCY_BUCKETS[index - 1] if index > 0 else 0.0
+            upper = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else max(latency_max, lower)
+            return min(latency_max, lower + (upper - lower) * (rank - seen) / count)
+        seen += count
+    return latency_max
+
+def rollup_analytics(since, until):
+    """Per-server and per-task figures from request_rollups; percentiles are histogram estimates"""
+    groups = {"overall": {}, "servers": {}, "tasks": {}}
+    query = {'bucket_start': {'$gte': math.floor(since / ROLLUP_BUCKET) * ROLLUP_BUCKET, '$lt': until}}
+    for rollup in rollups_collection.find(query):
+        for section, key in (("overall", None), ("servers", rollup['server']), ("tasks", rollup['task_type'])):
+            group = groups[section].setdefault(key, {
+                'count': 0, 'errors': 0, 'latency_sum': 0.0, 'latency_max': 0.0,
+                'histogram': [0] * (len(LATENCY_BUCKETS) + 1)
+            })
+            group['count'] += rollup['count']
+            group['errors'] += rollup['errors']
+            group['latency_sum'] += rollup['latency_sum']
+            group['latency_max'] = max(group['latency_max'], rollup['latency_max'] or 0.0)
+            group['histogram'] = [a + b for a, b in zip(group['histogram'], rollup['histogram'])]
+
+    seconds = until - since
+    def summarize(group):
+        percentiles = [histogram_percentile(group['histogram'], fraction, group['latency_max'])
+                       for fraction in ANALYTICS_PERCENTILES]
+        return summarize_group(group['count'], group['errors'], seconds, group['latency_sum'], percentiles)
+
+    overall = groups["overall"].get(None)
+    return {
+        "overall": summarize(overall) if overall else summarize_group(0, 0, seconds, 0, [None] * 3),
+        "servers": {key: summarize(group) for key, group in groups["servers"].items()},
+        "tasks": {key: summarize(group) for key, group in groups["tasks"].items()}
+    }
+
+def rollup_request_log_periodically():
+    """Background loop applying log retention and rolling up closed buckets"""
+    retention_ready = False
+    while True:
+        try:
+            if not retention_ready:
+                setup_request_log_retention()
+                retention_ready = True
+            while rollup_request_log():
+                pass  # Catch up on backlog one ROLLUP_MAX_WINDOW at a time
+        except Exception as e:
+            print(f"Error rolling up request log: {str(e)}")
+        time.sleep(ROLLUP_INTERVAL)
+
+def start_background_tasks():
+    """Start the aggregate refresh and request log maintenance loops"""
+    threading.Thread(target=refresh_aggregates_periodically, daemon=True).start()
+    threading.Thread(target=rollup_request_log_periodically, daemon=True).start()
+
+def refresh_aggregates_periodically():
+    """Background loop recomputing materialized aggregates from the collection"""
+    while True:
+        time.sleep(AGGREGATE_REFRESH_INTERVAL)
+        for aggregate in materialized_aggregates.values():
+            try:
+                aggregate.recompute()
+            except Exception as e:
+                print(f"Error recomputing aggregate {aggregate.name}: {str(e)}")
+
+class InvalidTaskData(ValueError):
+    """A task's parameters are invalid; answered with 400 rather than 500"""
+
+def task_seed(data):
+    """The task's optional seed, which must be a non-negative integer"""
+    seed = data.get('seed')
+    if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int) or seed < 0):
+        raise InvalidTaskData(f"seed must be a non-negative integer, got {seed!r}")
+    return seed
+
+def make_rng(seed=None):
+    """Random generator for user records, reproducible when a seed is given"""
+    if np is not None:
+        return np.random.default_rng(seed)
+    return random.Random(seed)
+
+def generate_user_batch(rng, size, now):
+    """Build a batch of random user records, vectorized when numpy is available"""
+    if np is None:
+        return [{
+            'username': ''.join(rng.choices(string.ascii_lowercase, k=8)),
+            'email': f"user_{rng.randint(1000, 9999)}@example.com",
+            'age': rng.randint(18, 80),
+            'active': rng.choice([True, False]),
+            'created_at': now - rng.randint(0, 86400 * 30)  # Up to 30 days ago
+        } for _ in range(size)]
+
+    letters = rng.integers(ord('a'), ord('z') + 1, size=(size, 8), dtype=np.uint8)
+    usernames = letters.view('S8').ravel().astype('U8').tolist()
+    emails = rng.integers(1000, 10000, size=size).tolist()
+    ages = rng.integers(18, 81, size=size).tolist()
+    active = (rng.random(size) < 0.5).tolist()
+    created_at = (now - rng.integers(0, 86400 * 30 + 1, size=size)).tolist()
+    return [{
+        'username': username,
+        'email': f"user_{email}@example.com",
+        'age': age,
+        'active': is_active,
+        'created_at': created
+    } for username, email, age, is_active, created in zip(usernames, emails, ages, active, created_at)]
+
+class BulkGenerationJob:
+    """Progress of a background db_generate_data bulk job"""
+    def __init__(self, total, seed=None, batch_size=BULK_BATCH_SIZE):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.total = total
+        self.seed = seed
+        self.batch_size = batch_size
+        self.inserted = 0
+        self.status = "pending"
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def record(self):
+        """State stored in the shared job table"""
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "total": self.total,
+            "inserted": self.inserted,
+            "seed": self.seed,
+            "error": self.error[:200] if self.error else None,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+    def to_dict(self):
+        return job_report(self.record())
+
+def job_report(record):
+    """Progress report of a job record, as returned by /jobs"""
+    elapsed = (record["finished_at"] or time.time()) - record["started_at"]
+    return {
+        "job_id": record["job_id"],
+        "server": server_name,
+        "status": record["status"],
+        "total": record["total"],
+        "inserted": record["inserted"],
+        "progress": record["inserted"] / record["total"] if record["total"] else 1.0,
+        "records_per_second": record["inserted"] / elapsed if elapsed > 0 else 0,
+        "elapsed": elapsed,
+        "seed": record["seed"],
+        "error": record["error"]
+    }
+
+class BulkJobTable:
+    """Bulk job records in shared memory, so every server process can report every job.
+
+    Each slot holds one job's record as JSON; the process running the job rewrites it as it progresses.
+    """
+    def __init__(self, shared=False):
+        self.records = multiprocessing.RawArray('c', MAX_BULK_JOBS * BULK_JOB_RECORD_SIZE)
+        self.lock = multiprocessing.Lock() if shared else threading.Lock()
+
+    def read(self, slot):
+        raw = self.records[slot * BULK_JOB_RECORD_SIZE:(slot + 1) * BULK_JOB_RECORD_SIZE].rstrip(b'\0')
+        return json.loads(raw) if raw else None
+
+    def write(self, slot, job):
+        record = job.record()
+        data = json.dumps(record).encode()
+        if len(data) > BULK_JOB_RECORD_SIZE:
+            record["seed"] = str(job.seed)[:100]     # Only an oversized seed can overflow a slot
+            data = json.dumps(record).encode()
+        self.records[slot * BULK_JOB_RECORD_SIZE:(slot + 1) * BULK_JOB_RECORD_SIZE] = data.ljust(BULK_JOB_RECORD_SIZE, b'\0')
+
+    def add(self, job):
+        """Store a new job in a free slot, or the slot of the oldest finished job; raises RuntimeError when all are running"""
+        with self.lock:
+            records = [self.read(slot) for slot in range(MAX_BULK_JOBS)]
+            free = [slot for slot, record in enumerate(records) if record is None]
+            if not free:
+                free = sorted((record["finished_at"], slot) for slot, record in enumerate(records)
+                              if record["finished_at"])
+                free = [slot for _, slot in free]
+            if not free:
+                raise RuntimeError(f"{MAX_BULK_JOBS} bulk jobs are already running")
+            job.slot = free[0]
+            self.write(job.slot, job)
+
+    def update(self, job):
+        with self.lock:
+            self.write(job.slot, job)
+
+    def jobs(self):
+        with self.lock:
+            records = [self.read(slot) for slot in range(MAX_BULK_JOBS)]
+        return sorted((record for record in records if record), key=lambda record: record["started_at"])
+
+    def get(self, job_id):
+        return next((record for record in self.jobs() if record["job_id"] == job_id), None)
+
+bulk_jobs = BulkJobTable()
+
+def run_bulk_generation(job):
+    """Generate and insert records batch by batch so memory stays bounded"""
+    job.status = "running"
+    bulk_jobs.update(job)
+    now = time.time()
+    try:
+        rng = make_rng(job.seed)
+        while job.inserted < job.total:
+            records = generate_user_batch(rng, min(job.batch_size, job.total - job.inserted), now)
+            data_collection.insert_many(records, ordered=False)
+            record_user_changes(added=records)
+            job.inserted += len(records)
+            bulk_jobs.update(job)
+        job.status = "completed"
+    except Exception as e:
+        job.status = "failed"
+        job.error = str(e)
+    job.finished_at = time.time()
+    bulk_jobs.update(job)
+
+def start_bulk_generation(total, seed=None, batch_size=BULK_BATCH_SIZE):
+    """Start a tracked background bulk generation job"""
+    job = BulkGenerationJob(total, seed, batch_size)
+    bulk_jobs.add(job)
+    threading.Thread(target=run_bulk_generation, args=(job,), daemon=True).start()
+    return job
+
+def task_addition(data):
+    return data.get('num1', 0) + data.get('num2', 0)
+
+def task_multiplication(data):
+    return data.get('num1', 1) * data.get('num2', 1)
+
+def task_factorial(data):
+    return math.factorial(min(data.get('num', 1), 10))  # Limit for safety
+
+def task_string_length(data):
+    return len(data.get('text', ''))
+
+def task_find_vowels(data):
+    return len([char for char in data.get('text', '') if char.lower() in 'aeiou'])
+
+# Typed array dtypes accepted by sort_large_list and their array module typecodes
+TYPED_ARRAY_CODES = {
+    'int8': 'b', 'uint8': 'B', 'int16': 'h', 'uint16': 'H', 'int32': 'i', 'uint32': 'I',
+    'int64': 'q', 'uint64': 'Q', 'float32': 'f', 'float64': 'd'
+}
+
+def typed_array_buffer(numbers):
+    """Raw little-endian bytes of a typed array payload ({"dtype", "data"}; data is bytes or base64)"""
+    if numbers.get('dtype') not in TYPED_ARRAY_CODES:
+        raise ValueError(f"Unsupported dtype {numbers.get('dtype')}")
+    data = numbers.get('data', b'')
+    return base64.b64decode(data) if isinstance(data, str) else data
+
+def typed_array_length(dtype, buffer):
+    return len(buffer) // array.array(TYPED_ARRAY_CODES[dtype]).itemsize
+
+def sort_typed_array(dtype, buffer):
+    """Sort a decoded typed array without building Python numbers; returns the payload form"""
+    if np is not None:
+        values = np.frombuffer(buffer, dtype=np.dtype(dtype).newbyteorder('<'))
+        return {'dtype': dtype, 'data': np.sort(values).tobytes()}
+
+    values = array.array(TYPED_ARRAY_CODES[dtype], buffer)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    values = array.array(values.typecode, sorted(values))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return {'dtype': dtype, 'data': values.tobytes()}
+
+def task_sort_large_list(data):
+    numbers = data.get('numbers', [])
+    typed = isinstance(numbers, dict)
+    if typed:
+        buffer = typed_array_buffer(numbers)    # Decoded once for both the size check and the sort
+    if (typed_array_length(numbers['dtype'], buffer) if typed else len(numbers)) > MAX_SORT_SIZE:
+        raise ValueError(f"sort_large_list accepts at most {MAX_SORT_SIZE} numbers")
+    return sort_typed_array(numbers['dtype'], buffer) if typed else sorted(numbers)
+
+def task_db_create_user(data):
+    user_data = data.get('user_data', {})
+    user_data['created_at'] = time.time()
+    result = data_collection.insert_one(user_data)
+    record_user_changes(added=[user_data])
+    return str(result.inserted_id)
+
+def task_db_find_users(data):
+    query = data.get('query', {})
+    limit = min(data.get('limit', 10), 100)  # Limit response size
+    result = list(data_collection.find(query, limit=limit))
+    # Convert ObjectId to string for JSON serialization
+    for doc in result:
+        doc['_id'] = str(doc['_id'])
+    return result
+
+def task_db_update_user(data):
+    update_data = data.get('update_data', {})
+    update_data['updated_at'] = time.time()
+    previous = data_collection.find_one_and_update(
+        {'_id': data.get('user_id', '')},
+        {'$set': update_data},
+        return_document=ReturnDocument.BEFORE
+    )
+    if previous is None:
+        return 0
+    record_user_changes(added=[{**previous, **update_data}], removed=[previous])
+    return 1
+
+def task_db_aggregate(data):
+    pipeline = data.get('pipeline', [])
+    aggregate = materialized_aggregates.get(pipeline_key(pipeline))
+    if aggregate and data.get('materialized', True):
+        result = aggregate.read()
+    else:
+        result = list(data_collection.aggregate(pipeline))
+    # Convert ObjectId to string for JSON serialization
+    for doc in result:
+        if '_id' in doc:
+            doc['_id'] = str(doc['_id'])
+    return result
+
+def task_db_generate_data(data):
+    seed = task_seed(data)
+    if data.get('bulk'):
+        # Large seeding runs as a background job polled through /jobs/<job_id>
+        count = min(data.get('count', BULK_BATCH_SIZE), BULK_MAX_RECORDS)
+        batch_size = max(1, min(data.get('batch_size', BULK_BATCH_SIZE), BULK_BATCH_SIZE))
+        return start_bulk_generation(count, seed, batch_size).to_dict()
+
+    count = min(data.get('count', 10), GENERATE_MAX_RECORDS)  # Limit for safety
+    records = generate_user_batch(make_rng(seed), count, time.time())
+    result = data_collection.insert_many(records)
+    record_user_changes(added=records)
+    return len(result.inserted_ids)
+
+TASK_HANDLERS = {
+    'addition': task_addition,
+    'multiplication': task_multiplication,
+    'factorial': task_factorial,
+    'string_length': task_string_length,
+    'find_vowels': task_find_vowels,
+    'sort_large_list': task_sort_large_list,
+    'db_create_user': task_db_create_user,
+    'db_find_users': task_db_find_users,
+    'db_update_user': task_db_update_user,
+    'db_aggregate': task_db_aggregate,
+    'db_generate_data': task_db_generate_data
+}
+
+def load_delay(current_load):
+    """Base processing delay for the current load"""
+    # Exponential backoff as load increases
+    return 0.1 * (1.5 ** (current_load - 1))
+
+def under_heavy_load():
+    """Whether in-flight requests, queued ones included, exceed MAX_CONCURRENT per server process.
+
+    The base delay follows busy workers, which never exceed WORKER_COUNT; this heavy-load
+    slowdown follows the whole backlog instead.
+    """
+    return get_current_load() > MAX_CONCURRENT * SERVER_PROCESSES
+
+cpu_pool = None
+cpu_pool_lock = threading.Lock()
+
+def get_cpu_pool():
+    """Process pool for large CPU-bound tasks, created on first use in each server process"""
+    global cpu_pool
+    with cpu_pool_lock:
+        if cpu_pool is None:
+            cpu_pool = ProcessPoolExecutor(max_workers=CPU_POOL_SIZE,
+                                           mp_context=multiprocessing.get_context('forkserver'))
+        return cpu_pool
+
+def should_offload(task_type, data):
+    """True when a CPU-bound task's payload is large enough to run in the process pool"""
+    threshold = OFFLOAD_THRESHOLDS.get(task_type)
+    if threshold is None:
+        return False
+    payload = data.get('numbers', []) if task_type == 'sort_large_list' else data.get('text', '')
+    if isinstance(payload, dict):
+        # Typed arrays are sorted by numpy, which releases the GIL, so they stay inline
+        return False
+    return len(payload) >= threshold
+
+def submit_cpu_task(task_type, data):
+    """Submit a task to the CPU pool, counting it as pending until it finishes"""
+    update_queue_counters(cpu_pending=1)
+    future = get_cpu_pool().submit(TASK_HANDLERS[task_type], data)
+    future.add_done_callback(lambda _: update_queue_counters(cpu_pending=-1))
+    return future
+
+def execute_task(task_type, data):
+    """Run a task handler inline, or in the CPU pool when its payload is large"""
+    if should_offload(task_type, data):
+        return submit_cpu_task(task_type, data).result()
+    return TASK_HANDLERS[task_type](data)
+
+def run_task(task_type, data, current_load):
+    """Simulate load-dependent processing delay, then execute the task"""
+    base_delay = load_delay(current_load)
+    with request_tracing.span('server.delay'):
+        time.sleep(base_delay * TASK_DELAY_FACTORS[task_type])
+    with request_tracing.span('server.db' if task_type.startswith('db_') else 'server.task'):
+        result = execute_task(task_type, data)
+
+    # Add additional delay if server is under heavy load
+    if under_heavy_load():
+        with request_tracing.span('server.delay'):
+            time.sleep(base_delay * 2)
+    return result
+
+INVALID_ITEM_ERRORS = ("Invalid task type", "Task must be an object")
+
+def batch_item(task):
+    """(task type, error) of one batch item; error is None when the item can run"""
+    if not isinstance(task, dict):
+        return "unknown", "Task must be an object"
+    task_type = task.get('task_type', 'addition')
+    if not isinstance(task_type, str) or task_type not in TASK_HANDLERS:
+        return str(task_type), "Invalid task type"
+    return task_type, None
+
+def plan_batch(tasks):
+    """Results pre-filled with errors for invalid items, and the batch's combined delay factor"""
+    results = [None] * len(tasks)
+    delay_factor = 0.0
+    for index, task in enumerate(tasks):
+        item_type, error = batch_item(task)
+        if error:
+            results[index] = {"task": item_type, "error": error}
+        else:
+            delay_factor += TASK_DELAY_FACTORS[item_type]
+    return results, delay_factor
+
+def execute_batch(tasks, results):
+    """Execute the batch items plan_batch left open, filling in `results`.
+
+    db_create_user and inline db_generate_data tasks are combined into a single insert_many.
+    """
+    users = []          # (index, user document) for db_create_user
+    generated = []      # (index, records) for db_generate_data
+    for index, task in enumerate(tasks):
+        if results[index] is not None:
+            continue
+        item_type = task.get('task_type', 'addition')
+        try:
+            if item_type == 'db_create_user':
+                user = dict(task.get('user_data', {}), created_at=time.time())
+                users.append((index, user))
+            elif item_type == 'db_generate_data' and not task.get('bulk'):
+                count = min(task.get('count', 10), GENERATE_MAX_RECORDS)
+                generated.append((index, generate_user_batch(make_rng(task_seed(task)), count, time.time())))
+            else:
+                with request_tracing.span('server.db' if item_type.startswith('db_') else 'server.task'):
+                    results[index] = {"task": item_type, "result": execute_task(item_type, task)}
+        except Exception as e:
+            results[index] = {"task": item_type, "error": str(e)}
+
+    documents = [user for _, user in users] + [record for _, records in generated for record in records]
+    if documents:
+        try:
+            with request_tracing.span('server.db'):
+                inserted_ids = data_collection.insert_many(documents, ordered=False).inserted_ids
+            record_user_changes(added=documents)
+            for position, (index, _) in enumerate(users):
+                results[index] = {"task": "db_create_user", "result": str(inserted_ids[position])}
+            for index, records in generated:
+                results[index] = {"task": "db_generate_data", "result": len(records)}
+        except Exception as e:
+            for index, _ in users + generated:
+                results[index] = {"task": tasks[index].get('task_type'), "error": str(e)}
+    return results
+
+def run_batch(task_type, tasks, current_load):
+    """Execute a batch of tasks with one simulated delay and grouped database writes.
+
+    Returns one entry per task with either a result or an error.
+    """
+    results, delay_factor = plan_batch(tasks)
+    base_delay = load_delay(current_load)
+    with request_tracing.span('server.delay'):
+        time.sleep(base_delay * delay_factor)
+    execute_batch(tasks, results)
+
+    # Add additional delay if server is under heavy load
+    if under_heavy_load():
+        with request_tracing.span('server.delay'):
+            time.sleep(base_delay * 2)
+    return results
+
+class WorkItem:
+    """A request waiting for, or being executed by, a scheduler worker"""
+    def __init__(self, task_type, data, runner=None):
+        self.task_type = task_type
+        self.data = data
+        self.runner = runner or run_task
+        self.trace = request_tracing.current_trace.get()     # Spans recorded by the worker go to the request's trace
+        self.enqueued_at = time.time()
+        self.done = threading.Event()
+        self.status = "queued"      # queued, completed, failed or dropped
+        self.result = None
+        self.error = None
+        self.sojourn = 0.0          # Time spent waiting in the queue
+        self.execution_time = 0.0   # Time spent in the worker
+
+class RequestScheduler:
+    """Bounded request queue served by a fixed worker pool.
+
+    Queue delay is controlled with CoDel: once the sojourn time of dequeued
+    requests has stayed above CODEL_TARGET for CODEL_INTERVAL, requests are
+    dropped at an increasing rate until it falls back under target. Under
+    sustained queueing the queue is served LIFO so fresh requests still meet
+    their deadlines, while requests older than QUEUE_DEADLINE are dropped.
+    """
+    def __init__(self, workers=WORKER_COUNT, capacity=QUEUE_CAPACITY):
+        self.workers = workers
+        self.capacity = capacity
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.started = False
+        self.busy = 0
+        self.lifo = False
+        self.above_target_since = None  # Start of the current standing-queue period
+        self.first_above_time = None    # CoDel: first dequeue above target in this period
+        self.dropping = False           # CoDel drop state
+        self.drop_count = 0
+        self.drop_next = 0.0
+
+    def ensure_started(self):
+        """Start worker threads on first use (after any fork)"""
+        with self.condition:
+            if self.started:
+                return
+            self.started = True
+        for _ in range(self.workers):
+            threading.Thread(target=self.worker_loop, daemon=True).start()
+
+    def submit(self, item):
+        """Queue a work item, returning False when the server-wide queue (all processes) is full"""
+        self.ensure_started()
+        with self.condition:
+            if not try_enqueue(self.capacity * SERVER_PROCESSES):
+                return False
+            self.queue.append(item)
+            self.condition.notify()
+            return True
+
+    def drop(self, item):
+        """Complete an item removed from the queue without executing it (caller holds the lock)"""
+        item.status = "dropped"
+        update_queue_counters(dropped=1)
+        item.done.set()
+
+    def update_mode(self, now):
+        """Serve LIFO while the oldest queued request has waited above target for LIFO_AFTER"""
+        oldest_wait = now - self.queue[0].enqueued_at if self.queue else 0.0
+        if oldest_wait < CODEL_TARGET:
+            self.above_target_since = None
+            self.lifo = False
+        elif self.above_target_since is None:
+            self.above_target_since = now
+        elif now - self.above_target_since >= LIFO_AFTER:
+            self.lifo = True
+
+    def should_drop(self, sojourn, now):
+        """CoDel control law for an item that has just left the queue (caller holds the lock)"""
+        if sojourn < CODEL_TARGET or not self.queue:
+            self.first_above_time = None
+            self.dropping = False
+            return False
+
+        if self.first_above_time is None:
+            self.first_above_time = now
+        if now - self.first_above_time < CODEL_INTERVAL:
+            return False
+
+        if not self.dropping:
+            self.dropping = True
+            # Resume near the previous drop rate if we only just left the drop state
+            self.drop_count = self.drop_count - 2 if now - self.drop_next < CODEL_INTERVAL and self.drop_count > 2 else 1
+            self.drop_next = now + CODEL_INTERVAL / math.sqrt(self.drop_count)
+            return True
+        if now >= self.drop_next:
+            self.drop_count += 1
+            self.drop_next = now + CODEL_INTERVAL / math.sqrt(self.drop_count)
+            return True
+        return False
+
+    def next_item(self):
+        """Block until a work item should be executed"""
+        with self.condition:
+            while True:
+                if not self.queue:
+                    # An empty queue ends any standing-queue period
+                    self.above_target_since = None
+                    self.lifo = False
+                while not self.queue:
+                    self.condition.wait()
+
+                now = time.time()
+                while self.queue and now - self.queue[0].enqueued_at > QUEUE_DEADLINE:
+                    update_queue_counters(queued=-1)
+                    self.drop(self.queue.popleft())
+                if not self.queue:
+                    continue
+
+                self.update_mode(now)
+                item = self.queue.pop() if self.lifo else self.queue.popleft()
+                item.sojourn = now - item.enqueued_at
+                update_queue_counters(queued=-1)
+                record_sojourn(item.sojourn)
+                if self.should_drop(item.sojourn, now):
+                    self.drop(item)
+                    continue
+
+                self.busy += 1
+                update_queue_counters(busy=1)
+                return item, self.busy
+
+    def worker_loop(self):
+        while True:
+            item, busy = self.next_item()
+            started = time.time()
+            if item.trace is not None:
+                item.trace.add('server.queue', item.enqueued_at, item.sojourn)
+            try:
+                with request_tracing.activate(item.trace):
+                    item.result = item.runner(item.task_type, item.data, busy)
+                item.status = "completed"
+            except Exception as e:
+                item.error = e
+                item.status = "failed"
+            item.execution_time = time.time() - started
+            with self.condition:
+                self.busy -= 1
+                update_queue_counters(busy=-1)
+            item.done.set()
+
+    def metrics(self):
+        """Scheduler settings of this process; counters are reported from ServerState"""
+        with self.condition:
+            return {
+                "queue_capacity": self.capacity * SERVER_PROCESSES,
+                "queue_mode": "lifo" if self.lifo else "fifo"
+            }
+
+scheduler = RequestScheduler()
+
+def request_log_entry(task_type, processing_time, result, status="success"):
+    """Document recorded in the requests collection for one task"""
+    return {
+        'server': server_name,
+        'task_type': task_type,
+        'processing_time': processing_time,
+        'timestamp': time.time(),
+        'logged_at': datetime.now(timezone.utc),  # BSON date for the retention TTL index
+        'status': status,
+        'result': str(result)[:100]  # Truncate result if too long
+    }
+
+def log_request_to_db(task_type, processing_time, result, status="success"):
+    """Log request information to database"""
+    try:
+        with request_tracing.span('server.log'):
+            requests_collection.insert_one(request_log_entry(task_type, processing_time, result, status))
+    except Exception as e:
+        print(f"Error logging to database: {str(e)}")
+
+def log_requests_to_db(entries):
+    """Log several request entries in one write"""
+    if not entries:
+        return
+    try:
+        with request_tracing.span('server.log'):
+            requests_collection.insert_many(entries, ordered=False)
+    except Exception as e:
+        print(f"Error logging to database: {str(e)}")
+
+def batch_task_counts(tasks):
+    """Number of tasks of each known type in a batch"""
+    type_counts = {}
+    for task in tasks:
+        task_type, error = batch_item(task)
+        if error is None:
+            type_counts[task_type] = type_counts.get(task_type, 0) + 1
+    return type_counts
+
+def batch_log_entries(results, share):
+    """Request log entries for the results of run_batch, each charged `share` seconds"""
+    entries = []
+    for entry in results:
+        if "error" in entry:
+            status = "invalid_task" if entry["error"] in INVALID_ITEM_ERRORS else "error"
+            entries.append(request_log_entry(entry["task"], share, entry["error"], status))
+        else:
+            entries.append(request_log_entry(entry["task"], share, entry["result"]))
+    return entries
+
+def read_task_body():
+    """Decode a JSON or msgpack request body"""
+    return wire_format.loads(request.get_data(), request.content_type,
+                             request.headers.get('Content-Encoding'))
+
+def encoded_response(payload, code=200):
+    """Respond in the format and encoding the caller accepts"""
+    body, headers = wire_format.encode_response(payload, request.headers.get('Accept'),
+                                                request.headers.get('Accept-Encoding'))
+    return Response(body, status=code, headers=headers)
+
+def overloaded_response(current_load, **details):
+    """503 returned when the request could not be queued or was dropped from the queue"""
+    return encoded_response({
+        "error": "Server overloaded",
+        "server": server_name,
+        "current_load": current_load,
+        **details
+    }, 503)
+
+def build_health_report():
+    """Server status and HTTP code reported by /health"""
+    current_load = get_current_load()
+    status = "healthy"
+    code = 200
+
+    if current_load > OVERLOAD_THRESHOLD:
+        status = "overloaded"
+        code = 503
+    elif current_load > MAX_CONCURRENT:
+        status = "heavy_load"
+
+    load_metrics = get_load_metrics()
+    return {
+        "server": server_name,
+        "status": status,
+        "current_load": current_load,
+        "total_requests": server_state.total_requests,
+        "weighted_load": load_metrics["weighted_load"],
+        "predicted_drain_time": load_metrics["predicted_drain_time"],
+        "utilization": load_metrics["utilization"]
+    }, code
+
+def faults_enabled():
+    """Fault injection is off unless protected by ADMIN_TOKEN or explicitly enabled"""
+    return ADMIN_TOKEN is not None or ENABLE_FAULTS
+
+def admin_authorized(headers):
+    return ADMIN_TOKEN is None or hmac.compare_digest(headers.get('X-Admin-Token', ''), ADMIN_TOKEN)
+
+def set_faults(data):
+    """Replace the injected faults with those in an /admin/faults body; raises ValueError on bad values"""
+    latency = float(data.get('latency', 0))
+    error_rate = float(data.get('error_rate', 0))
+    duration = float(data.get('duration', 0))
+    if not (0 <= latency < math.inf and 0 <= duration < math.inf and 0 <= error_rate <= 1):
+        raise ValueError("latency and duration must be non-negative and error_rate between 0 and 1")
+    with server_state.request_lock:
+        server_state.fault_latency = latency
+        server_state.fault_error_rate = error_rate
+        server_state.fault_hang = 1 if data.get('hang') else 0
+        server_state.fault_until = time.time() + duration if duration else 0
+
+def clear_faults():
+    set_faults({})
+
+def current_faults():
+    """Injected faults in effect, or None"""
+    until = server_state.fault_until
+    now = time.time()
+    if until and now >= until:
+        return None
+    if not (server_state.fault_latency or server_state.fault_error_rate or server_state.fault_hang):
+        return None
+    return {
+        "latency": server_state.fault_latency,
+        "error_rate": server_state.fault_error_rate,
+        "hang": bool(server_state.fault_hang),
+        "expires_in": until - now if until else None
+    }
+
+def faults_report():
+    return {"server": server_name, "faults": current_faults()}
+
+def crash_soon():
+    """Exit without any cleanup once the crash request has been answered"""
+    threading.Timer(CRASH_DELAY, os._exit, (1,)).start()
+
+def build_analytics_report(since, until, source):
+    """Analytics reported by /analytics for a window and source, with the HTTP code"""
+    if until <= since or source not in ('raw', 'rollup'):
+        return {"error": "Expected since < until and source raw or rollup"}, 400
+
+    started = time.time()
+    requested_source, fallback_reason = source, None
+    try:
+        if source == 'raw':
+            try:
+                report = raw_log_analytics(since, until)
+            except (OperationFailure, NotImplementedError) as e:
+                print(f"Raw analytics unavailable, using rollups: {str(e)}")
+                source, fallback_reason = 'rollup', str(e) or type(e).__name__
+        if source == 'rollup':
+            report = rollup_analytics(since, until)
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+    return {
+        "server": server_name,
+        "source": source,
+        "requested_source": requested_source,
+        "fallback_reason": fallback_reason,
+        "window": {"since": since, "until": until, "seconds": until - since},
+        "query_time": time.time() - started,
+        **report
+    }, 200
+
+def build_load_report(queue_metrics):
+    """Load metrics reported by /load"""
+    return {
+        "server": server_name,
+        **get_load_metrics(),
+        **queue_metrics,
+        "processes": SERVER_PROCESSES,
+        "total_requests": server_state.total_requests
+    }
+
+@app.before_request
+def start_trace():
+    """Trace task requests under the caller's request ID (or a new one)"""
+    if request.endpoint in TRACED_ENDPOINTS:
+        g.trace = request_tracing.RequestTrace(request.headers.get(request_tracing.REQUEST_ID_HEADER), 'server')
+        request_tracing.current_trace.set(g.trace)
+
+@app.after_request
+def finish_trace(response):
+    """Return the request's spans in Server-Timing and send them to the collector"""
+    trace = g.pop('trace', None)
+    if trace is not None:
+        request_tracing.current_trace.set(None)
+        trace.finish()
+        response.headers[request_tracing.REQUEST_ID_HEADER] = trace.request_id
+        response.headers[request_tracing.TIMING_HEADER] = trace.server_timing()
+    return response
+
+@app.before_request
+def inject_faults():
+    """Apply faults set through /admin/faults to every other endpoint"""
+    if request.path.startswith('/admin/'):
+        return None
+    faults = current_faults()
+    if faults is None:
+        return None
+    with request_tracing.span('server.fault'):
+        while faults and faults["hang"]:
+            time.sleep(FAULT_POLL_INTERVAL)
+            faults = current_faults()
+        if faults is not None and faults["latency"]:
+            time.sleep(faults["latency"])
+    if faults is None:
+        return None
+    if random.random() < faults["error_rate"]:
+        return encoded_response({"error": "Injected fault", "server": server_name}, 500)
+    return None
+
+@app.route('/admin/faults', methods=['GET', 'POST', 'DELETE'])
+def admin_faults():
+    """Show (GET), inject (POST) or clear (DELETE) faults.
+
+    POST takes {"latency": seconds, "error_rate": 0..1, "hang": bool, "duration": seconds} and
+    replaces any faults in effect; {"crash": true} makes the server exit abruptly instead.
+    """
+    if not faults_enabled():
+        return jsonify({"error": "Fault injection is disabled; set ADMIN_TOKEN or ENABLE_FAULTS=1"}), 404
+    if not admin_authorized(request.headers):
+        return jsonify({"error": "Admin token required"}), 403
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        if data.get('crash'):
+            crash_soon()
+            return jsonify({"server": server_name, "crashing": True}), 202
+        try:
+            set_faults(data)
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+    elif request.method == 'DELETE':
+        clear_faults()
+    return jsonify(faults_report())
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    """Health check endpoint that reports server status"""
+    report, code = build_health_report()
+    return jsonify(report), code
+
+@app.route('/load', methods=['GET'])
+def get_load():
+    """Return current server load metrics"""
+    return jsonify(build_load_report(scheduler.metrics()))
+
+@app.route('/analytics', methods=['GET'])
+def get_analytics():
+    """Throughput, error rates and processing_time percentiles from the request log.
+
+    Query parameters: since/until (epoch seconds, default the last ANALYTICS_DEFAULT_WINDOW
+    seconds) and source ("raw" log documents or "rollup" summaries). Raw analysis falls
+    back to rollups when the database does not support $percentile; "source" names the
+    one that answered and "fallback_reason" says why it differs from "requested_source".
+    """
+    until = request.args.get('until', default=time.time(), type=float)
+    since = request.args.get('since', default=until - ANALYTICS_DEFAULT_WINDOW, type=float)
+    report, code = build_analytics_report(since, until, request.args.get('source', 'raw'))
+    return jsonify(report), code
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """List bulk generation jobs started on this server"""
+    return jsonify({"server": server_name, "jobs": [job_report(record) for record in bulk_jobs.jobs()]})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Report progress of a bulk generation job"""
+    record = bulk_jobs.get(job_id)
+    if record is None:
+        return jsonify({"error": "Unknown job", "server": server_name}), 404
+    return jsonify(job_report(record))
+
+@app.route('/request', methods=['POST'])
+def handle_request():
+    """Handle incoming task requests with load-based processing"""
+    current_load = update_load(1)  # Increment load counter
+    start_time = time.time()
+    result = None
+    task_type = "unknown"
+
+    try:
+        data = read_task_body()
+        task_type = data.get('task_type', 'addition')
+
+        if task_type not in TASK_HANDLERS:
+            update_load(-1)  # Decrement load counter
+            log_request_to_db(task_type, 0, None, "invalid_task")
+            return encoded_response({"error": "Invalid task type"}, 400)
+
+        # Queue the task for the worker pool; reject if the queue is full
+        begin_task(task_type)
+        item = WorkItem(task_type, data)
+        if not scheduler.submit(item):
+            finish_task(task_type)
+            update_load(-1)
+            return overloaded_response(current_load)
+
+        item.done.wait()
+        if item.status == "dropped":
+            finish_task(task_type)
+            log_request_to_db(task_type, time.time() - start_time, None, "dropped")
+            update_load(-1)
+            return overloaded_response(current_load, queue_time=item.sojourn)
+        if item.error is not None:
+            finish_task(task_type)
+            raise item.error
+        result = item.result
+
+        processing_time = time.time() - start_time
+        finish_task(task_type, item.execution_time)
+        response = {
+            "server": server_name,
+            "task": task_type,
+            "result": result,
+            "load": current_load,
+            "processing_time": processing_time,
+            "queue_time": item.sojourn
+        }
+
+        # Log successful request to database
+        log_request_to_db(task_type, processing_time, result)
+
+        update_load(-1)  # Decrement load counter
+        return encoded_response(response)
+
+    except wire_format.UnsupportedFormat as e:
+        update_load(-1)
+        return jsonify({"error": f"Unsupported content type {str(e)}"}), 415
+
+    except InvalidTaskData as e:
+        log_request_to_db(task_type, time.time() - start_time, str(e), "invalid_task")
+        update_load(-1)
+        return encoded_response({"error": str(e)}, 400)
+
+    except Exception as e:
+        processing_time = time.time() - start_time
+        log_request_to_db(task_type, processing_time, str(e), "error")
+        update_load(-1)  # Decrement load counter
+        return encoded_response({"error": str(e)}, 500)
+
+@app.route('/batch', methods=['POST'])
+def handle_batch():
+    """Run many tasks as one request: one load entry, grouped DB writes and one log write"""
+    current_load = update_load(1)  # One load entry for the whole batch
+    start_time = time.time()
+
+    try:
+        body = read_task_body()
+        tasks = body.get('tasks') if isinstance(body, dict) else None
+        if not isinstance(tasks, list) or not tasks or len(tasks) > MAX_BATCH_SIZE:
+            update_load(-1)
+            return encoded_response({"error": f"Batch must contain 1 to {MAX_BATCH_SIZE} tasks"}, 400)
+
+        type_counts = batch_task_counts(tasks)
+        for task_type, count in type_counts.items():
+            begin_task(task_type, count)
+
+        item = WorkItem('batch', tasks, runner=run_batch)
+        if not scheduler.submit(item):
+            for task_type, count in type_counts.items():
+                finish_task(task_type, count=count)
+            update_load(-1)
+            return overloaded_response(current_load)
+
+        item.done.wait()
+        if item.status != "completed":
+            for task_type, count in type_counts.items():
+                finish_task(task_type, count=count)
+            update_load(-1)
+            if item.status == "dropped":
+                return overloaded_response(current_load, queue_time=item.sojourn)
+            return encoded_response({"error": str(item.error)}, 500)
+
+        processing_time = time.time() - start_time
+        share = item.execution_time / len(tasks)
+        for task_type, count in type_counts.items():
+            finish_task(task_type, share, count)
+
+        log_requests_to_db(batch_log_entries(item.result, share))
+
+        failed = sum(1 for entry in item.result if "error" in entry)
+        update_load(-1)
+        return encoded_response({
+            "server": server_name,
+            "load": current_load,
+            "processing_time": processing_time,
+            "queue_time": item.sojourn,
+            "succeeded": len(tasks) - failed,
+            "failed": failed,
+            "results": item.result
+        })
+
+    except wire_format.UnsupportedFormat as e:
+        update_load(-1)
+        return jsonify({"error": f"Unsupported content type {str(e)}"}), 415
+
+    except Exception as e:
+        update_load(-1)
+        return encoded_response({"error": str(e)}, 500)
+
+def serve_worker(fd):
+    """Serve the app on an inherited listening socket"""
+    make_server('0.0.0.0', PORT, app, threaded=True, fd=fd).serve_forever()
+
+def serve_multiprocess(processes, port=PORT):
+    """Serve from several forked processes sharing one socket and one ServerState"""
+    global server_state, bulk_jobs
+    server_state = ServerState(shared=True)
+    bulk_jobs = BulkJobTable(shared=True)
+    listener = socket.create_server(('0.0.0.0', port), backlog=1024)
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=serve_worker, args=(listener.fileno(),), daemon=True)
+               for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    start_background_tasks()
+    # A worker that exits (an injected crash or a fatal error) takes the whole server down with it
+    multiprocessing.connection.wait([worker.sentinel for worker in workers])
+    for worker in workers:
+        worker.terminate()
+    sys.exit(1)
+
+if __name__ == "__main__":
+    if SERVER_PROCESSES > 1:
+        serve_multiprocess(SERVER_PROCESSES)
+    else:
+        start_background_tasks()
+        app.run(host='0.0.0.0', port=PORT)
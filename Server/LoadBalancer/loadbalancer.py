@@ -1,33 +1,302 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g
 import requests
 import itertools
 import hashlib
+import heapq
+import hmac
+import ipaddress
+import math
 import random
 import time
+import os
+import sys
+import threading
+from collections import deque, defaultdict, OrderedDict
+# wire_format and request_tracing live in the repo's shared/ directory (copied beside this file in Docker)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'shared'))
+import wire_format
+import request_tracing
 
 app = Flask(__name__)
 
-# Server configuration
-servers = ["http://server1:5000", "http://server2:5000", "http://server3:5000", "http://server4:5000"]
+# Server configuration; BACKEND_SERVERS is a comma-separated list of backend base URLs
+DEFAULT_SERVERS = "http://server1:5000,http://server2:5000,http://server3:5000,http://server4:5000"
+servers = [url.strip() for url in os.environ.get('BACKEND_SERVERS', DEFAULT_SERVERS).split(',') if url.strip()]
+PORT = int(os.environ.get('PORT', 5000))
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')     # When set, registry changes require it in X-Admin-Token; otherwise loopback only
 current_algorithm = "round_robin"
 
+# Headers passed through unchanged so client and server negotiate body format and compression
+FORWARDED_REQUEST_HEADERS = ('Content-Type', 'Content-Encoding', 'Accept')
+FORWARDED_RESPONSE_HEADERS = ('Content-Type', 'Content-Encoding', request_tracing.TIMING_HEADER)
+
+# Recent proxied requests kept for /stats: (finish time, latency seconds, status code)
+PROXY_LOG_SIZE = 10000
+STATS_DEFAULT_WINDOW = 10   # Seconds of proxied requests summarized by /stats
+
+# Per-client admission, off by default: a single-host load generator is one client to the load balancer,
+# so limits sized for multi-tenant fairness would throttle the benchmarks. Clients are identified by
+# CLIENT_ID_HEADER, falling back to the source address. CLIENT_WEIGHTS ("id=weight,...") scales a
+# client's token rate, burst and fair share; unlisted clients weigh 1.
+CLIENT_ID_HEADER = 'X-Client-ID'
+CLIENT_RATE_LIMIT = float(os.environ.get('CLIENT_RATE_LIMIT', 0))      # Tokens per second per unit weight; 0 disables
+CLIENT_BURST = float(os.environ.get('CLIENT_BURST', 200))              # Bucket size per unit weight
+CLIENT_WEIGHTS = {
+    client.strip(): float(weight)
+    for client, _, weight in (entry.partition('=') for entry in os.environ.get('CLIENT_WEIGHTS', '').split(','))
+    if client.strip() and weight
+}
+BUCKET_STRIPES = 64                 # Locks guarding the token buckets; clients hash onto one
+BACKEND_SLOTS = int(os.environ.get('BACKEND_SLOTS', 0))                # Proxied requests in flight per backend; 0 disables
+FAIR_QUEUE_PER_CLIENT = int(os.environ.get('FAIR_QUEUE_PER_CLIENT', 64))  # Waiting requests allowed per client
+FAIR_QUEUE_TIMEOUT = float(os.environ.get('FAIR_QUEUE_TIMEOUT', 10))   # Seconds a request may wait for a slot
+# Client IDs come from the caller, so per-client state is bounded: clients idle for CLIENT_IDLE_TTL are
+# forgotten, and once MAX_TRACKED_CLIENTS are known, new ones share the OVERFLOW_CLIENT bucket and queue.
+MAX_TRACKED_CLIENTS = int(os.environ.get('MAX_TRACKED_CLIENTS', 10000))
+CLIENT_IDLE_TTL = float(os.environ.get('CLIENT_IDLE_TTL', 300))       # Raised to a full bucket refill if longer
+OVERFLOW_CLIENT = '(overflow)'
+
 # Round robin iterator
 server_pool = itertools.cycle(servers)
+servers_lock = threading.Lock()    # Serializes registration; routing reads the current list/pool as-is
+proxy_log = deque(maxlen=PROXY_LOG_SIZE)
 
-# Server state tracking
-server_states = {
-    server: {
+def new_server_state():
+    return {
         'healthy': True,
         'last_check': time.time(),
         'consecutive_failures': 0,
-        'current_load': 0
-    } for server in servers
-}
+        'current_load': 0,
+        'predicted_drain_time': 0
+    }
+
+# Server state tracking
+server_states = {server: new_server_state() for server in servers}
+
+def register_server(server):
+    """Add a backend to the pool; returns False if it was already registered"""
+    global servers, server_pool
+    with servers_lock:
+        if server in servers:
+            return False
+        server_states[server] = new_server_state()
+        # Rebind rather than mutate so in-progress selections keep iterating a consistent list
+        servers = servers + [server]
+        server_pool = itertools.cycle(servers)
+        return True
+
+def deregister_server(server):
+    """Stop routing new requests to a backend; requests already proxied to it finish normally"""
+    global servers, server_pool
+    with servers_lock:
+        if server not in servers:
+            return False
+        servers = [url for url in servers if url != server]
+        server_pool = itertools.cycle(servers)
+        # server_states keeps the entry so concurrent selections that still hold the old list don't fail
+        return True
+
+def client_id():
+    return request.headers.get(CLIENT_ID_HEADER) or request.remote_addr or 'unknown'
+
+class ClientRegistry:
+    """Bounds the clients the admission stages keep state for (LRU by last request)"""
+    def __init__(self, capacity, idle_ttl):
+        self.capacity = capacity
+        self.idle_ttl = idle_ttl
+        self.lock = threading.Lock()
+        self.last_seen = OrderedDict()     # Client -> monotonic time of its last request, oldest first
+        self.next_sweep = 0.0
+        self.overflowed = 0
+
+    def resolve(self, client):
+        """The client to account a request to: itself, or OVERFLOW_CLIENT when the registry is full"""
+        with self.lock:
+            now = time.monotonic()
+            if client in self.last_seen:
+                self.last_seen[client] = now
+                self.last_seen.move_to_end(client)
+                return client
+            if now >= self.next_sweep:
+                self.evict_idle(now)
+                self.next_sweep = now + min(self.idle_ttl, 10.0)
+            if len(self.last_seen) >= self.capacity and client not in CLIENT_WEIGHTS:
+                self.overflowed += 1
+                return OVERFLOW_CLIENT
+            self.last_seen[client] = now
+            return client
+
+    def evict_idle(self, now):
+        """Forget clients idle for idle_ttl; ones with queued requests count as active"""
+        evicted = []
+        while self.last_seen:
+            client, seen = next(iter(self.last_seen.items()))
+            if now - seen < self.idle_ttl:
+                break
+            if fair_scheduler.has_queued(client):
+                self.last_seen[client] = now
+                self.last_seen.move_to_end(client)
+                continue
+            del self.last_seen[client]
+            evicted.append(client)
+        if evicted:
+            rate_limiter.forget(evicted)
+            fair_scheduler.forget(evicted)
+
+    def metrics(self):
+        with self.lock:
+            return {"tracked_clients": len(self.last_seen), "max_tracked_clients": self.capacity,
+                    "overflowed": self.overflowed}
+
+class TokenBuckets:
+    """Per-client token buckets, striped across locks so concurrent clients rarely contend"""
+    def __init__(self, rate, burst, stripes=BUCKET_STRIPES):
+        self.rate = rate
+        self.burst = burst
+        self.locks = [threading.Lock() for _ in range(stripes)]
+        self.buckets = {}           # Client -> [tokens, last refill time]
+        self.limited = defaultdict(int)
+
+    def take(self, client, weight):
+        """Take a token; returns 0 if allowed, otherwise the seconds until one is available"""
+        if self.rate <= 0:
+            return 0.0
+        rate, burst = self.rate * weight, self.burst * weight
+        with self.locks[hash(client) % len(self.locks)]:
+            now = time.monotonic()
+            bucket = self.buckets.get(client)
+            if bucket is None:
+                bucket = self.buckets[client] = [burst, now]
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0.0
+            bucket[0] = tokens
+            self.limited[client] += 1
+            return (1 - tokens) / rate
+
+    def forget(self, clients):
+        for client in clients:
+            with self.locks[hash(client) % len(self.locks)]:
+                self.buckets.pop(client, None)
+                self.limited.pop(client, None)
+
+class Waiter:
+    __slots__ = ('tag', 'seq', 'client', 'event', 'granted')
+
+    def __init__(self, tag, seq, client):
+        self.tag = tag
+        self.seq = seq
+        self.client = client
+        self.event = threading.Event()
+        self.granted = False
+
+    def __lt__(self, other):
+        return (self.tag, self.seq) < (other.tag, other.seq)
+
+class FairScheduler:
+    """Caps proxied requests in flight at BACKEND_SLOTS per backend (no cap when it is 0).
+
+    Below the cap requests pass straight through. Once it is reached they wait, and each freed slot goes
+    to the waiter with the smallest virtual finish tag (start-time fair queueing): a client's tags advance
+    by 1/weight per request, so a client with a deep backlog only gets its weighted share of slots while
+    light clients are served almost immediately.
+    """
+    def __init__(self, slots_per_backend, per_client_queue, timeout):
+        self.slots_per_backend = slots_per_backend
+        self.per_client_queue = per_client_queue
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.waiting = []           # Heap of Waiters
+        self.queued = defaultdict(int)
+        self.last_tag = {}
+        self.virtual_time = 0.0
+        self.seq = itertools.count()
+        self.queue_full = defaultdict(int)
+        self.timed_out = defaultdict(int)
+
+    def capacity(self):
+        return max(1, self.slots_per_backend * len(servers))
+
+    def enabled(self):
+        return self.slots_per_backend > 0
+
+    def acquire(self, client, weight):
+        """Wait for a slot; returns 'admitted', 'queue_full' or 'timeout'"""
+        if not self.enabled():
+            return "admitted"
+        with self.lock:
+            if self.inflight < self.capacity() and not self.waiting:
+                self.inflight += 1
+                return "admitted"
+            if self.queued[client] >= self.per_client_queue:
+                self.queue_full[client] += 1
+                return "queue_full"
+            tag = max(self.virtual_time, self.last_tag.get(client, 0.0)) + 1.0 / weight
+            self.last_tag[client] = tag
+            waiter = Waiter(tag, next(self.seq), client)
+            heapq.heappush(self.waiting, waiter)
+            self.queued[client] += 1
+
+        if waiter.event.wait(self.timeout):
+            return "admitted"
+        with self.lock:
+            if waiter.granted:      # Granted between the timeout and taking the lock
+                return "admitted"
+            self.waiting.remove(waiter)
+            heapq.heapify(self.waiting)
+            self.queued[client] -= 1
+            self.timed_out[client] += 1
+            return "timeout"
+
+    def has_queued(self, client):
+        with self.lock:
+            return self.queued.get(client, 0) > 0
+
+    def forget(self, clients):
+        with self.lock:
+            for client in clients:
+                for counters in (self.queued, self.last_tag, self.queue_full, self.timed_out):
+                    counters.pop(client, None)
+
+    def release(self):
+        """Free the finished request's slot and admit waiters into any free capacity (which grows with the pool)"""
+        if not self.enabled():
+            return
+        with self.lock:
+            self.inflight -= 1
+            capacity = self.capacity()
+            while self.waiting and self.inflight < capacity:
+                waiter = heapq.heappop(self.waiting)
+                self.queued[waiter.client] -= 1
+                self.virtual_time = waiter.tag
+                self.inflight += 1
+                waiter.granted = True
+                waiter.event.set()
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "enabled": self.enabled(),
+                "capacity": self.capacity() if self.enabled() else None,
+                "inflight": self.inflight,
+                "queued": len(self.waiting),
+                "queued_by_client": {client: count for client, count in self.queued.items() if count > 0}
+            }
+
+rate_limiter = TokenBuckets(CLIENT_RATE_LIMIT, CLIENT_BURST)
+fair_scheduler = FairScheduler(BACKEND_SLOTS, FAIR_QUEUE_PER_CLIENT, FAIR_QUEUE_TIMEOUT)
+# A client forgotten before its bucket refilled would come back with a fresh burst
+client_registry = ClientRegistry(MAX_TRACKED_CLIENTS, max(CLIENT_IDLE_TTL, CLIENT_BURST / CLIENT_RATE_LIMIT)
+                                 if CLIENT_RATE_LIMIT > 0 else CLIENT_IDLE_TTL)
 
 def is_server_healthy(server):
     """Check server health and update state"""
     try:
-        response = requests.get(f"{server}/health", timeout=2)
+        with request_tracing.span('lb.health_probe'):
+            response = requests.get(f"{server}/health", timeout=2)
         server_states[server]['last_check'] = time.time()
         
         if response.status_code == 200:
@@ -51,10 +320,13 @@ def is_server_healthy(server):
 def get_server_load(server):
     """Get current load of a server"""
     try:
-        response = requests.get(f"{server}/load", timeout=1)
+        with request_tracing.span('lb.load_probe'):
+            response = requests.get(f"{server}/load", timeout=1)
         if response.status_code == 200:
-            load = response.json().get('load', 0)
+            metrics = response.json()
+            load = metrics.get('load', 0)
             server_states[server]['current_load'] = load
+            server_states[server]['predicted_drain_time'] = metrics.get('predicted_drain_time', 0)
             return load
     except:
         pass
@@ -63,7 +335,9 @@ def get_server_load(server):
 def choose_server_round_robin():
     """Round-robin server selection"""
     for _ in range(len(servers)):
-        server = next(server_pool)
+        server = next(server_pool, None)
+        if server is None:
+            break
         if is_server_healthy(server):
             return server
     return None
@@ -77,12 +351,15 @@ def choose_server_hash(request_data):
           str(request_data.get('text', ''))
     
     # Try servers in hash-determined order
+    candidates = servers
+    if not candidates:
+        return None
     hash_val = int(hashlib.md5(key.encode()).hexdigest(), 16)
-    start_idx = hash_val % len(servers)
+    start_idx = hash_val % len(candidates)
     
-    for i in range(len(servers)):
-        idx = (start_idx + i) % len(servers)
-        server = servers[idx]
+    for i in range(len(candidates)):
+        idx = (start_idx + i) % len(candidates)
+        server = candidates[idx]
         if is_server_healthy(server):
             return server
     return None
@@ -107,43 +384,197 @@ def choose_server_least_loaded():
     
     return chosen_server
 
+def choose_server_least_drain_time():
+    """Select the server predicted to finish its in-flight work soonest"""
+    for server in servers:
+        if is_server_healthy(server):
+            get_server_load(server)
+
+    healthy = [server for server in servers if server_states[server]['healthy']]
+    if not healthy:
+        return None
+    return min(healthy, key=lambda server: (server_states[server]['predicted_drain_time'],
+                                            server_states[server]['current_load']))
+
 @app.route('/set_algorithm', methods=['POST'])
 def set_algorithm():
     global current_algorithm
     data = request.json
     algo = data.get('algorithm', 'round_robin')
     
-    if algo in ["round_robin", "source_hashing", "least_loaded"]:
+    if algo in ["round_robin", "source_hashing", "least_loaded", "least_drain_time"]:
         current_algorithm = algo
         return jsonify({"message": f"Algorithm set to {algo}"})
     else:
         return jsonify({"error": "Invalid algorithm"}), 400
 
+def decode_request_body(body):
+    """Decode a JSON or msgpack request body for algorithms that inspect it"""
+    try:
+        return wire_format.loads(body, request.content_type, request.headers.get('Content-Encoding')) or {}
+    except Exception:
+        return {}
+
+@app.before_request
+def start_trace():
+    """Trace proxied requests under the client's request ID (or a new one)"""
+    if request.endpoint == 'route_request':
+        g.trace = request_tracing.RequestTrace(request.headers.get(request_tracing.REQUEST_ID_HEADER), 'lb')
+        request_tracing.current_trace.set(g.trace)
+
+@app.after_request
+def finish_trace(response):
+    """Put this tier's spans in front of the backend's in Server-Timing and send them to the collector"""
+    trace = g.pop('trace', None)
+    if trace is not None:
+        request_tracing.current_trace.set(None)
+        trace.finish()
+        response.headers[request_tracing.REQUEST_ID_HEADER] = trace.request_id
+        response.headers[request_tracing.TIMING_HEADER] = trace.server_timing(
+            response.headers.get(request_tracing.TIMING_HEADER))
+    return response
+
 @app.route('/request', methods=['POST'])
 def route_request():
-    if current_algorithm == "round_robin":
-        server = choose_server_round_robin()
-    elif current_algorithm == "source_hashing":
-        server = choose_server_hash(request.json)
-    elif current_algorithm == "least_loaded":
-        server = choose_server_least_loaded()
-    else:
-        server = choose_server_round_robin()
+    """Admit the request under its client's rate limit and fair share, then proxy it"""
+    client = client_registry.resolve(client_id())
+    weight = CLIENT_WEIGHTS.get(client, 1.0)
+    with request_tracing.span('lb.admission'):
+        retry_after = rate_limiter.take(client, weight)
+        if retry_after > 0:
+            return (jsonify({"error": "Rate limit exceeded", "client": client}), 429,
+                    {"Retry-After": str(math.ceil(retry_after))})
+        admission = fair_scheduler.acquire(client, weight)
+    if admission == "queue_full":
+        return jsonify({"error": "Too many queued requests for this client", "client": client}), 429
+    if admission == "timeout":
+        proxy_log.append((time.time(), FAIR_QUEUE_TIMEOUT, 503))
+        return jsonify({"error": "Timed out waiting for a backend slot", "client": client}), 503
+    try:
+        return proxy_request(request.get_data())
+    finally:
+        fair_scheduler.release()
+
+def proxy_request(body):
+    """Choose a backend with the current algorithm and relay the request to it"""
+    with request_tracing.span('lb.select'):
+        if current_algorithm == "round_robin":
+            server = choose_server_round_robin()
+        elif current_algorithm == "source_hashing":
+            server = choose_server_hash(decode_request_body(body))
+        elif current_algorithm == "least_loaded":
+            server = choose_server_least_loaded()
+        elif current_algorithm == "least_drain_time":
+            server = choose_server_least_drain_time()
+        else:
+            server = choose_server_round_robin()
     
     if not server:
+        proxy_log.append((time.time(), 0.0, 503))
         return jsonify({"error": "No healthy servers available"}), 503
     
+    start_time = time.time()
+    # Proxy the body as received; the server's response is relayed without re-encoding
+    headers = {name: request.headers[name] for name in FORWARDED_REQUEST_HEADERS if name in request.headers}
+    headers['Accept-Encoding'] = request.headers.get('Accept-Encoding', 'identity')
+    trace = request_tracing.current_trace.get()
+    if trace is not None:
+        headers[request_tracing.REQUEST_ID_HEADER] = trace.request_id
     try:
-        response = requests.post(
-            f"{server}/request",
-            json=request.json,
-            timeout=10
-        )
-        return response.json(), response.status_code
+        # Connecting, sending, the backend's own time and reading the reply; the client derives the
+        # network share by subtracting the backend's server.request span
+        with request_tracing.span('lb.upstream'):
+            response = requests.post(
+                f"{server}/request",
+                data=body,
+                headers=headers,
+                timeout=10,
+                stream=True
+            )
+            content = response.raw.read(decode_content=False)
+        finish_time = time.time()
+        proxy_log.append((finish_time, finish_time - start_time, response.status_code))
+        response_headers = {name: response.headers[name] for name in FORWARDED_RESPONSE_HEADERS
+                            if name in response.headers}
+        return Response(content, status=response.status_code, headers=response_headers)
     except Exception as e:
         server_states[server]['consecutive_failures'] += 1
+        finish_time = time.time()
+        proxy_log.append((finish_time, finish_time - start_time, 500))
         return jsonify({"error": str(e)}), 500
 
+@app.route('/servers', methods=['GET'])
+def list_servers():
+    return jsonify({
+        "servers": [{"url": server, **server_states[server]} for server in servers]
+    })
+
+def admin_authorized():
+    """Registry changes need ADMIN_TOKEN when it is set, and otherwise a caller on this host"""
+    if ADMIN_TOKEN is not None:
+        return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN)
+    try:
+        return ipaddress.ip_address(request.remote_addr).is_loopback
+    except ValueError:
+        return False
+
+@app.route('/servers', methods=['POST', 'DELETE'])
+def update_servers():
+    """Register (POST) or deregister (DELETE) a backend: {"url": "http://host:port"}"""
+    if not admin_authorized():
+        return jsonify({"error": "Admin token required"}), 403
+    data = request.get_json(silent=True) or {}
+    server = str(data.get('url', '')).strip().rstrip('/')
+    if not server:
+        return jsonify({"error": "url is required"}), 400
+
+    if request.method == 'POST':
+        changed = register_server(server)
+    else:
+        changed = deregister_server(server)
+    return jsonify({"url": server, "changed": changed, "servers": servers})
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+@app.route('/stats', methods=['GET'])
+def proxy_stats():
+    """Latency and error rate of requests proxied in the last `window` seconds"""
+    window = request.args.get('window', STATS_DEFAULT_WINDOW, type=float)
+    cutoff = time.time() - window
+    recent = [entry for entry in list(proxy_log) if entry[0] >= cutoff]
+    latencies = sorted(latency for _, latency, status in recent if status < 500)
+    errors = sum(1 for _, _, status in recent if status >= 500)
+    return jsonify({
+        "window": window,
+        "requests": len(recent),
+        "throughput": len(recent) / window if window > 0 else 0.0,
+        "error_rate": errors / len(recent) if recent else 0.0,
+        "p50_latency": percentile(latencies, 0.50),
+        "p99_latency": percentile(latencies, 0.99),
+        "servers": len(servers),
+        "admission": {**fair_scheduler.metrics(), **client_registry.metrics(),
+                      "client_rate_limit": CLIENT_RATE_LIMIT, "client_burst": CLIENT_BURST}
+    })
+
+@app.route('/clients', methods=['GET'])
+def client_stats():
+    """Per-client admission counters: rate limited, rejected for a full queue, timed out waiting"""
+    clients = set(rate_limiter.limited) | set(fair_scheduler.queue_full) | set(fair_scheduler.timed_out)
+    return jsonify({
+        client: {
+            "weight": CLIENT_WEIGHTS.get(client, 1.0),
+            "rate_limited": rate_limiter.limited.get(client, 0),
+            "queue_full": fair_scheduler.queue_full.get(client, 0),
+            "timed_out": fair_scheduler.timed_out.get(client, 0),
+            "queued": fair_scheduler.queued.get(client, 0)
+        } for client in clients
+    })
+
 @app.route('/health', methods=['GET'])
 def health_check():
     healthy_servers = sum(1 for server in servers if is_server_healthy(server))
@@ -154,4 +585,4 @@ def health_check():
     })
 
 if __name__ == "__main__":
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=PORT)
\ No newline at end of file
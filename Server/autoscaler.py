@@ -0,0 +1,207 @@
+import argparse
+import json
+import math
+import os
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from launch_cluster import LocalCluster, IN_MEMORY_DATABASE, exit_on_sigterm, wait_until_healthy
+
+# Autoscaler: runs a LocalCluster and resizes its backend pool from backend /load and load balancer /stats.
+# Scaling up needs UP_TICKS consecutive hot samples, scaling down DOWN_TICKS consecutive cold ones, and each
+# direction has its own cooldown after any scaling action, so a single noisy sample never moves the pool.
+CHECK_INTERVAL = 1.0            # Seconds between samples
+TARGET_UTILIZATION = 0.6        # Mean backend utilization the pool is sized for
+SCALE_UP_UTILIZATION = 0.8      # Hot when mean utilization exceeds this...
+SCALE_UP_QUEUE = 2.0            # ...or mean queued requests per backend exceed this...
+SCALE_UP_LATENCY = 1.0          # ...or load balancer p99 (seconds) exceeds this...
+SCALE_UP_ERROR_RATE = 0.01      # ...or more than this fraction of proxied requests failed
+SCALE_DOWN_UTILIZATION = 0.3    # Cold when mean utilization is below this with nothing queued
+UP_TICKS = 2
+DOWN_TICKS = 10
+UP_COOLDOWN = 5.0               # Seconds after any scaling action before scaling up again
+DOWN_COOLDOWN = 30.0            # Seconds after any scaling action before scaling down again
+MAX_STEP_UP = 4                 # Backends added per scale-up
+DRAIN_TIMEOUT = 30.0            # Seconds to wait for a deregistered backend to finish in-flight work
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')     # Sent to the load balancer's /servers, which shares this environment
+
+class Autoscaler:
+    """Grows and shrinks a LocalCluster's backend pool, keeping the load balancer's registry in sync"""
+    def __init__(self, cluster, min_backends, max_backends, event_log=None):
+        self.cluster = cluster
+        self.min_backends = min_backends
+        self.max_backends = max_backends
+        self.event_log = event_log
+        self.hot_ticks = 0
+        self.cold_ticks = 0
+        self.last_action = 0.0
+        self.http = requests.Session()
+        if ADMIN_TOKEN:
+            self.http.headers['X-Admin-Token'] = ADMIN_TOKEN
+
+    def sample(self):
+        """Poll every backend's /load and the load balancer's /stats"""
+        backends = list(self.cluster.backends)
+        with ThreadPoolExecutor(max_workers=max(1, min(32, len(backends)))) as pool:
+            reports = [report for report in pool.map(self.backend_load, backends) if report]
+        try:
+            lb_stats = self.http.get(f"{self.cluster.lb_url}/stats", params={"window": CHECK_INTERVAL * UP_TICKS},
+                                     timeout=2).json()
+        except requests.RequestException:
+            lb_stats = {}
+
+        count = max(1, len(reports))
+        return {
+            "backends": len(backends),
+            "utilization": sum(report.get('utilization', 0.0) for report in reports) / count,
+            "queue_depth": sum(report.get('queue_depth', 0) for report in reports) / count,
+            "p99_latency": lb_stats.get('p99_latency', 0.0),
+            "error_rate": lb_stats.get('error_rate', 0.0),
+            "throughput": lb_stats.get('throughput', 0.0)
+        }
+
+    def backend_load(self, url):
+        try:
+            return self.http.get(f"{url}/load", timeout=1).json()
+        except (requests.RequestException, ValueError):
+            return None
+
+    def hot_reason(self, sample):
+        if sample['utilization'] > SCALE_UP_UTILIZATION:
+            return "utilization"
+        if sample['queue_depth'] > SCALE_UP_QUEUE:
+            return "queue_depth"
+        if sample['p99_latency'] > SCALE_UP_LATENCY:
+            return "p99_latency"
+        if sample['error_rate'] > SCALE_UP_ERROR_RATE:
+            return "error_rate"
+        return None
+
+    def is_cold(self, sample):
+        return (sample['utilization'] < SCALE_DOWN_UTILIZATION and sample['queue_depth'] == 0
+                and sample['error_rate'] == 0 and sample['p99_latency'] <= SCALE_UP_LATENCY)
+
+    def step(self):
+        """Take one sample and scale if the hysteresis and cooldown conditions are met"""
+        sample = self.sample()
+        now = time.time()
+        reason = self.hot_reason(sample)
+        if reason:
+            self.hot_ticks += 1
+            self.cold_ticks = 0
+        elif self.is_cold(sample):
+            self.cold_ticks += 1
+            self.hot_ticks = 0
+        else:
+            self.hot_ticks = self.cold_ticks = 0
+
+        current = sample['backends']
+        if (self.hot_ticks >= UP_TICKS and current < self.max_backends
+                and now - self.last_action >= UP_COOLDOWN):
+            # Size for the target utilization; latency/error triggers without high utilization add one backend
+            wanted = math.ceil(current * sample['utilization'] / TARGET_UTILIZATION)
+            added = max(1, min(wanted - current, MAX_STEP_UP, self.max_backends - current))
+            added = self.scale_up(added)
+            if added:
+                self.record("scale_up", reason, sample, current + added)
+        elif (self.cold_ticks >= DOWN_TICKS and current > self.min_backends
+                and now - self.last_action >= DOWN_COOLDOWN):
+            if self.scale_down():
+                self.record("scale_down", "idle", sample, current - 1)
+        return sample
+
+    def update_registry(self, method, url):
+        """Register (POST) or deregister (DELETE) a backend; returns False if the load balancer did not accept it"""
+        try:
+            self.http.request(method, f"{self.cluster.lb_url}/servers", json={"url": url}, timeout=2).raise_for_status()
+            return True
+        except requests.RequestException as e:
+            print(f"{time.strftime('%H:%M:%S')} could not {method} {url} at the load balancer: {str(e)}")
+            return False
+
+    def scale_up(self, count):
+        """Start backends, wait until they answer, then register them with the load balancer.
+
+        Returns the number registered; backends that fail to start or register are stopped again.
+        """
+        urls = [self.cluster.start_backend(wait=False) for _ in range(count)]
+        added = 0
+        for url in urls:
+            if wait_until_healthy(url) and self.update_registry('POST', url):
+                added += 1
+            else:
+                self.cluster.stop_backend(url)
+        self.last_action = time.time()
+        return added
+
+    def scale_down(self):
+        """Deregister the newest backend, let its in-flight requests finish, then stop it.
+
+        Returns False, leaving the backend running, if the load balancer did not deregister it.
+        """
+        url = list(self.cluster.backends)[-1]
+        if not self.update_registry('DELETE', url):
+            self.last_action = time.time()
+            return False
+        deadline = time.time() + DRAIN_TIMEOUT
+        while time.time() < deadline:
+            report = self.backend_load(url)
+            if not report or (report.get('load', 0) == 0 and report.get('queue_depth', 0) == 0):
+                break
+            time.sleep(0.2)
+        self.cluster.stop_backend(url)
+        self.last_action = time.time()
+        return True
+
+    def record(self, action, reason, sample, backends):
+        """Print a scaling event and append it to the event log, for lining up with client results"""
+        event = {"time": time.time(), "action": action, "reason": reason, "backends": backends, **{
+            key: sample[key] for key in ('utilization', 'queue_depth', 'p99_latency', 'error_rate', 'throughput')
+        }}
+        print(f"{time.strftime('%H:%M:%S')} {action}: {sample['backends']} -> {backends} backends "
+              f"({reason}, util {sample['utilization']:.2f}, queue {sample['queue_depth']:.1f}, "
+              f"p99 {sample['p99_latency']:.3f}s, errors {sample['error_rate']:.1%})")
+        if self.event_log:
+            with open(self.event_log, 'a') as f:
+                f.write(json.dumps(event) + "\n")
+
+    def run(self):
+        while True:
+            started = time.time()
+            self.step()
+            time.sleep(max(0.0, CHECK_INTERVAL - (time.time() - started)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local cluster whose backend pool follows observed load")
+    parser.add_argument('--min-backends', type=int, default=1)
+    parser.add_argument('--max-backends', type=int, default=16)
+    parser.add_argument('--base-port', type=int, default=5001, help="Port of the first backend")
+    parser.add_argument('--lb-port', type=int, default=5000, help="Load balancer port")
+    parser.add_argument('--database-url', default='mongodb://localhost:27017/loadbalancer',
+                        help="MongoDB URL shared by all backends")
+    parser.add_argument('--in-memory', action='store_true',
+                        help="Give each backend a private in-memory database (mongomock) instead of MongoDB")
+    parser.add_argument('--event-log', help="Append scaling events to this JSON-lines file")
+    parser.add_argument('--log-dir', help="Directory for per-process log files")
+    args = parser.parse_args()
+    exit_on_sigterm()
+
+    cluster = LocalCluster(
+        IN_MEMORY_DATABASE if args.in_memory else args.database_url,
+        base_port=args.base_port,
+        lb_port=args.lb_port,
+        log_dir=args.log_dir
+    )
+    try:
+        lb_url = cluster.start(args.min_backends)
+        print(f"Load balancer ready at {lb_url}/request with {args.min_backends} backends "
+              f"(autoscaling up to {args.max_backends})")
+        Autoscaler(cluster, args.min_backends, args.max_backends, args.event_log).run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Stopping cluster...")
+        cluster.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+import requests
+
+# Local cluster launcher: N backends on consecutive ports plus a load balancer wired to them,
+# all as processes on this machine (no Docker needed).
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(SERVER_DIR, 'Backend')
+LOAD_BALANCER_DIR = os.path.join(SERVER_DIR, 'LoadBalancer')
+STARTUP_TIMEOUT = 30        # Seconds to wait for a process to answer /health
+IN_MEMORY_DATABASE = 'mongomock://'
+
+def wait_until_healthy(url, timeout=STARTUP_TIMEOUT):
+    """Poll a /health endpoint until the process answers, whatever its status"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(f"{url}/health", timeout=1)
+            return True
+        except requests.RequestException:
+            time.sleep(0.2)
+    return False
+
+def exit_on_sigterm():
+    """Turn SIGTERM into a normal exit so `finally` blocks shut the cluster's processes down"""
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+class LocalCluster:
+    """Backend and load balancer processes on one machine, one port each"""
+    def __init__(self, database_url, base_port=5001, lb_port=5000, async_mode=False,
+                 backend_env=None, log_dir=None):
+        self.database_url = database_url
+        self.base_port = base_port
+        self.lb_port = lb_port
+        self.async_mode = async_mode
+        self.backend_env = backend_env or {}
+        self.log_dir = log_dir
+        self.backends = {}          # Backend URL -> process
+        self.load_balancer = None
+        self.next_index = 1
+
+    @property
+    def lb_url(self):
+        return f"http://127.0.0.1:{self.lb_port}"
+
+    def spawn(self, name, script, cwd, env):
+        """Start a Python process, logging to <log_dir>/<name>.log when a log directory is set"""
+        output = subprocess.DEVNULL
+        if self.log_dir:
+            os.makedirs(self.log_dir, exist_ok=True)
+            output = open(os.path.join(self.log_dir, f"{name}.log"), 'a')
+        return subprocess.Popen([sys.executable, script], cwd=cwd, env={**os.environ, **env},
+                                stdout=output, stderr=subprocess.STDOUT)
+
+    def start_backend(self, wait=True):
+        """Start the next backend on its own port and return its URL"""
+        index = self.next_index
+        self.next_index += 1
+        port = self.base_port + index - 1
+        name = f"Server-{index}"
+        script = 'async_server.py' if self.async_mode else 'server.py'
+        process = self.spawn(name, script, BACKEND_DIR, {
+            'SERVER_NAME': name,
+            'PORT': str(port),
+            'DATABASE_URL': self.database_url,
+            **self.backend_env
+        })
+        url = f"http://127.0.0.1:{port}"
+        self.backends[url] = process
+        if wait and not wait_until_healthy(url):
+            raise RuntimeError(f"{name} did not start on port {port}")
+        return url
+
+    def stop_backend(self, url):
+        """Terminate a backend process"""
+        process = self.backends.pop(url)
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    def start_load_balancer(self):
+        """Start the load balancer with every running backend registered"""
+        self.load_balancer = self.spawn('LoadBalancer', 'loadbalancer.py', LOAD_BALANCER_DIR, {
+            'BACKEND_SERVERS': ','.join(self.backends),
+            'PORT': str(self.lb_port)
+        })
+        if not wait_until_healthy(self.lb_url):
+            raise RuntimeError(f"Load balancer did not start on port {self.lb_port}")
+        return self.lb_url
+
+    def start(self, backends):
+        """Start the requested number of backends, then the load balancer"""
+        for _ in range(backends):
+            self.start_backend(wait=False)
+        for url in self.backends:
+            if not wait_until_healthy(url):
+                raise RuntimeError(f"Backend {url} did not start")
+        return self.start_load_balancer()
+
+    def shutdown(self):
+        for url in list(self.backends):
+            self.stop_backend(url)
+        if self.load_balancer:
+            self.load_balancer.terminate()
+            self.load_balancer.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run N backends and a load balancer as local processes")
+    parser.add_argument('--backends', type=int, default=4, help="Number of backend servers")
+    parser.add_argument('--base-port', type=int, default=5001, help="Port of the first backend")
+    parser.add_argument('--lb-port', type=int, default=5000, help="Load balancer port")
+    parser.add_argument('--database-url', default='mongodb://localhost:27017/loadbalancer',
+                        help="MongoDB URL shared by all backends")
+    parser.add_argument('--in-memory', action='store_true',
+                        help="Give each backend a private in-memory database (mongomock) instead of MongoDB")
+    parser.add_argument('--async-mode', action='store_true', help="Run backends with async_server.py")
+    parser.add_argument('--processes', type=int, default=1, help="SERVER_PROCESSES for each backend")
+    parser.add_argument('--log-dir', help="Directory for per-process log files")
+    parser.add_argument('--enable-faults', action='store_true',
+                        help="Serve /admin/faults on the backends (set ADMIN_TOKEN too: they listen on all interfaces)")
+    args = parser.parse_args()
+    exit_on_sigterm()
+
+    cluster = LocalCluster(
+        IN_MEMORY_DATABASE if args.in_memory else args.database_url,
+        base_port=args.base_port,
+        lb_port=args.lb_port,
+        async_mode=args.async_mode,
+        backend_env={'SERVER_PROCESSES': str(args.processes), **({'ENABLE_FAULTS': '1'} if args.enable_faults else {})},
+        log_dir=args.log_dir
+    )
+    try:
+        print(f"Starting {args.backends} backends on ports {args.base_port}-{args.base_port + args.backends - 1}...")
+        lb_url = cluster.start(args.backends)
+        print(f"Load balancer ready at {lb_url}/request")
+        print("Press Ctrl+C to stop the cluster")
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Stopping cluster...")
+        cluster.shutdown()
+
+if __name__ == "__main__":
+    main()
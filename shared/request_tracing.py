@@ -0,0 +1,175 @@
+import argparse
+import contextlib
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+# End-to-end request tracing. The client gives every request an ID, sent in REQUEST_ID_HEADER and
+# passed on by the load balancer to the backend. Each tier times its work on the request as named
+# spans and returns their totals in a Server-Timing header; the load balancer puts its own in front
+# of the backend's, so the client sees every hop. With SPAN_FILE set, a tier also appends each span
+# to that JSONL collector file (processes on one host can share it). The client, load balancer and
+# backend all use this module. To see where the slowest requests spent their time:
+#   python request_tracing.py spans.jsonl --slowest 5
+REQUEST_ID_HEADER = 'X-Request-ID'
+TIMING_HEADER = 'Server-Timing'
+SPAN_FILE = os.environ.get('SPAN_FILE')
+
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+def new_request_id():
+    return uuid.uuid4().hex
+
+class SpanWriter:
+    """Appends spans to a JSONL file from a background thread started in each process that writes"""
+    def __init__(self, path):
+        self.path = path
+        self.pid = None
+        self.entries = None
+        self.lock = threading.Lock()
+
+    def write(self, spans):
+        if self.pid != os.getpid():     # First write, or first since this process was forked
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.entries = queue.Queue()
+                    threading.Thread(target=self.write_entries, daemon=True).start()
+                    self.pid = os.getpid()
+        self.entries.put(spans)
+
+    def write_entries(self):
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        while True:
+            spans = self.entries.get()
+            # One O_APPEND write per request keeps lines from different processes whole
+            os.write(fd, "".join(json.dumps(span) + "\n" for span in spans).encode())
+            self.entries.task_done()
+
+    def flush(self):
+        """Wait until this process's spans are written"""
+        if self.pid == os.getpid():
+            self.entries.join()
+
+span_writer = SpanWriter(SPAN_FILE) if SPAN_FILE else None
+
+class RequestTrace:
+    """Spans one tier records for one request; finish() adds the tier's total as '<tier>.request'"""
+    def __init__(self, request_id, tier):
+        self.request_id = request_id or new_request_id()
+        self.tier = tier
+        self.started = time.time()
+        self.spans = []     # (name, start time, seconds)
+
+    def add(self, name, start, seconds):
+        self.spans.append((name, start, seconds))
+
+    @contextlib.contextmanager
+    def span(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.time() - start)
+
+    def totals(self):
+        """Seconds per span name, summed over repeated spans such as one health probe per backend"""
+        totals = {}
+        for name, _, seconds in self.spans:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def server_timing(self, downstream=None):
+        """Server-Timing value for this tier's spans, followed by those of the tier it called"""
+        entries = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.totals().items()]
+        if downstream:
+            entries.append(downstream)
+        return ", ".join(entries)
+
+    def finish(self):
+        self.add(f"{self.tier}.request", self.started, time.time() - self.started)
+        if span_writer:
+            span_writer.write([{"request_id": self.request_id, "tier": self.tier, "span": name,
+                                "start": start, "duration": seconds} for name, start, seconds in self.spans])
+
+@contextlib.contextmanager
+def activate(trace):
+    """Make `trace` the one span() records to in this thread or task"""
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+
+def span(name):
+    """Time a block as a span of the active trace; does nothing outside a traced request"""
+    trace = current_trace.get()
+    return trace.span(name) if trace is not None else contextlib.nullcontext()
+
+def parse_server_timing(value):
+    """Seconds per metric name in a Server-Timing header value"""
+    totals = {}
+    for entry in (value or '').split(','):
+        name, *params = entry.strip().split(';')
+        for param in params:
+            key, _, number = param.strip().partition('=')
+            if name and key == 'dur':
+                try:
+                    totals[name] = totals.get(name, 0.0) + float(number) / 1000
+                except ValueError:
+                    pass
+    return totals
+
+def network_spans(totals):
+    """Time between tiers: each caller's wait for the callee minus the time the callee reports"""
+    derived = {}
+    if 'client.request' in totals:
+        callee = totals.get('lb.request', totals.get('server.request'))
+        if callee is not None:
+            derived['client.network'] = max(0.0, totals['client.request'] - callee)
+    if 'lb.upstream' in totals and 'server.request' in totals:
+        derived['lb.network'] = max(0.0, totals['lb.upstream'] - totals['server.request'])
+    return derived
+
+def read_spans(path):
+    """Spans in a collector file grouped by request ID"""
+    requests = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                span = json.loads(line)
+                requests.setdefault(span["request_id"], []).append(span)
+    return requests
+
+def print_waterfall(request_id, spans):
+    """Every span of one request, by start time, with offsets from the request's first span"""
+    spans = sorted(spans, key=lambda span: (span["start"], -span["duration"]))
+    origin = spans[0]["start"]
+    print(f"\nRequest {request_id}")
+    for span in spans:
+        print(f"  +{(span['start'] - origin) * 1000:9.1f}ms {span['duration'] * 1000:9.1f}ms  {span['span']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Show per-request span waterfalls from a span collector file")
+    parser.add_argument('path', help="Collector file written with SPAN_FILE")
+    parser.add_argument('--request-id', help="Show this request")
+    parser.add_argument('--slowest', type=int, default=5, help="Otherwise show this many slowest requests")
+    args = parser.parse_args()
+
+    requests = read_spans(args.path)
+    if args.request_id:
+        if args.request_id not in requests:
+            parser.error(f"no spans for request {args.request_id}")
+        print_waterfall(args.request_id, requests[args.request_id])
+        return
+
+    def elapsed(spans):
+        return max(span["start"] + span["duration"] for span in spans) - min(span["start"] for span in spans)
+    for request_id in sorted(requests, key=lambda request_id: elapsed(requests[request_id]), reverse=True)[:args.slowest]:
+        print_waterfall(request_id, requests[request_id])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Request/response body encoding shared by the client, load balancer and servers.
+# JSON is always available; msgpack is used when installed and asked for through
+# Content-Type/Accept, and large bodies are gzip-compressed when the peer accepts it.
+import base64
+import gzip
+import json
+
+try:
+    import msgpack
+except ImportError:  # Fall back to JSON only
+    msgpack = None
+
+JSON_TYPE = 'application/json'
+MSGPACK_TYPE = 'application/msgpack'
+COMPRESSION_THRESHOLD = 8192  # Bodies at least this many bytes are compressed when accepted
+GZIP_MAGIC = b'\x1f\x8b'
+
+class UnsupportedFormat(Exception):
+    """The body uses an encoding this process cannot decode"""
+
+def encode_bytes(value):
+    """JSON fallback for binary fields such as typed array buffers: base64 text"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(value).decode('ascii')
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def is_msgpack(content_type):
+    return bool(content_type) and 'msgpack' in content_type
+
+def negotiate(accept):
+    """Pick the response content type for an Accept header"""
+    if msgpack is not None and is_msgpack(accept):
+        return MSGPACK_TYPE
+    return JSON_TYPE
+
+def dumps(payload, content_type=JSON_TYPE):
+    if is_msgpack(content_type):
+        if msgpack is None:
+            raise UnsupportedFormat(content_type)
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload, default=encode_bytes).encode()
+
+def loads(body, content_type=JSON_TYPE, content_encoding=None):
+    """Decode a body, undoing gzip unless the HTTP stack already did"""
+    if content_encoding == 'gzip' and body[:2] == GZIP_MAGIC:
+        body = gzip.decompress(body)
+    if not body:
+        return None
+    if is_msgpack(content_type):
+        if msgpack is None:
+            raise UnsupportedFormat(content_type)
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(body)
+
+def compress(body, accept_encoding=None):
+    """Gzip a body above COMPRESSION_THRESHOLD if the peer accepts it; returns (body, encoding)"""
+    if len(body) >= COMPRESSION_THRESHOLD and 'gzip' in (accept_encoding or ''):
+        return gzip.compress(body, compresslevel=1), 'gzip'
+    return body, None
+
+def encode_response(payload, accept=None, accept_encoding=None):
+    """Encode a response body in the negotiated format; returns (body, headers)"""
+    content_type = negotiate(accept)
+    body, encoding = compress(dumps(payload, content_type), accept_encoding)
+    headers = {'Content-Type': content_type}
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return body, headers
+
+def encode_request(payload, content_type=JSON_TYPE, compress_body=True):
+    """Encode a request body and the headers asking for the same format back"""
+    if content_type == MSGPACK_TYPE and msgpack is None:
+        content_type = JSON_TYPE
+    body = dumps(payload, content_type)
+    headers = {'Content-Type': content_type, 'Accept': content_type, 'Accept-Encoding': 'gzip'}
+    if compress_body:
+        body, encoding = compress(body, 'gzip')
+        if encoding:
+            headers['Content-Encoding'] = encoding
+    return body, headers